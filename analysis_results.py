@@ -0,0 +1,29 @@
+"""
+Helpers for the text results of the GPT-5 analyses (analyze_text, analyze_image).
+
+Analyses are returned as strings: JSON on success, the model's plain-text answer when it did not
+follow the prompt, or an error message when the call failed. Only the last kind makes a result
+degraded (not cached, deduplicated or persisted). Shared by the extraction and email pipeline
+modules, so neither imports the other just for this check.
+"""
+from typing import Any
+
+
+# returned by analyze_text / analyze_image (and the image wrappers in extract_text.py) instead of an
+# answer when the call itself failed: 429, timeouts, client or prompt errors. A retry can succeed.
+FAILURE_PREFIXES = (
+    "GPT-5 completion failed:",
+    "GPT-5 Image completion failed:",
+    "Failed to get GPT-5 client:",
+    "Failed to prepare GPT-5 request:",
+    "Failed to load GPT-5 prompt file:",
+    "Image analysis failed:",
+)
+
+
+def is_failed_analysis(text: Any) -> bool:
+    """
+    True for the error message of a failed model call. A plain-text answer of the model (a refusal,
+    a description instead of JSON) is a result like any other and is kept, cached and persisted.
+    """
+    return isinstance(text, str) and text.startswith(FAILURE_PREFIXES)
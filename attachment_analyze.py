@@ -8,8 +8,6 @@ import os
 #import re
 import shutil
 #from xmlrpc import client
-from docx import Document
-import docx2txt
 import pdfplumber
 from pdf2image import convert_from_path
 from PIL import Image
@@ -19,62 +17,31 @@ import tempfile
 from urllib.parse import urlparse
 import requests
 import zipfile
-from azure.ai.vision.imageanalysis import ImageAnalysisClient
 #from azure.ai.vision.imageanalysis.models import VisualFeatures
-from azure.core.credentials import AzureKeyCredential
 #from azure.core.exceptions import HttpResponseError
-from azure.identity import DefaultAzureCredential
-import json
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 #from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.core.credentials import AzureKeyCredential
 #from azure.ai.documentintelligence.models import AnalyzeDocumentRequest
-from openai import AzureOpenAI 
-from datetime import datetime, timedelta
-from azure.storage.blob import (BlobServiceClient, generate_blob_sas, BlobSasPermissions)
+from datetime import datetime
+from settings import get_settings
+from docx_reader import read_docx
+from sas import get_sas_service
+from clients import get_openai_client, get_image_analysis_client, get_blob_service_client
 import time
 import uuid
 
 
 def get_gpt5_client():
-    gpt5_endpoint = os.getenv("GPT5_ENDPOINT", "").strip()
-    gpt5_deployment = os.getenv("GPT5_DEPLOYMENT", "").strip()
-    gpt5_model_name = os.getenv("GPT5_MODEL", "").strip()
-    gpt5_key = os.getenv("GPT5_KEY", "").strip()
-    gpt5_api_version = "2024-12-01-preview"
-
-    if not gpt5_endpoint:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            gpt5_endpoint = gpt5_endpoint or settings.get("GPT5_ENDPOINT", "")
-            gpt5_deployment = gpt5_deployment or settings.get("GPT5_DEPLOYMENT", "")
-            gpt5_model_name = gpt5_model_name or settings.get("GPT5_MODEL", "")
-            gpt5_key = gpt5_key or settings.get("GPT5_KEY", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    gpt5_endpoint = settings.gpt5_endpoint
+    gpt5_deployment = settings.gpt5_deployment
+    gpt5_model_name = settings.gpt5_model
+    gpt5_key = settings.gpt5_key
+    gpt5_api_version = settings.gpt5_api_version
 
     if not gpt5_endpoint:
         raise RuntimeError("GPT5_ENDPOINT is missing")
 
-    if gpt5_key:  
-        # 🔑 Locally via API Key
-        client = AzureOpenAI(
-            api_key=gpt5_key,
-            api_version=gpt5_api_version,
-            azure_endpoint=gpt5_endpoint
-        )
-    else:  
-        # 🔐 In the cloud via Managed Identity
-        credential = DefaultAzureCredential()
-        token_provider = get_bearer_token_provider(
-            credential, "https://cognitiveservices.azure.com/.default"
-        )
-        client = AzureOpenAI(
-            api_version=gpt5_api_version,
-            azure_endpoint=gpt5_endpoint,
-            azure_ad_token_provider=token_provider
-        )
+    client = get_openai_client(gpt5_endpoint, gpt5_api_version, gpt5_key, settings.gpt5_max_retries)
 
     return {
         "client": client,
@@ -83,27 +50,14 @@ def get_gpt5_client():
     }
 def get_ai_services_client():
     
-    endpoint = os.getenv("AI_SERVICES_ENDPOINT", "").strip()
-    key = os.getenv("AI_SERVICES_KEY", "").strip()
-
-    if not endpoint:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            endpoint = endpoint or settings.get("AI_SERVICES_ENDPOINT", "")
-            key = key or settings.get("AI_SERVICES_KEY", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    endpoint = settings.ai_services_endpoint
+    key = settings.ai_services_key
 
     if not endpoint:
         raise RuntimeError("AI_SERVICES_ENDPOINT is missing")
 
-    if key:  
-        credential = AzureKeyCredential(key)
-    else:  
-        credential = DefaultAzureCredential()
-
-    client = ImageAnalysisClient(endpoint=endpoint, credential=credential)
+    client = get_image_analysis_client(endpoint, key)
     return client
 
 def to_blob_sas_url(file_input):
@@ -114,36 +68,17 @@ def to_blob_sas_url(file_input):
     Returns:
         str: SAS URL with READ permission valid for 1 hour
     """
-    # Get environment variables
-    storage_endpoint = os.getenv("STORAGE_ACCOUNT_BLOB_ENDPOINT", "").strip()
-    storage_key = os.getenv("STORAGE_ACCOUNT_KEY", "").strip()
-    container_name = os.getenv("EMAIL_ATTACHMENTS_CONTAINER", "emailattachments").strip()
-    
-    # Fallback to local.settings.json if running locally
-    if not storage_endpoint:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            storage_endpoint = storage_endpoint or settings.get("STORAGE_ACCOUNT_BLOB_ENDPOINT", "")
-            storage_key = storage_key or settings.get("STORAGE_ACCOUNT_KEY", "")
-            container_name = container_name or settings.get("EMAIL_ATTACHMENTS_CONTAINER", "emailattachments")
-        except FileNotFoundError:
-            pass
+    # Cached settings (environment, local.settings.json fallback)
+    settings = get_settings()
+    storage_endpoint = settings.storage_account_blob_endpoint
+    storage_key = settings.storage_account_key
+    container_name = settings.email_attachments_container or "emailattachments"
     
     if not storage_endpoint:
         raise RuntimeError("STORAGE_ACCOUNT_BLOB_ENDPOINT is required")
     
-    # Use key authentication if available (local), otherwise use managed identity (App Service)
-    if storage_key:
-        credential = storage_key
-    else:
-        credential = DefaultAzureCredential()
-    
-    # Create BlobServiceClient
-    blob_service_client = BlobServiceClient(
-        account_url=storage_endpoint,
-        credential=credential
-    )
+    # Shared client: key authentication if available (local), otherwise managed identity (cloud)
+    blob_service_client = get_blob_service_client(storage_endpoint, storage_key)
     
     # Determine if input is a blob URI or local file
     blob_name = None
@@ -173,46 +108,9 @@ def to_blob_sas_url(file_input):
         # Assume it's already a blob name without leading slash
         blob_name = file_input
     
-    # Generate SAS token with READ permission for 1 hour
-    # SAS generation requires account key, so we need to handle both cases
-    if storage_key:
-        sas_token = generate_blob_sas(
-            account_name=storage_endpoint.split("//")[1].split(".")[0],
-            container_name=container_name,
-            blob_name=blob_name,
-            account_key=storage_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=1)
-        )
-        # Ensure no double slashes in URL
-        base_url = storage_endpoint.rstrip("/")
-        sas_url = f"{base_url}/{container_name}/{blob_name}?{sas_token}"
-    else:
-        # When using managed identity, return the blob URL with user delegation SAS
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name,
-            blob=blob_name
-        )
-        
-        # Get user delegation key for generating SAS with managed identity
-        delegation_key = blob_service_client.get_user_delegation_key(
-            key_start_time=datetime.utcnow(),
-            key_expiry_time=datetime.utcnow() + timedelta(hours=1)
-        )
-        
-        sas_token = generate_blob_sas(
-            account_name=storage_endpoint.split("//")[1].split(".")[0],
-            container_name=container_name,
-            blob_name=blob_name,
-            user_delegation_key=delegation_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=1)
-        )
-        # Ensure no double slashes in URL
-        base_url = storage_endpoint.rstrip("/")
-        sas_url = f"{base_url}/{container_name}/{blob_name}?{sas_token}"
-    
-    return sas_url
+    # Generate SAS token with READ permission for 1 hour, signed with the account key or the
+    # cached user delegation key (sas.py)
+    return get_sas_service(storage_endpoint).blob_sas_url(container_name, blob_name, expiry_hours=1)
 
 def get_temp_dir():
     """
@@ -240,36 +138,18 @@ def download_document_to_temp(blob_uri):
         str: Path to downloaded temporary file
     """
     try:
-        # Get environment variables
-        storage_endpoint = os.getenv("STORAGE_ACCOUNT_BLOB_ENDPOINT", "").strip()
-        storage_key = os.getenv("STORAGE_ACCOUNT_KEY", "").strip()
-        container_name = os.getenv("EMAIL_ATTACHMENTS_CONTAINER", "emailattachments").strip()
-        
-        # Fallback to local.settings.json if running locally
-        if not storage_endpoint:
-            try:
-                with open("local.settings.json", "r") as fh:
-                    settings = json.load(fh)["Values"]
-                storage_endpoint = storage_endpoint or settings.get("STORAGE_ACCOUNT_BLOB_ENDPOINT", "")
-                storage_key = storage_key or settings.get("STORAGE_ACCOUNT_KEY", "")
-                container_name = container_name or settings.get("EMAIL_ATTACHMENTS_CONTAINER", "emailattachments")
-            except FileNotFoundError:
-                pass
+        # Cached settings (environment, local.settings.json fallback)
+        settings = get_settings()
+        storage_endpoint = settings.storage_account_blob_endpoint
+        storage_key = settings.storage_account_key
+        container_name = settings.email_attachments_container or "emailattachments"
         
         if not storage_endpoint:
             raise RuntimeError("STORAGE_ACCOUNT_BLOB_ENDPOINT is required")
         
-        # Use key authentication if available (local), otherwise use managed identity (cloud)
-        if storage_key:
-            credential = storage_key
-        else:
-            credential = DefaultAzureCredential()
-        
-        # Create BlobServiceClient
-        blob_service_client = BlobServiceClient(
-            account_url=storage_endpoint,
-            credential=credential
-        )
+        # Shared client: key authentication if available (local), otherwise managed identity (cloud)
+        blob_service_client = get_blob_service_client(storage_endpoint, storage_key,
+                                                      max_chunk_get_size=settings.download_chunk_bytes)
         
         # Parse blob URI
         blob_name = None
@@ -293,11 +173,22 @@ def download_document_to_temp(blob_uri):
         temp_dir = get_temp_dir()
         _, ext = os.path.splitext(blob_name)
         
-        # Download to temp file
+        # Stream to temp file: ranged GETs of DOWNLOAD_CHUNK_BYTES, fetched in parallel for large blobs
+        concurrency = max(1, settings.download_max_concurrency)
         with tempfile.NamedTemporaryFile(delete=False, suffix=ext, dir=temp_dir) as tmp_file:
-            download_stream = blob_client.download_blob()
-            tmp_file.write(download_stream.readall())
             temp_path = tmp_file.name
+            try:
+                download_stream = blob_client.download_blob(max_concurrency=concurrency)
+                if concurrency > 1:
+                    # parallel ranges written at their offsets straight into the file
+                    download_stream.readinto(tmp_file)
+                else:
+                    for chunk in download_stream.chunks():
+                        tmp_file.write(chunk)
+            except Exception:
+                tmp_file.close()
+                os.remove(temp_path)
+                raise
         
         logging.info(f"Downloaded {blob_uri} to {temp_path}")
         return temp_path
@@ -315,24 +206,16 @@ def get_image_url(blob_uri):
     Returns:
         str: URL for image processing
     """
-    storage_key = os.getenv("STORAGE_ACCOUNT_KEY", "").strip()
-    
-    # Fallback to local.settings.json
-    if not storage_key:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            storage_key = storage_key or settings.get("STORAGE_ACCOUNT_KEY", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    storage_key = settings.storage_account_key
     
     # If running locally with key, generate SAS URL
     if storage_key:
         return to_blob_sas_url(blob_uri)
     
     # In cloud with managed identity, construct blob URL
-    storage_endpoint = os.getenv("STORAGE_ACCOUNT_BLOB_ENDPOINT", "").strip()
-    container_name = os.getenv("EMAIL_ATTACHMENTS_CONTAINER", "emailattachments").strip()
+    storage_endpoint = settings.storage_account_blob_endpoint
+    container_name = settings.email_attachments_container or "emailattachments"
     
     blob_name = blob_uri.lstrip("/").split("/", 1)[-1]
     return f"{storage_endpoint.rstrip('/')}/{container_name}/{blob_name}"
@@ -346,18 +229,14 @@ def extract_docx(file_path):
         dict: Extracted content and metadata
     """
     try:
-        # Extract text
-        doc = Document(file_path)
-        text = docx2txt.extract(file_path)
-        
-        # Extract structured content
-        doc = Document(file_path)
-        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+        # one parse for text, paragraphs and tables
+        content = read_docx(file_path)
         
         return {
             "type": "docx",
-            "text": text,
-            "paragraphs": paragraphs,
+            "text": content.text,
+            "paragraphs": content.paragraphs,
+            "tables": content.tables,
             "status": "success"
         }
     except Exception as e:
@@ -0,0 +1,96 @@
+"""
+Microbenchmark of the single-pass DOCX reader (docx_reader.py) against the previous extraction path.
+
+Baseline: zipfile.is_zipfile + ZipFile validation, Document() for paragraphs/tables and
+docx2txt.process() writing the embedded images to a temp dir that is then read back.
+Single pass: read_docx() on the same file.
+Per document it reports the median time of both paths over --repeat runs and checks that both
+return the same paragraphs, tables and image bytes.
+
+Usage:
+    python benchmarks/bench_docx_reader.py claim_letter.docx data/samples/*.docx [--repeat 20] [--memory]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="DOCX files")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per document and path")
+    parser.add_argument("--memory", action="store_true", help="read_docx from a BytesIO instead of the path")
+    return parser.parse_args()
+
+
+def _baseline(path):
+    """The DOCX branch of extract_file_info before docx_reader.py: three opens of the archive."""
+    import docx2txt
+    from docx import Document
+
+    if not zipfile.is_zipfile(path):
+        raise ValueError("not a zip package")
+    with zipfile.ZipFile(path) as archive:
+        if "word/document.xml" not in {name.lower() for name in archive.namelist()}:
+            raise ValueError("missing document content")
+    doc = Document(path)
+    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+    tables = [[[cell.text.strip() for cell in row.cells] for row in table.rows] for table in doc.tables]
+    img_dir = tempfile.mkdtemp(prefix="docx_images_")
+    try:
+        docx2txt.process(path, img_dir)
+        media = []
+        for name in sorted(os.listdir(img_dir)):
+            with open(os.path.join(img_dir, name), "rb") as fh:
+                media.append((name, fh.read()))
+    finally:
+        shutil.rmtree(img_dir, ignore_errors=True)
+    return paragraphs, tables, media
+
+
+def _single_pass(source):
+    from docx_reader import read_docx
+    content = read_docx(source)
+    return content.paragraphs, content.tables, content.media
+
+
+def _median_ms(func, repeat):
+    timings = []
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    args = _parse_args()
+    print(f"{'document':<40}{'baseline ms':>13}{'single ms':>11}{'speedup':>9}{'images':>8}  same")
+    totals = [0.0, 0.0]
+    for path in args.paths:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        source = (lambda: BytesIO(data)) if args.memory else (lambda: path)
+        base_ms, base = _median_ms(lambda: _baseline(path), args.repeat)
+        new_ms, new = _median_ms(lambda: _single_pass(source()), args.repeat)
+        # docx2txt extracts every word/media entry, read_docx only the images the package references
+        same = base[0] == new[0] and base[1] == new[1] and {m[1] for m in new[2]} <= {m[1] for m in base[2]}
+        totals[0] += base_ms
+        totals[1] += new_ms
+        print(f"{os.path.basename(path)[:39]:<40}{base_ms:>13.1f}{new_ms:>11.1f}"
+              f"{base_ms / new_ms if new_ms else 0:>8.1f}x{len(new[2]):>8}  {'yes' if same else 'NO'}")
+    if totals[1]:
+        print(f"{'total':<40}{totals[0]:>13.1f}{totals[1]:>11.1f}{totals[0] / totals[1]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
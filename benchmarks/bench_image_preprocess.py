@@ -0,0 +1,125 @@
+"""
+Benchmark of the image preprocessing stage (image_preprocess.py) against the previous payloads.
+
+Baseline: PDF pages rendered at 200 DPI and saved as lossless PNG, image attachments sent as-is.
+Preprocessed: PDF pages rendered at PDF_RASTER_DPI, then downscaled / grayscale / JPEG-WebP.
+Per page it reports payload bytes, preprocessing time and estimated GPT-5 vision input tokens.
+With --live both payloads are also sent to GPT-5 (credentials from local.settings.json) and the
+call latency is reported.
+
+Usage:
+    python benchmarks/bench_image_preprocess.py claim_pack.pdf photo.jpg [--max-edge 1600] [--live]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASELINE_DPI = 200
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="PDF or image files")
+    parser.add_argument("--dpi", type=int, help="PDF_RASTER_DPI for the preprocessed run")
+    parser.add_argument("--max-edge", type=int, help="IMAGE_MAX_EDGE")
+    parser.add_argument("--format", help="IMAGE_FORMAT (JPEG or WEBP)")
+    parser.add_argument("--quality", type=int, help="IMAGE_QUALITY")
+    parser.add_argument("--live", action="store_true", help="also time real GPT-5 vision calls")
+    return parser.parse_args()
+
+
+def _apply_overrides(args):
+    overrides = {"PDF_RASTER_DPI": args.dpi, "IMAGE_MAX_EDGE": args.max_edge,
+                 "IMAGE_FORMAT": args.format, "IMAGE_QUALITY": args.quality}
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+
+def _baseline_pages(path):
+    """(label, PIL image or raw bytes) as the code sent them before preprocessing."""
+    from pdf2image import convert_from_path
+    if path.lower().endswith(".pdf"):
+        for number, page in enumerate(convert_from_path(path, dpi=BASELINE_DPI), start=1):
+            yield f"{os.path.basename(path)} p{number}", page
+    else:
+        with open(path, "rb") as fh:
+            yield os.path.basename(path), fh.read()
+
+
+def _new_pages(path, dpi):
+    from pdf2image import convert_from_path
+    if path.lower().endswith(".pdf"):
+        yield from convert_from_path(path, dpi=dpi)
+    else:
+        with open(path, "rb") as fh:
+            yield fh.read()
+
+
+def _png_bytes(page):
+    if isinstance(page, bytes):
+        return page
+    buffer = BytesIO()
+    page.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _dimensions_and_mime(data):
+    from PIL import Image
+    with Image.open(BytesIO(data)) as img:
+        return img.size, Image.MIME.get(img.format or "", "image/png")
+
+
+def _timed_call(payload, mime):
+    from extract_text import _to_data_url, analyze_image
+    url = _to_data_url(payload, mime, max_bytes=len(payload))
+    start = time.perf_counter()
+    analyze_image(url)
+    return time.perf_counter() - start
+
+
+def main():
+    args = _parse_args()
+    _apply_overrides(args)
+    from image_preprocess import prepare_image_payload
+    from settings import get_settings
+    from tokens import estimate_image_tokens
+
+    settings = get_settings()
+    print(f"max_edge={settings.image_max_edge} format={settings.image_format} "
+          f"quality={settings.image_quality} dpi {BASELINE_DPI} -> {settings.pdf_raster_dpi}")
+    header = f"{'page':<32}{'bytes before':>14}{'bytes after':>13}{'prep ms':>9}{'tok before':>12}{'tok after':>11}"
+    if args.live:
+        header += f"{'s before':>10}{'s after':>9}"
+    print(header)
+
+    totals = [0, 0, 0.0, 0, 0]
+    for path in args.paths:
+        for (label, old_page), new_page in zip(_baseline_pages(path), _new_pages(path, settings.pdf_raster_dpi)):
+            before = _png_bytes(old_page)
+            start = time.perf_counter()
+            after, mime = prepare_image_payload(new_page)
+            prep_ms = (time.perf_counter() - start) * 1000
+            size_before, mime_before = _dimensions_and_mime(before)
+            size_after, _ = _dimensions_and_mime(after)
+            tok_before = estimate_image_tokens(*size_before)
+            tok_after = estimate_image_tokens(*size_after)
+            line = f"{label[:31]:<32}{len(before):>14,}{len(after):>13,}{prep_ms:>9.1f}{tok_before:>12}{tok_after:>11}"
+            if args.live:
+                line += f"{_timed_call(before, mime_before):>10.2f}{_timed_call(after, mime):>9.2f}"
+            print(line)
+            for i, value in enumerate((len(before), len(after), prep_ms, tok_before, tok_after)):
+                totals[i] += value
+
+    if totals[0]:
+        print(f"{'total':<32}{totals[0]:>14,}{totals[1]:>13,}{totals[2]:>9.1f}{totals[3]:>12}{totals[4]:>11}")
+        print(f"payload reduction: {100 * (1 - totals[1] / totals[0]):.1f}%, "
+              f"estimated vision tokens: {totals[3]} -> {totals[4]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Local SQLite-backed result caches with size-based LRU eviction.
+
+Used to skip repeated download/OCR/GPT-5 work for content we've already processed
+(reply chains, forwarded emails, resubmitted invoices). Values are JSON documents stored
+under a content-addressed key; each namespace lives in its own table of one SQLite file
+and is trimmed to its own size limit, least recently used entries first. An optional secondary
+"aux" value (e.g. a perceptual hash) can be stored next to each entry for similarity lookups.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import get_settings
+
+
+DEFAULT_CACHE_FILE = "results.sqlite"
+
+
+class SqliteLRUCache:
+    def __init__(self, path: str, namespace: str, max_bytes: int):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", namespace):
+            raise ValueError(f"Invalid cache namespace: {namespace!r}")
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {namespace} ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " aux TEXT NULL)"
+        )
+        try:
+            # caches created before the aux column existed
+            self._conn.execute(f"ALTER TABLE {namespace} ADD COLUMN aux TEXT NULL")
+        except sqlite3.OperationalError:
+            pass
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {namespace}_last_access ON {namespace}(last_access)")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key (and mark it recently used), or None."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.namespace} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.namespace} SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any, aux: Optional[str] = None) -> None:
+        """Store a JSON-serializable value (and optional aux key), then evict LRU entries above max_bytes."""
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            logging.info(f"Cache {self.namespace}: entry {key} ({size} bytes) exceeds cache size, not stored")
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.namespace} (key, value, size, created_at, last_access, aux) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, payload, size, now, now, aux)
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.namespace}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in self._conn.execute(
+                f"SELECT key, size FROM {self.namespace} ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute(f"DELETE FROM {self.namespace} WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        logging.info(f"Cache {self.namespace}: evicted {removed} least recently used entries")
+
+    def aux_entries(self) -> List[Tuple[str, str]]:
+        """All (key, aux) pairs that have an aux value."""
+        with self._lock:
+            return self._conn.execute(f"SELECT key, aux FROM {self.namespace} WHERE aux IS NOT NULL").fetchall()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.namespace}").fetchone()
+        return {"namespace": self.namespace, "entries": entries, "bytes": total,
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.namespace}")
+
+
+def cache_file_path() -> str:
+    """SQLite file shared by the local caches (RESULT_CACHE_DIR, default <tempdir>/ai-claims-cache)."""
+    cache_dir = get_settings().cache_dir or os.path.join(tempfile.gettempdir(), "ai-claims-cache")
+    return os.path.join(cache_dir, DEFAULT_CACHE_FILE)
+
+
+_lock = threading.Lock()
+_caches: Dict[str, SqliteLRUCache] = {}
+
+
+def get_cache(namespace: str, enabled: bool, max_mb: int) -> Optional[SqliteLRUCache]:
+    if not enabled:
+        return None
+    cache = _caches.get(namespace)
+    if cache is None:
+        with _lock:
+            cache = _caches.get(namespace)
+            if cache is None:
+                try:
+                    cache = SqliteLRUCache(cache_file_path(), namespace, max_mb * 1024 * 1024)
+                except (sqlite3.Error, OSError) as exc:
+                    # caching is an optimization only, never fail the request because of it
+                    logging.warning(f"Cache {namespace} unavailable: {exc}")
+                    return None
+                _caches[namespace] = cache
+    return cache
+
+
+def get_attachment_cache() -> Optional[SqliteLRUCache]:
+    """Cache of extract_file_info results keyed by attachment content hash, None if disabled."""
+    settings = get_settings()
+    return get_cache("attachments", settings.attachment_cache_enabled, settings.attachment_cache_max_mb)
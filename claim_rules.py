@@ -0,0 +1,214 @@
+"""
+Local rules for claim emails that do not need a model call.
+
+Claim references start with one of the prefixes listed in the prompts (ai/gpt5_prompt.txt),
+followed by the claim number, e.g. "TPEH123456", "TAAI-000123" or "TPEH 123456".
+
+Pre-classification (RULE_CLASSIFIER_ENABLED): an attachment or email body that carries a currency amount,
+at least RULE_CLASSIFIER_MIN_MARKERS distinct invoice markers ("Invoice No", "Total due",
+"Receipt No", ...) and no quote markers, or the reverse, is classified without GPT-5. Its Summary
+is extractive (the marker lines) and marked with SummarySource "rules"; the readable summary is
+still written by a GPT-5 combine step. Analyses that agree and carry at most one GPT-5 Summary
+between them are merged locally instead of being sent back to GPT-5 (merge_analyses). Counters
+for every path are exposed by classifier_stats().
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from settings import get_settings
+
+
+CLAIM_PREFIXES = ("TPEH", "TAAI", "TEGH", "TCCHH", "THEC", "TEGC", "TAQC", "MSFTCL")
+
+CLAIM_REFERENCE_RE = re.compile(
+    r"\b(?:" + "|".join(sorted(CLAIM_PREFIXES, key=len, reverse=True)) + r")[-_/ ]?\d(?:[0-9A-Z-]*[0-9A-Z])?\b",
+    re.IGNORECASE,
+)
+
+INVOICE = "Invoice"
+QUOTE = "Quote"
+NO_VALUE = "None"
+# bump when the rules change: cached rule results of an older version are classified again
+RULES_VERSION = "3"
+SUMMARY_SOURCE = "SummarySource"
+
+# specific markers only: claim acknowledgements also say "we confirm receipt of your claim" or
+# "amount paid to date" and must go to GPT-5
+DOCUMENT_MARKERS = {
+    INVOICE: [re.compile(p, re.IGNORECASE) for p in (
+        r"\btax\s+invoice\b",
+        r"\binvoice\s*(?:no\b|number\b|#)",
+        r"\btotal\s+(?:amount\s+)?due\b",
+        r"\bamount\s+due\b",
+        r"\bbalance\s+due\b",
+        r"\breceipt\s*(?:no\b|number\b|#)",
+        r"\bpayment\s+receipt\b",
+        r"\bpaid\s+in\s+full\b",
+    )],
+    QUOTE: [re.compile(p, re.IGNORECASE) for p in (
+        r"\bquotation\b",
+        r"\bquote\s*(?:no\b|number\b|#)",
+        r"\bestimate\s*(?:no\b|number\b|#)",
+        r"\bvalid\s+(?:until|for\s+\d+\s+days)\b",
+        r"\bproposal\b",
+    )],
+}
+
+# invoices and quotes state a price: "$1,250.00", "EUR 300", "1 250,00 €", "£75"
+AMOUNT_RE = re.compile(
+    r"(?:[$€£]|\b(?:USD|EUR|GBP|AUD|NZD|CAD)\b)\s?\d[\d,. ]*\d|\d[\d,. ]*\d\s?(?:[$€£]|\b(?:USD|EUR|GBP|AUD|NZD|CAD)\b)",
+    re.IGNORECASE,
+)
+
+# lines kept for the extractive summary: the markers plus amounts and totals
+SUMMARY_LINE_RE = re.compile(r"\b(?:total|amount|balance|invoice|receipt|quot(?:e|ation)|estimate)\b", re.IGNORECASE)
+SUMMARY_MAX_CHARS = 400
+JSON_KEY_RE = re.compile(r'^[{\[\s]*"[^"]*"\s*:\s*')
+
+# classify_document answered / the document went to GPT-5 (recorded by the caller)
+RULES = "rules"
+GPT = "gpt"
+# merge_analyses answered (EMPTY: nothing to merge) / a GPT-5 combine call follows
+MERGED = "merged"
+EMPTY = "empty"
+COMBINED = "combined"
+
+_stats_lock = threading.Lock()
+_counts = {RULES: 0, GPT: 0, MERGED: 0, EMPTY: 0, COMBINED: 0}
+
+
+def record(outcome: str) -> None:
+    with _stats_lock:
+        _counts[outcome] += 1
+
+
+def _ratio(part: int, total: int) -> float:
+    return round(part / total, 3) if total else 0.0
+
+
+def classifier_stats() -> Dict[str, Any]:
+    """
+    How often each path was taken. fast_path_ratio: share of documents classified by the rules
+    instead of GPT-5; merge_ratio: share of combine steps merged locally instead of by GPT-5.
+    """
+    with _stats_lock:
+        counts = dict(_counts)
+    counts["fast_path_ratio"] = _ratio(counts[RULES], counts[RULES] + counts[GPT])
+    local_merges = counts[MERGED] + counts[EMPTY]
+    counts["merge_ratio"] = _ratio(local_merges, local_merges + counts[COMBINED])
+    return counts
+
+
+def normalize_claim_reference(reference: str) -> str:
+    """
+    Canonical claim number: upper-cased, separators removed ("tpeh-123" and "TPEH 123" -> "TPEH123").
+    Used for Claims.ClaimNumber and every lookup of it.
+    """
+    match = CLAIM_REFERENCE_RE.search(reference)
+    value = match.group(0) if match else reference
+    return re.sub(r"[-_/\s]", "", value).upper()
+
+
+def find_claim_reference(*texts: Optional[str]) -> Optional[str]:
+    """First claim reference in texts (searched in order), normalized, or None."""
+    for text in texts:
+        match = CLAIM_REFERENCE_RE.search(text or "")
+        if match:
+            return normalize_claim_reference(match.group(0))
+    return None
+
+
+def _format(analysis: Dict[str, Any]) -> str:
+    """Same shape as analyze_text results: "None" values dropped, indented JSON."""
+    return json.dumps({k: v for k, v in analysis.items() if v != NO_VALUE}, ensure_ascii=False, indent=2)
+
+
+def _extractive_summary(text: str) -> str:
+    lines: List[str] = []
+    for line in text.splitlines():
+        line = JSON_KEY_RE.sub("", line.strip()).strip(" \t\"',{}[]")
+        if line and SUMMARY_LINE_RE.search(line) and line not in lines:
+            lines.append(line)
+    return "; ".join(lines)[:SUMMARY_MAX_CHARS]
+
+
+def classify_document(text: str) -> Optional[str]:
+    """
+    Analysis JSON (DocumentType, ClaimReference, Summary) when the rules are confident about the
+    document type, else None and the text goes to GPT-5.
+    """
+    settings = get_settings()
+    if not settings.rule_classifier_enabled or not text:
+        return None
+    # extraction results arrive as JSON: restore their line breaks so markers and lines are found
+    text = text.replace("\\r", "").replace("\\n", "\n").replace("\\t", " ")
+    hits = {doc_type: sum(1 for marker in markers if marker.search(text))
+            for doc_type, markers in DOCUMENT_MARKERS.items()}
+    document_type = None
+    if hits[INVOICE] >= settings.rule_classifier_min_markers and not hits[QUOTE]:
+        document_type = INVOICE
+    elif hits[QUOTE] >= settings.rule_classifier_min_markers and not hits[INVOICE]:
+        document_type = QUOTE
+    if document_type is None or not AMOUNT_RE.search(text):
+        return None
+    record(RULES)
+    return _format({
+        "DocumentType": document_type,
+        "ClaimReference": find_claim_reference(text) or NO_VALUE,
+        "Summary": _extractive_summary(text) or document_type,
+        SUMMARY_SOURCE: RULES,
+    })
+
+
+def _same(values: Iterable[Any]) -> Optional[Any]:
+    """The common value of the non-empty values, NO_VALUE when there are none; raises on a conflict."""
+    distinct = {v for v in values if v and v != NO_VALUE}
+    if len(distinct) > 1:
+        raise ValueError(f"conflicting values {sorted(distinct)}")
+    return distinct.pop() if distinct else NO_VALUE
+
+
+def merge_analyses(analyses: Iterable[Any]) -> Optional[str]:
+    """
+    Combine analysis results locally when no model judgement is needed: all are analysis JSON, their
+    DocumentType and ClaimReference do not conflict and at most one has a Summary, written by GPT-5.
+    Otherwise None, and the caller combines them with GPT-5. An extractive rule Summary always goes
+    through a GPT-5 combine, so it never becomes the final summary. No analyses merge to an empty result.
+    """
+    parsed = _parse_analyses(analyses) if get_settings().rule_classifier_enabled else None
+    merged = _merge(parsed) if parsed is not None else None
+    if merged is None:
+        record(COMBINED)
+        return None
+    record(MERGED if parsed else EMPTY)
+    return _format(merged)
+
+
+def _parse_analyses(analyses: Iterable[Any]) -> Optional[List[Dict[str, Any]]]:
+    """The analyses as dicts, None if any is not analysis JSON (a plain-text answer or an error)."""
+    parsed = []
+    for analysis in analyses:
+        try:
+            value = json.loads(analysis) if isinstance(analysis, str) else None
+        except ValueError:
+            return None
+        if not isinstance(value, dict) or "error" in value:
+            return None
+        parsed.append(value)
+    return parsed
+
+
+def _merge(parsed: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    summaries = [p["Summary"] for p in parsed if p.get("Summary") and p["Summary"] != NO_VALUE]
+    if len(summaries) > 1 or any(p.get(SUMMARY_SOURCE) == RULES for p in parsed):
+        return None
+    try:
+        return {
+            "DocumentType": _same(p.get("DocumentType") for p in parsed),
+            "ClaimReference": _same(p.get("ClaimReference") for p in parsed),
+            "Summary": summaries[0] if summaries else NO_VALUE,
+        }
+    except ValueError:
+        return None
@@ -0,0 +1,116 @@
+"""
+Process-wide registry of Azure SDK clients shared by all function invocations.
+
+Clients are created lazily on first use and reused afterwards, so the HTTP connection pools
+(keep-alive TLS sessions) and managed-identity tokens survive between requests instead of being
+rebuilt for every image, page and attachment. Creation is guarded by a lock, the clients
+themselves are safe to share between threads.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import requests
+from azure.ai.vision.imageanalysis import ImageAnalysisClient
+from azure.core.credentials import AzureKeyCredential
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from azure.storage.blob import BlobServiceClient
+from openai import AzureOpenAI
+
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+# RLock: factories may resolve other registry entries (e.g. token provider -> credential)
+_lock = threading.RLock()
+_clients: Dict[Hashable, Any] = {}
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+            logging.info(f"Client registry: created {key[0]} client")
+    return client
+
+
+def get_credential() -> DefaultAzureCredential:
+    """
+    Shared DefaultAzureCredential (Managed Identity in Azure).
+    The credential caches access tokens and only goes back to the identity endpoint
+    shortly before they expire.
+    """
+    return _get_or_create(("credential",), DefaultAzureCredential)
+
+
+def get_token_provider(scope: str = COGNITIVE_SERVICES_SCOPE) -> Callable[[], str]:
+    """Shared bearer token provider; tokens are cached until close to expiry."""
+    return _get_or_create(("token_provider", scope),
+                          lambda: get_bearer_token_provider(get_credential(), scope))
+
+
+def get_openai_client(endpoint: str, api_version: str, api_key: str = "", max_retries: int = 2) -> AzureOpenAI:
+    """
+    AzureOpenAI client for the endpoint.
+    - api_key set -> key auth (local development)
+    - otherwise -> Managed Identity via the shared token provider
+    max_retries: SDK retries with exponential backoff on 429/5xx, honouring Retry-After.
+    """
+    def factory():
+        if api_key:
+            # 🔑 Locally via API Key
+            return AzureOpenAI(api_key=api_key, api_version=api_version, azure_endpoint=endpoint,
+                               max_retries=max_retries)
+        # 🔐 In the cloud via Managed Identity
+        return AzureOpenAI(
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            azure_ad_token_provider=get_token_provider(),
+            max_retries=max_retries
+        )
+    return _get_or_create(("openai", endpoint, api_version, api_key, max_retries), factory)
+
+
+def get_blob_service_client(account_url: str, account_key: str = "",
+                            max_chunk_get_size: Optional[int] = None) -> BlobServiceClient:
+    """
+    BlobServiceClient for the account, using the storage key if given, Managed Identity otherwise.
+    max_chunk_get_size: size of the ranged GETs used by download_blob() (SDK default 4 MiB).
+    """
+    options = {"max_chunk_get_size": max_chunk_get_size} if max_chunk_get_size else {}
+    return _get_or_create(
+        ("blob", account_url.rstrip("/"), account_key, max_chunk_get_size),
+        lambda: BlobServiceClient(account_url=account_url, credential=account_key or get_credential(), **options)
+    )
+
+
+def get_image_analysis_client(endpoint: str, key: str = "") -> ImageAnalysisClient:
+    """AI Services (Vision) client, key auth if given, Managed Identity otherwise."""
+    return _get_or_create(
+        ("vision", endpoint, key),
+        lambda: ImageAnalysisClient(endpoint=endpoint,
+                                    credential=AzureKeyCredential(key) if key else get_credential())
+    )
+
+
+def get_http_session() -> requests.Session:
+    """Shared requests session for plain HTTP(S) downloads (SAS URLs), keeps connections alive."""
+    return _get_or_create(("http",), requests.Session)
+
+
+def reset_clients() -> None:
+    """Close and drop all cached clients, e.g. after configuration changes."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as exc:
+                logging.debug("Failed to close client: %s", exc)
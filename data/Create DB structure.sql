@@ -24,10 +24,14 @@ CREATE TABLE ClaimFiles (
     FileType NVARCHAR(50), -- e.g. jpg, pdf, docx
     BlobUrl NVARCHAR(500) NOT NULL, -- link to Blob storage
     ExtractedText NVARCHAR(MAX) NULL, -- OCR or AI processed text
+    ContentHash NVARCHAR(80) NULL, -- md5:<hex> of the blob, to reuse extractions for follow-up emails
     CreatedAt DATETIME2 DEFAULT SYSDATETIME(),
     FOREIGN KEY (ClaimId) REFERENCES Claims(ClaimId)
 );
 
+CREATE INDEX IX_ClaimFiles_ClaimId ON ClaimFiles (ClaimId) INCLUDE (FileName, ContentHash);
+-- existing databases: ALTER TABLE ClaimFiles ADD ContentHash NVARCHAR(80) NULL;
+
 
 CREATE TABLE ClaimEmails (
     EmailId INT IDENTITY(1,1) PRIMARY KEY,
@@ -0,0 +1,94 @@
+"""
+Single-pass DOCX reader for extract_file_info.
+
+The archive is opened and parsed once by python-docx; paragraphs, tables and the embedded media
+(word/media/*, including header/footer images) all come from that one parsed package instead of
+separate zipfile, Document() and docx2txt passes. Packages python-docx rejects (e.g. unexpected
+content types) fall back to a single raw zip read: docx2txt's XML-to-text on the main part plus
+the media entries.
+"""
+import logging
+import os
+import zipfile
+from dataclasses import dataclass, field
+from typing import BinaryIO, List, Tuple, Union
+
+from docx import Document
+from docx.opc.exceptions import PackageNotFoundError
+from docx2txt.docx2txt import xml2text
+
+
+MEDIA_PREFIX = "word/media/"
+DOCUMENT_PART = "word/document.xml"
+
+DocxSource = Union[str, BinaryIO]
+
+
+class NotWordPackageError(ValueError):
+    """The file is not a zip package at all (e.g. a legacy binary .doc)."""
+
+
+class WordStructureError(ValueError):
+    """The zip package has no main document part."""
+
+
+@dataclass
+class DocxContent:
+    paragraphs: List[str] = field(default_factory=list)
+    # table -> rows -> stripped cell texts
+    tables: List[List[List[str]]] = field(default_factory=list)
+    # (filename, bytes) of embedded images, sorted by name
+    media: List[Tuple[str, bytes]] = field(default_factory=list)
+    # True when python-docx could not parse the package and the raw zip fallback was used
+    fallback: bool = False
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.paragraphs)
+
+
+def _rewind(source: DocxSource) -> DocxSource:
+    if not isinstance(source, str):
+        source.seek(0)
+    return source
+
+
+def read_docx(source: DocxSource) -> DocxContent:
+    """
+    Read paragraphs, tables and media of a DOCX given as a local path or a binary stream.
+    Raises NotWordPackageError / WordStructureError for files that are not Word packages.
+    """
+    try:
+        doc = Document(_rewind(source))
+    except (zipfile.BadZipFile, PackageNotFoundError) as exc:
+        raise NotWordPackageError(str(exc)) from exc
+    except (KeyError, ValueError) as exc:
+        # missing [Content_Types].xml, unexpected main content type, ...
+        logging.warning(f"Failed to parse Word document, falling back to raw zip read: {exc}")
+        return _read_raw(source)
+
+    content = DocxContent()
+    content.paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+    for table in doc.tables:
+        content.tables.append([[cell.text.strip() for cell in row.cells] for row in table.rows])
+    # every part of the package was loaded with the document, images included
+    media = {}
+    for part in doc.part.package.iter_parts():
+        name = part.partname.lstrip("/")
+        if name.startswith(MEDIA_PREFIX):
+            media[os.path.basename(name)] = part.blob
+    content.media = sorted(media.items())
+    return content
+
+
+def _read_raw(source: DocxSource) -> DocxContent:
+    """Text and media straight from the zip entries, one archive open."""
+    with zipfile.ZipFile(_rewind(source)) as archive:
+        names = archive.namelist()
+        if DOCUMENT_PART not in names:
+            raise WordStructureError("Word archive missing document content")
+        text = xml2text(archive.read(DOCUMENT_PART))
+        media = sorted((os.path.basename(name), archive.read(name)) for name in names
+                       if name.startswith(MEDIA_PREFIX) and not name.endswith("/"))
+    paragraphs = [line for line in text.splitlines() if line.strip()]
+    return DocxContent(paragraphs=paragraphs, media=media, fallback=True)
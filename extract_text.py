@@ -1,24 +1,27 @@
-#import base64
+import base64
+import hashlib
 import logging
+import mimetypes
 import os
-import shutil
 import tempfile
 from urllib.parse import urlparse
-import requests
 import zipfile
-from docx import Document
-import docx2txt
-import pdfplumber
-from pdf2image import convert_from_path
-from PIL import Image
+from docx_reader import NotWordPackageError, WordStructureError, read_docx
+from pdf_extract import extract_text_layer, iter_pdf_page_images, ocr_pages
+from PIL import Image, ImageStat
 from io import BytesIO
 import contextlib
-from azure.ai.vision.imageanalysis import ImageAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AzureOpenAI 
-from datetime import datetime, timedelta
-from azure.storage.blob import (BlobServiceClient, generate_blob_sas, BlobSasPermissions)
+from settings import get_settings
+from prompts import get_prompt, TEXT_PROMPT, IMAGE_PROMPT
+from tokens import count_tokens
+from cache import get_attachment_cache
+from image_cache import get_image_cache, image_hashes, image_pixels
+from image_preprocess import prepare_image_payload
+from clients import get_openai_client, get_image_analysis_client, get_blob_service_client, get_http_session
+from sas import get_sas_service, parse_blob_uri, redact_url
+from claim_rules import GPT, RULES_VERSION, classify_document, record as record_classification
+from analysis_results import is_failed_analysis
+import threading
 import time
 import uuid
 import json
@@ -27,44 +30,17 @@ import json
 
 
 def get_gpt5_client():
-    gpt5_endpoint = os.getenv("GPT5_ENDPOINT", "").strip()
-    gpt5_deployment = os.getenv("GPT5_DEPLOYMENT", "").strip()
-    gpt5_model_name = os.getenv("GPT5_MODEL", "").strip()
-    gpt5_key = os.getenv("GPT5_KEY", "").strip()
-    gpt5_api_version = "2024-12-01-preview"
-
-    if not gpt5_endpoint:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            gpt5_endpoint = gpt5_endpoint or settings.get("GPT5_ENDPOINT", "")
-            gpt5_deployment = gpt5_deployment or settings.get("GPT5_DEPLOYMENT", "")
-            gpt5_model_name = gpt5_model_name or settings.get("GPT5_MODEL", "")
-            gpt5_key = gpt5_key or settings.get("GPT5_KEY", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    gpt5_endpoint = settings.gpt5_endpoint
+    gpt5_deployment = settings.gpt5_deployment
+    gpt5_model_name = settings.gpt5_model
+    gpt5_key = settings.gpt5_key
+    gpt5_api_version = settings.gpt5_api_version
 
     if not gpt5_endpoint:
         raise RuntimeError("GPT5_ENDPOINT is missing")
 
-    if gpt5_key:  
-        # 🔑 Locally via API Key
-        client = AzureOpenAI(
-            api_key=gpt5_key,
-            api_version=gpt5_api_version,
-            azure_endpoint=gpt5_endpoint
-        )
-    else:  
-        # 🔐 In the cloud via Managed Identity
-        credential = DefaultAzureCredential()
-        token_provider = get_bearer_token_provider(
-            credential, "https://cognitiveservices.azure.com/.default"
-        )
-        client = AzureOpenAI(
-            api_version=gpt5_api_version,
-            azure_endpoint=gpt5_endpoint,
-            azure_ad_token_provider=token_provider
-        )
+    client = get_openai_client(gpt5_endpoint, gpt5_api_version, gpt5_key, settings.gpt5_max_retries)
 
     return {
         "client": client,
@@ -72,27 +48,14 @@ def get_gpt5_client():
         "model_name": gpt5_model_name
     }
 def get_ai_services_client():
-    endpoint = os.getenv("AI_SERVICES_ENDPOINT", "").strip()
-    key = os.getenv("AI_SERVICES_KEY", "").strip()
-
-    if not endpoint:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            endpoint = endpoint or settings.get("AI_SERVICES_ENDPOINT", "")
-            key = key or settings.get("AI_SERVICES_KEY", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    endpoint = settings.ai_services_endpoint
+    key = settings.ai_services_key
 
     if not endpoint:
         raise RuntimeError("AI_SERVICES_ENDPOINT is missing")
 
-    if key:  
-        credential = AzureKeyCredential(key)
-    else:  
-        credential = DefaultAzureCredential()
-
-    client = ImageAnalysisClient(endpoint=endpoint, credential=credential)
+    client = get_image_analysis_client(endpoint, key)
     return client
 def _is_remote_path(path: str) -> bool:
     parsed = urlparse(path)
@@ -104,12 +67,80 @@ def _extract_filename(path: str) -> str:
     parsed = urlparse(path)
     return os.path.basename(parsed.path) if parsed.scheme else os.path.basename(path)
 def _download_to_temp(url: str) -> str:
+    """Stream the URL to a temp file in DOWNLOAD_CHUNK_BYTES chunks, never holding the whole body in memory."""
     suffix = os.path.splitext(urlparse(url).path)[1] or ".tmp"
+    chunk_size = max(64 * 1024, get_settings().download_chunk_bytes)
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        tmp.write(response.content)
+        try:
+            with get_http_session().get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+def _download_to_buffer(url: str, max_bytes: int):
+    """
+    Stream the URL into memory. Returns a BytesIO, or the path of a temp file when the body
+    turns out to be larger than max_bytes (what was buffered so far is moved to the file).
+    """
+    chunk_size = max(64 * 1024, get_settings().download_chunk_bytes)
+    buffer = BytesIO()
+    tmp = None
+    try:
+        with get_http_session().get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if tmp is None and buffer.tell() + len(chunk) > max_bytes:
+                    suffix = os.path.splitext(urlparse(url).path)[1] or ".tmp"
+                    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+                    tmp.write(buffer.getbuffer())
+                    buffer = None
+                    logging.info(f"Attachment exceeds {max_bytes} bytes, spooling to {tmp.name}")
+                (tmp or buffer).write(chunk)
+    except Exception:
+        if tmp is not None:
+            tmp.close()
+            os.remove(tmp.name)
+        raise
+    if tmp is not None:
+        tmp.close()
         return tmp.name
+    buffer.seek(0)
+    return buffer
+
+
+@contextlib.contextmanager
+def _open_attachment(path: str):
+    """
+    Like _ensure_local_file, but remote attachments are yielded as an in-memory BytesIO
+    (EXTRACT_IN_MEMORY) unless larger than EXTRACT_IN_MEMORY_MAX_BYTES. Local paths are yielded as-is.
+    """
+    settings = get_settings()
+    if not settings.extract_in_memory:
+        with _ensure_local_file(path) as local_path:
+            yield local_path
+        return
+    if _is_remote_path(path):
+        url = path
+    elif isinstance(path, str) and path.startswith('/'):
+        try:
+            url = ensure_remote_image_url(path)
+        except Exception as exc:
+            raise RuntimeError(f"Failed to resolve storage URI to remote URL: {exc}") from exc
+    else:
+        yield path
+        return
+    source = _download_to_buffer(url, settings.extract_in_memory_max_bytes)
+    try:
+        yield source
+    finally:
+        if isinstance(source, str) and os.path.exists(source):
+            os.remove(source)
+
 
 @contextlib.contextmanager
 def _ensure_local_file(path: str):
@@ -157,19 +188,40 @@ def _to_image_bytes(image_source):
         with open(image_source, "rb") as fh:
             return fh.read()
     raise TypeError(f"Unsupported image source type: {type(image_source)!r}")
-def _get_storage_account_url():
-    # try explicit blob endpoint first, then account name
-    url = os.getenv("STORAGE_ACCOUNT_BLOB_ENDPOINT", "").strip()
-    
-    if not url:
-        # local.settings.json fallback
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            url = url or settings.get("STORAGE_ACCOUNT_BLOB_ENDPOINT")
+def _to_data_url(payload: bytes, mime: str, max_bytes: int):
+    """
+    Base64 data URL for an encoded image, built in memory.
+    Returns None when the payload is larger than max_bytes (caller uploads it instead).
+    """
+    if len(payload) > max_bytes:
+        logging.info(f"Image of {len(payload)} bytes exceeds inline limit {max_bytes}, using blob upload")
+        return None
+    return f"data:{mime};base64,{base64.b64encode(payload).decode('ascii')}"
 
-        except Exception:
-            pass
+
+@contextlib.contextmanager
+def _temp_image_file(payload: bytes, mime: str):
+    """Write an encoded image to a temp file (blob transport), removed on exit."""
+    suffix = mimetypes.guess_extension(mime) or ".img"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as fh:
+        fh.write(payload)
+        tmp = fh.name
+    try:
+        yield tmp
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _describe_image_url(image_url: str) -> str:
+    """Loggable form of an image URL (data URLs are summarized, not dumped)."""
+    if image_url.startswith("data:"):
+        return f"{image_url[:image_url.find(',')]} ({len(image_url)} chars)"
+    return redact_url(image_url)
+
+
+def _get_storage_account_url():
+    url = get_settings().storage_account_blob_endpoint
     if not url:
         raise RuntimeError("Storage account URL not configured. Set STORAGE_ACCOUNT_BLOB_ENDPOINT.")
     return url
@@ -179,25 +231,8 @@ def _upload_file_to_container_and_get_sas(account_url: str, container_name: str,
 	Upload a local file to the given container and return a read-only SAS URL.
 	(Compact helper used for uploading temp images to a specific container, e.g. "tems".)
 	"""
-	account_key = os.getenv("STORAGE_ACCOUNT_KEY")
-	if not account_key:
-		try:
-			with open("local.settings.json", "r") as fh:
-				settings = json.load(fh)["Values"]
-			account_key = account_key or settings.get("STORAGE_ACCOUNT_KEY", "")
-		except FileNotFoundError:
-			pass
-
-	if account_key:
-		blob_service_client = BlobServiceClient(account_url=account_url, credential=account_key)
-		user_delegation_key = None
-	else:
-		credential = DefaultAzureCredential()
-		blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-		user_delegation_key = blob_service_client.get_user_delegation_key(
-			key_start_time=datetime.utcnow(),
-			key_expiry_time=datetime.utcnow() + timedelta(hours=expiry_hours)
-		)
+	settings = get_settings()
+	blob_service_client = get_blob_service_client(account_url, settings.storage_account_key)
 
 	# Ensure container exists
 	container_client = blob_service_client.get_container_client(container_name)
@@ -210,30 +245,8 @@ def _upload_file_to_container_and_get_sas(account_url: str, container_name: str,
 	with open(local_file, "rb") as data:
 		blob_client.upload_blob(data, overwrite=True)
 
-	account_name = blob_service_client.account_name or os.getenv("STORAGE_ACCOUNT_NAME")
-	if not account_name:
-		raise ValueError("Storage account name could not be determined")
-
-	if account_key and blob_service_client.account_name:
-		sas_token = generate_blob_sas(
-			account_name=account_name,
-			container_name=container_name,
-			blob_name=blob_name,
-			account_key=account_key,
-			permission=BlobSasPermissions(read=True),
-			expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
-		)
-	else:
-		sas_token = generate_blob_sas(
-			account_name=account_name,
-			container_name=container_name,
-			blob_name=blob_name,
-			user_delegation_key=user_delegation_key,
-			permission=BlobSasPermissions(read=True),
-			expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
-		)
-
-	return f"{blob_client.url}?{sas_token}"
+	# signed locally; the user delegation key (Managed Identity) is cached by the SAS service
+	return get_sas_service(account_url).blob_sas_url(container_name, blob_name, expiry_hours)
 
 def upload_temp_image_and_get_url(local_file_path: str, container: str = "tems") -> str:
 	"""
@@ -258,61 +271,9 @@ def ensure_remote_image_url(image_source):
         
         # Check if it's a URI path (starts with /)
         if image_source.startswith('/'):
-            account_url = _get_storage_account_url()
-            # Parse container and blob path from URI
-            parts = image_source.lstrip('/').split('/', 1)
-            if len(parts) == 2:
-                container_name, blob_path = parts
-            else:
-                raise ValueError(f"Invalid URI path format: {image_source}")
-            
-            # Generate SAS URL for existing blob
-            account_key = os.getenv("STORAGE_ACCOUNT_KEY")
-            if not account_key:
-                try:
-                    with open("local.settings.json", "r") as fh:
-                        settings = json.load(fh)["Values"]
-                    account_key = settings.get("STORAGE_ACCOUNT_KEY", "")
-                except FileNotFoundError:
-                    pass
-            
-            if account_key:
-                blob_service_client = BlobServiceClient(account_url=account_url, credential=account_key)
-                user_delegation_key = None
-            else:
-                credential = DefaultAzureCredential()
-                blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-                user_delegation_key = blob_service_client.get_user_delegation_key(
-                    key_start_time=datetime.utcnow(),
-                    key_expiry_time=datetime.utcnow() + timedelta(hours=1)
-                )
-            
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-            
-            account_name = blob_service_client.account_name or os.getenv("STORAGE_ACCOUNT_NAME")
-            if not account_name:
-                raise ValueError("Storage account name could not be determined")
-            
-            if account_key:
-                sas_token = generate_blob_sas(
-                    account_name=account_name,
-                    container_name=container_name,
-                    blob_name=blob_path,
-                    account_key=account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=1)
-                )
-            else:
-                sas_token = generate_blob_sas(
-                    account_name=account_name,
-                    container_name=container_name,
-                    blob_name=blob_path,
-                    user_delegation_key=user_delegation_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=1)
-                )
-            
-            return f"{blob_client.url}?{sas_token}"
+            # Generate SAS URL for existing blob (signed locally, no per-blob delegation key)
+            container_name, blob_path = parse_blob_uri(image_source)
+            return get_sas_service(_get_storage_account_url()).blob_sas_url(container_name, blob_path)
         
         # local file path -> upload
         account_url = _get_storage_account_url()
@@ -339,10 +300,127 @@ def ensure_remote_image_url(image_source):
                     pass
 
     raise TypeError("ensure_remote_image_url accepts HTTP URL, URI path, local filepath or PIL.Image")
-def extract_file_info(file_path, ocr_text_threshold=50):
+
+
+def remote_content_key(path: str):
+    """
+    Content key from blob metadata (Content-MD5) without downloading the attachment.
+    Returns None when the MD5 is not available.
+    """
+    try:
+        if _is_remote_path(path):
+            head = get_http_session().head(path, timeout=10)
+            md5 = head.headers.get("Content-MD5") if head.ok else None
+            md5 = base64.b64decode(md5) if md5 else None
+        elif path.startswith('/'):
+            container_name, blob_path = path.lstrip('/').split('/', 1)
+            blob_service_client = get_blob_service_client(_get_storage_account_url(), get_settings().storage_account_key)
+            props = blob_service_client.get_blob_client(container=container_name, blob=blob_path).get_blob_properties()
+            md5 = props.content_settings.content_md5
+        else:
+            return None
+    except Exception as exc:
+        logging.info(f"Content MD5 lookup failed for {redact_url(path)}: {exc}")
+        return None
+    return f"md5:{bytes(md5).hex()}" if md5 else None
+
+
+def _file_content_key(source, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 content key of a local file or an in-memory BytesIO."""
+    digest = hashlib.sha256()
+    if isinstance(source, BytesIO):
+        digest.update(source.getbuffer())
+        return f"sha256:{digest.hexdigest()}"
+    with open(source, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def extract_file_info(file_path, ocr_text_threshold=50, failures=None):
+    """
+    Analysis of one attachment (cached by content). failures, when given, is extended with the
+    pages/images whose analysis failed, i.e. the result is degraded and should not be kept.
+    """
     ext = _resolve_extension(file_path)
-    print(f"\033[93mProcessing file: {file_path} with extension {ext}\033[0m")
+    print(f"\033[93mProcessing file: {redact_url(file_path)} with extension {ext}\033[0m")
+
+    # Content-addressed cache: try the blob MD5 first (no download), else hash the downloaded file
+    cache = get_attachment_cache()
+    cache_key = remote_content_key(file_path) if cache else None
+    cached = cache.get(cache_key) if cache_key else None
+    if cached:
+        logging.info(f"Attachment cache hit for {redact_url(file_path)} ({cache_key})")
+        return _cached_analysis(cache, cache_key, cached)
+
+    # remote attachments are extracted from memory (EXTRACT_IN_MEMORY), otherwise from a temp file
+    with _open_attachment(file_path) as source:
+        if cache and not cache_key:
+            cache_key = _file_content_key(source)
+            cached = cache.get(cache_key)
+            if cached:
+                logging.info(f"Attachment cache hit for {redact_url(file_path)} ({cache_key})")
+                return _cached_analysis(cache, cache_key, cached)
+        result, complete, extract_failures = _extract_local_file(file_path, source, ext, ocr_text_threshold)
+    if failures is not None:
+        failures.extend(extract_failures)
+    if not complete:
+        return result
+
+    # ---------- Анализ текста ----------
+
+
+    analysis, rules = _analyze_extraction(result)
+    if extract_failures:
+        # degraded by a transient failure (429, timeout, ...): a retry must extract again
+        logging.warning(f"Attachment {redact_url(file_path)} not cached, image analysis failed for: {', '.join(extract_failures)}")
+    elif cache and cache_key and not is_failed_analysis(analysis):
+        cache.put(cache_key, {"extraction": result, "analysis": analysis, "rules": rules})
+    return analysis
+
+
+def _analyze_extraction(result):
+    """(analysis, rules) for an extraction result, see analyze_document_text."""
+    # Convert result dict to string for analysis
+    return analyze_document_text(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+def analyze_document_text(text):
+    """
+    (analysis, rules) for an attachment's extraction or an email body: obvious invoices / quotes are
+    classified locally (rules = RULES_VERSION), everything else goes to GPT-5 (rules = None).
+    """
+    analysis = classify_document(text)
+    if analysis is not None:
+        return analysis, RULES_VERSION
+    record_classification(GPT)
+    return analyze_text(text), None
+
+
+def _cached_analysis(cache, cache_key, cached):
+    """
+    Analysis of a cached attachment. A rule result is only valid for the current rules: with
+    RULE_CLASSIFIER_ENABLED off or after a rules change the cached extraction is analysed again.
+    """
+    rules = cached.get("rules")
+    if not rules or (get_settings().rule_classifier_enabled and rules == RULES_VERSION):
+        return cached["analysis"]
+    logging.info(f"Cached rule result {cache_key} (rules {rules}) analysed again")
+    analysis, rules = _analyze_extraction(cached["extraction"])
+    if not is_failed_analysis(analysis):
+        cache.put(cache_key, {"extraction": cached["extraction"], "analysis": analysis, "rules": rules})
+    return analysis
+
 
+def _extract_local_file(file_path, source, ext, ocr_text_threshold=50):
+    """
+    Extract digital text, tables and image OCR from a local path or an in-memory BytesIO of the
+    attachment. Embedded DOCX images are read from the parsed package, never written to disk.
+    Returns (result, complete, failures); complete is False when the file could not be processed
+    and result only carries a "Summary" explaining why. failures names the pages/images whose
+    analysis failed, such results must not be cached.
+    """
+    failures = []
     result = {
         "Digital text": "",
         "Images": []   # list with results for images
@@ -351,154 +429,127 @@ def extract_file_info(file_path, ocr_text_threshold=50):
     tables = []
     file_type = "unknown"
 
-    with _ensure_local_file(file_path) as local_path:
-        if ext in (".docx", ".doc"):
-            is_docx_package = zipfile.is_zipfile(local_path)
-            if ext == ".doc" and not is_docx_package:
+    if ext in (".docx", ".doc"):
+        # one parse of the package: paragraphs, tables and embedded images (docx_reader.py)
+        try:
+            content = read_docx(source)
+        except NotWordPackageError as exc:
+            if ext == ".doc":
                 result["Summary"] = "Unsupported legacy DOC format."
                 logging.warning("Legacy .doc format detected, which is not supported.")
-                return result
-            if is_docx_package:
-                with zipfile.ZipFile(local_path) as archive:
-                    entries = {name.lower() for name in archive.namelist()}
-                    if "word/document.xml" not in entries:
-                        print("Word archive missing document content.")
-                        result["Summary"] = "Unsupported Word archive structure."
-                        logging.warning("Word archive missing document content.")
-                        return result
-            doc = None
-            if is_docx_package:
-                try:
-                    doc = Document(local_path)
-                except ValueError as exc:
-                    print(f"Failed to parse Word document, fallback to docx2txt: {exc}")
-                    logging.warning(f"Failed to parse Word document, fallback to docx2txt: {exc}")  
-            if doc:
-                text_content = "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-                for table in doc.tables:
-                    table_data = []
-                    for row in table.rows:
-                        table_data.append([cell.text.strip() for cell in row.cells])
-                    tables.append(table_data)
-                if tables:
-                    print(f"\033[92mExtracted tables from the document: {tables}\033[0m")
-                    logging.info(f'Extracted tables from the document: {tables}')
             else:
-                print("Docx2txt fallback for text extraction.")
-                logging.info("Docx2txt fallback for text extraction.")
-                text_content = ""
-            img_dir = tempfile.mkdtemp(prefix="docx_images_")
-            try:
-                extracted_text = ""
-                try:
-                    extracted_text = docx2txt.process(local_path, img_dir)
-                except Exception as exc:
-                    print(f"Docx2txt processing failed: {exc}")
-                    logging.warning(f"Docx2txt processing failed: {exc}")   
-                    result["Summary"] = "Unable to process Word document."
-                    return result
-                if not doc and extracted_text and not text_content.strip():
-                    text_content = extracted_text
-                    logging.info(f"Extracted text from Word document: {text_content}")
-                img_files = os.listdir(img_dir)
-                for img_file in img_files:
-                    img_path = os.path.join(img_dir, img_file)
-                    try:
-                        # upload extracted image to "tems" container and get SAS URL
-                        img_url = upload_temp_image_and_get_url(img_path, container="tems")
-                        logging.info(f"Uploaded extracted image '{img_path}' -> {img_url}")
-                        ocr_text = analyze_image(img_url)
-                    except Exception as exc:
-                        print(f"Failed to upload/analyze image '{img_path}': {exc}")
-                        logging.warning(f"Failed to upload/analyze image '{img_path}': {exc}")
-                        ocr_text = ""
-
-                    print(f"Image '{img_file}' analyzed" f" with OCR text: {ocr_text}")
-                    logging.info(f"Image '{img_file}' analyzed with OCR text: {ocr_text}")  
-                    result["Images"].append({"filename": img_file, "ocr_text": ocr_text})
-            except ValueError as exc:
                 print(f"Failed to extract Word document content: {exc}")
                 result["Summary"] = "Unable to process Word document."
                 logging.warning(f"Failed to extract Word document content: {exc}")
-                return result
-            finally:
-                shutil.rmtree(img_dir, ignore_errors=True)
-                result["Digital text"] = text_content + "\n" + "\n".join([str(t) for t in tables])
-                logging.info(f'Extracted digital text length: {len(text_content)} and tables: {tables}')
-
-        # ----- PDF -----
-        elif ext == ".pdf":
-            print("PDF file detected")
-             # check for text layer
-            scanned = True
-            with pdfplumber.open(local_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text and page_text.strip():
-                        scanned = False
-                        text_content += page_text + "\n"
-                        print(f"Extracted text from page {page.page_number}: {page_text}")
-                    page_tables = page.extract_tables()
-                    for table in page_tables:
-                        tables.append(table)
-                        print(f"Extracted table from page {page.page_number}: {table}")
-
-            if not scanned:
-                file_type = "digital"
-                print(f"Document classified as {file_type}.")
-                result["Digital text"] = text_content + "\n" + "\n".join([str(t) for t in tables])
-            else:
-                print("No text layer found, performing OCR.")
-                pages = convert_from_path(local_path)
-                ocr_chunks = []
-                for page in pages:
-                    try:
-                        page_url = ensure_remote_image_url(page)
-                    except Exception as exc:
-                        print(f"Failed to ensure remote URL for PDF page image: {exc}")
-                        page_text = ""
-                    else:
-                        page_text = analyze_image(page_url)
-                        print(f"OCR text for PDF page: {page_text[:100]}...")
-                        logging.info(f"OCR text for PDF page: {page_text[:100]}...")    
-                    if page_text:
-                         ocr_chunks.append(page_text)
-                if ocr_chunks:
-                    text_content = "\n".join(ocr_chunks)
-                    file_type = "scanned"
-        # ----- Images (jpg/png) -----
-        elif ext in [".jpg", ".jpeg", ".png", ".tiff"]:
-            print("Image file detected")
-            logging.info("Image file detected")
+            return result, False, failures
+        except WordStructureError:
+            print("Word archive missing document content.")
+            result["Summary"] = "Unsupported Word archive structure."
+            logging.warning("Word archive missing document content.")
+            return result, False, failures
+        except (ValueError, zipfile.BadZipFile) as exc:
+            print(f"Failed to extract Word document content: {exc}")
+            result["Summary"] = "Unable to process Word document."
+            logging.warning(f"Failed to extract Word document content: {exc}")
+            return result, False, failures
+
+        text_content = content.text
+        tables = content.tables
+        if tables:
+            print(f"\033[92mExtracted tables from the document: {tables}\033[0m")
+            logging.info(f'Extracted tables from the document: {tables}')
+        for img_file, img_data in content.media:
             try:
-                # Ensure we obtain an HTTPS-accessible URL for the input (handles '/container/blob', local path, or PIL.Image)
-                img_url = ensure_remote_image_url(file_path)
-                logging.info(f"Image URL for initially image '{file_path}': {img_url}")
+                # on a cache miss upload extracted image to "tems" container and analyze via SAS URL
+                ocr_text = analyze_image_cached(
+                    img_data, to_url=lambda path: upload_temp_image_and_get_url(path, container="tems"),
+                    near_match=True)
             except Exception as exc:
-                print(f"Failed to ensure remote URL for image '{file_path}': {exc}")
-                logging.warning(f"Failed to ensure remote URL for image '{file_path}': {exc}")
-                ocr_text = ""
-            else:
-                ocr_text = analyze_image(img_url)
-            result["Images"].append({
-                "filename": _extract_filename(file_path),
-                "ocr_text": ocr_text
-            })
-            print(f"Image OCR text: {ocr_text[:100]}...")
-            logging.info(f"Image OCR text: {ocr_text[:100]}...")
-
-        else:
-            result["Summary"] = "Unsupported file format."
-            logging.warning("Unsupported file format encountered.")
-            return result
+                print(f"Failed to upload/analyze image '{img_file}': {exc}")
+                logging.warning(f"Failed to upload/analyze image '{img_file}': {exc}")
+                ocr_text = f"Image analysis failed: {exc}"
+            if is_failed_analysis(ocr_text):
+                failures.append(f"image {img_file}")
+
+            print(f"Image '{img_file}' analyzed" f" with OCR text: {ocr_text}")
+            logging.info(f"Image '{img_file}' analyzed with OCR text: {ocr_text}")
+            result["Images"].append({"filename": img_file, "ocr_text": ocr_text})
+        result["Digital text"] = text_content + "\n" + "\n".join([str(t) for t in tables])
+        logging.info(f'Extracted digital text length: {len(text_content)} and tables: {tables}')
+
+    # ----- PDF -----
+    elif ext == ".pdf":
+        print("PDF file detected")
+        settings = get_settings()
+        # per page: text layer if it has usable text, otherwise OCR (only those pages are rasterized)
+        page_texts, tables, scanned_pages = extract_text_layer(
+            source, min_chars=ocr_text_threshold,
+            workers=settings.pdf_process_workers or os.cpu_count() or 1,
+            parallel_min_pages=settings.pdf_parallel_min_pages)
+        for table in tables:
+            print(f"Extracted table: {table}")
+        file_type = "digital"
+        if scanned_pages:
+            file_type = "hybrid" if set(page_texts) - set(scanned_pages) else "scanned"
+            print(f"No usable text layer on pages {scanned_pages}, performing OCR.")
+            # pages are rendered a small window at a time and OCRed in parallel as soon as they are ready
+            pages = iter_pdf_page_images(source, scanned_pages, dpi=settings.pdf_raster_dpi,
+                                         window=settings.pdf_raster_window)
+            page_results = ocr_pages(pages, _ocr_page, max_workers=settings.pdf_ocr_concurrency)
+            for page_number, page_text, seconds in page_results:
+                print(f"OCR text for PDF page {page_number} ({seconds:.2f}s): {page_text[:100]}...")
+                logging.info(f"OCR text for PDF page {page_number} ({seconds:.2f}s): {page_text[:100]}...")
+                if is_failed_analysis(page_text):
+                    failures.append(f"page {page_number}")
+                elif page_text:
+                    # OCR replaces the short text layer only when it returned something
+                    page_texts[page_number] = page_text
+            logging.info(f"OCR of {len(page_results)} PDF pages, page timings: "
+                         f"{[(number, round(seconds, 2)) for number, _, seconds in page_results]}")
+
+        text_content = "\n".join(page_texts[number] for number in sorted(page_texts))
+        if page_texts or tables:
+            result["Digital text"] = text_content + "\n" + "\n".join([str(t) for t in tables])
+        print(f"Document classified as {file_type}.")
+    # ----- Images (jpg/png) -----
+    elif ext in [".jpg", ".jpeg", ".png", ".tiff"]:
+        print("Image file detected")
+        logging.info("Image file detected")
+        try:
+            # hash the downloaded copy; on a cache miss with blob transport the prepared (upright,
+            # downscaled) payload is uploaded, not the original attachment
+            image_source = source if isinstance(source, str) else source.getvalue()
+            ocr_text = analyze_image_cached(
+                image_source, to_url=lambda path: upload_temp_image_and_get_url(path, container="tems"))
+        except Exception as exc:
+            print(f"Failed to upload/analyze image '{redact_url(file_path)}': {exc}")
+            logging.warning(f"Failed to upload/analyze image '{redact_url(file_path)}': {exc}")
+            ocr_text = ""
+            failures.append("image")
+        if is_failed_analysis(ocr_text):
+            failures.append("image")
+        result["Images"].append({
+            "filename": _extract_filename(file_path),
+            "ocr_text": ocr_text
+        })
+        print(f"Image OCR text: {ocr_text[:100]}...")
+        logging.info(f"Image OCR text: {ocr_text[:100]}...")
 
-    # ---------- Анализ текста ----------
+    else:
+        result["Summary"] = "Unsupported file format."
+        logging.warning("Unsupported file format encountered.")
+        return result, False, failures
 
+    return result, True, failures
 
-    # Convert result dict to string for analysis
-    text_for_analysis = json.dumps(result, ensure_ascii=False, indent=2)
-    return analyze_text(text_for_analysis)
 
+def _ocr_page(image) -> str:
+    """analyze_image_cached for a rendered PDF page; an exception is reported like a failed GPT-5 call."""
+    try:
+        return analyze_image_cached(image)
+    except Exception as exc:
+        logging.warning(f"OCR failed for PDF page: {exc}")
+        return f"Image analysis failed: {exc}"
 
 
 # def analyze_image(image_source):
@@ -534,40 +585,6 @@ def extract_file_info(file_path, ocr_text_threshold=50):
 #     else:
 #         return str("Caption: " + caption_text)
 
-def count_tokens(model_name: str, text: str) -> int:
-    """
-    Count tokens for the given text.
-
-    Uses the tiktoken library when available (best accuracy). If tiktoken is not
-    installed or fails, falls back to a simple heuristic estimate (1 token ≈ 4 chars).
-    If a model name is configured (gpt5_model_name or gpt5_deployment) the function
-    will attempt to use tiktoken.encoding_for_model(model) to pick the proper encoding.
-    """
-    try:
-        import tiktoken  # optional dependency; import at runtime
-        model = None
-        try:
-            # prefer explicit model env vars if present
-            model = model_name
-        except NameError:
-            model = None
-
-        try:
-            if model:
-                enc = tiktoken.encoding_for_model(model)
-            else:
-                enc = tiktoken.get_encoding("cl100k_base")
-        except Exception:
-            # fallback encoding if model-specific lookup fails
-            enc = tiktoken.get_encoding("cl100k_base")
-
-        return len(enc.encode(text))
-    except Exception as exc:
-        logging.debug("tiktoken not available or failed, using heuristic token count: %s", exc)
-        # Heuristic: average ~4 characters per token for English text.
-        approx = max(1, int(len(text) / 4))
-        return approx
-    return len(text.split())
 def _clean_text_for_analysis(text: str) -> str:
     """
     Remove cid: image references and clean up malformed link patterns from text.
@@ -609,8 +626,8 @@ def analyze_text(text: str) -> str:
         client = cfg["client"]
         deployment = cfg["deployment"]
         model_name = cfg["model_name"]
-        with open('./ai/gpt5_prompt.txt', 'r') as f:
-            prompt = f.read()
+        prompt_template = get_prompt(TEXT_PROMPT)
+        prompt = prompt_template.text
     except FileNotFoundError as exc:
         logging.error("Prompt file missing: %s", exc)
         return f"Failed to load GPT-5 prompt file: {exc}"
@@ -619,7 +636,8 @@ def analyze_text(text: str) -> str:
         return f"Failed to prepare GPT-5 request: {exc}"
 
     try:
-        token_count = count_tokens(model_name, (prompt+text))
+        # prompt tokens are precomputed by the prompt registry, only the user text is encoded here
+        token_count = prompt_template.token_count(model_name) + count_tokens(model_name, text)
         logging.info(f'----------Text analysis. Prompt + text token count: {token_count}')
         response = client.chat.completions.create(
             messages=[
@@ -651,27 +669,64 @@ def analyze_text(text: str) -> str:
             
     except Exception:
         return str(response)
-def _is_image_large_enough(image_url: str, min_bytes: int = 100_000) -> bool:
+
+
+def _is_image_worth_analyzing(image_source) -> bool:
+    """
+    Local gate for a path, bytes or PIL.Image, evaluated before any upload or network call.
+    Rejects small files (logos/icons), small pixel areas (spacers) and near-uniform images
+    (blank pages) by the per-channel standard deviation of a thumbnail.
+    """
+    settings = get_settings()
     try:
-        head = requests.head(image_url, timeout=10)
-    except requests.RequestException as exc:
-        logging.warning("HEAD request failed for %s: %s", image_url, exc)
-        return False
-    size = head.headers.get("Content-Length")
-    if size is None:
-        logging.warning("Missing Content-Length for %s", image_url)
+        if isinstance(image_source, Image.Image):
+            return _is_image_content_large_enough(image_source, settings)
+        size = os.path.getsize(image_source) if isinstance(image_source, str) else len(image_source)
+        if size < settings.image_min_bytes:
+            logging.info(f"Image skipped: {size} bytes below {settings.image_min_bytes}")
+            return False
+        with Image.open(image_source if isinstance(image_source, str) else BytesIO(image_source)) as img:
+            return _is_image_content_large_enough(img, settings)
+    except Exception as exc:
+        # unreadable locally: let GPT-5 decide rather than silently dropping content
+        logging.warning(f"Local image check failed, analyzing anyway: {exc}")
+        return True
+
+
+def _is_image_content_large_enough(img: Image.Image, settings) -> bool:
+    width, height = img.size
+    if width * height < settings.image_min_pixels:
+        logging.info(f"Image skipped: {width}x{height} below {settings.image_min_pixels} pixels")
         return False
-    try:
-        return int(size) >= min_bytes
-    except ValueError:
-        logging.warning("Invalid Content-Length for %s: %s", image_url, size)
+    thumb = img.copy()
+    thumb.thumbnail((64, 64))
+    stddev = max(ImageStat.Stat(thumb.convert("RGB")).stddev)
+    if stddev < settings.image_min_stddev:
+        logging.info(f"Image skipped: near-uniform (stddev {stddev:.1f})")
         return False
+    return True
+
+
+_vision_semaphore = None
+_vision_semaphore_lock = threading.Lock()
+
+
+def _vision_slots() -> threading.BoundedSemaphore:
+    """Semaphore limiting in-flight GPT-5 vision calls to VISION_MAX_CONCURRENCY per worker process."""
+    global _vision_semaphore
+    if _vision_semaphore is None:
+        with _vision_semaphore_lock:
+            if _vision_semaphore is None:
+                _vision_semaphore = threading.BoundedSemaphore(max(1, get_settings().vision_max_concurrency))
+    return _vision_semaphore
+
 
 def analyze_image(image_url: str) -> str:
-    if not _is_image_large_enough(image_url):
-        logging.info("Image %s skipped: below size threshold.", image_url)
-        return ""
-    logging.info(f'-----------------Analyzing image URL: {image_url}')
+    """
+    OCR/caption the image at image_url with GPT-5. No size check here: callers gate images locally
+    (_is_image_worth_analyzing, see analyze_image_cached) before any upload or call.
+    """
+    logging.info(f'-----------------Analyzing image URL: {_describe_image_url(image_url)}')
 
 
 
@@ -681,24 +736,25 @@ def analyze_image(image_url: str) -> str:
         client = cfg["client"]
         deployment = cfg["deployment"]
         model_name = cfg["model_name"]
-        with open('./ai/gpt5_img_prompt.txt', 'r') as f:
-            prompt = f.read()
+        prompt = get_prompt(IMAGE_PROMPT).text
     except Exception as exc:
         logging.error("Failed to get GPT-5 client or prompt: %s", exc)
         return f"Failed to get GPT-5 client: {exc}"
 
     try:
         # Message format: system text + user with image_url object (image_url.url)
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": [{"type": "text", "text": prompt}]},
-                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_url}}]}
-            ],
-            max_tokens=16384,
-            stop=None,
-            stream=False,
-            model=deployment
-        )
+        # process-wide cap on concurrent vision calls (attachments x pages run in parallel)
+        with _vision_slots():
+            response = client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": [{"type": "text", "text": prompt}]},
+                    {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_url}}]}
+                ],
+                max_tokens=16384,
+                stop=None,
+                stream=False,
+                model=deployment
+            )
     except Exception as exc:
         logging.error("GPT-5 Image chat completion failed: %s", exc)
         return f"GPT-5 Image completion failed: {exc}"
@@ -713,6 +769,66 @@ def analyze_image(image_url: str) -> str:
         
     except Exception:
         return str(response)
+def analyze_image_cached(image_source, to_url=None, near_match: bool = False) -> str:
+    """
+    analyze_image behind the local size gate and the image OCR cache.
+    - image_source: local path, bytes or PIL.Image; hashed for the cache lookup.
+    - near_match: also match near-identical images by perceptual hash; only for embedded assets
+      (logos, signatures) up to IMAGE_CACHE_NEAR_MAX_PIXELS, never for pages or photo/scan attachments.
+    - to_url: callable turning a local file with the prepared image into an HTTPS URL (default
+      ensure_remote_image_url), used on a miss with IMAGE_TRANSPORT=blob or when the image is too
+      large to send inline as a data URL.
+    Every answer except a failed call (is_failed_analysis) is cached; an image PIL cannot decode
+    (e.g. EMF/WMF) is skipped like a logo, GPT-5 does not accept it either.
+    """
+    if not _is_image_worth_analyzing(image_source):
+        return ""
+
+    cache = get_image_cache()
+    keys = None
+    if cache:
+        try:
+            keys = image_hashes(image_source)
+        except Exception as exc:
+            logging.warning(f"Failed to hash image for cache lookup: {exc}")
+        if keys and not _near_match_allowed(image_source, near_match):
+            # exact key only: neither looked up nor stored by perceptual hash
+            keys = (keys[0], None)
+        if keys:
+            cached = cache.lookup(*keys)
+            if cached is not None:
+                logging.info(f"Image cache hit {keys[0]}, stats: {cache.stats()}")
+                return cached
+
+    # downscaled / grayscale / JPEG-WebP re-encoded payload (image_preprocess.py)
+    settings = get_settings()
+    try:
+        payload, mime = prepare_image_payload(image_source)
+    except Exception as exc:
+        logging.warning(f"Image skipped, cannot be decoded for GPT-5: {exc}")
+        return ""
+    logging.info(f"Image payload: {len(payload)} bytes {mime}")
+    image_url = None
+    if settings.image_transport == "inline":
+        image_url = _to_data_url(payload, mime, settings.image_inline_max_bytes)
+    if image_url is None:
+        # blob transport, or the inline payload is too large
+        with _temp_image_file(payload, mime) as tmp_path:
+            image_url = (to_url or ensure_remote_image_url)(tmp_path)
+    logging.info(f"Image URL for analysis: {_describe_image_url(image_url)}")
+    ocr_text = analyze_image(image_url)
+    if cache and keys and ocr_text and not is_failed_analysis(ocr_text):
+        cache.store_result(*keys, ocr_text)
+    return ocr_text
+
+
+def _near_match_allowed(image_source, near_match: bool) -> bool:
+    if not near_match:
+        return False
+    pixels = image_pixels(image_source)
+    return pixels is not None and pixels <= get_settings().image_cache_near_max_pixels
+
+
 def upload_and_get_sas(account_url: str, blob_name: str, local_file: str, expiry_hours: int = 1) -> str:
 
     """
@@ -733,34 +849,15 @@ def upload_and_get_sas(account_url: str, blob_name: str, local_file: str, expiry
     """
 
     # Check for local dev override
-    account_key = os.getenv("STORAGE_ACCOUNT_KEY")
-    email_attachments_container_name = os.getenv("EMAIL_ATTACHMENTS_CONTAINER")
-
-    if not account_key:
-        try:
-            with open("local.settings.json", "r") as fh:
-                settings = json.load(fh)["Values"]
-            account_key = account_key or settings.get("STORAGE_ACCOUNT_KEY", "")
-            email_attachments_container_name = email_attachments_container_name or settings.get("EMAIL_ATTACHMENTS_CONTAINER", "")
-        except FileNotFoundError:
-            pass
+    settings = get_settings()
+    account_key = settings.storage_account_key
+    email_attachments_container_name = settings.email_attachments_container
 
     if not email_attachments_container_name:
         raise ValueError("EMAIL_ATTACHMENTS_CONTAINER is not configured")
 
-    if account_key:
-        # Use Storage Key (local testing)
-        blob_service_client = BlobServiceClient(account_url=account_url, credential=account_key)
-        user_delegation_key = None  # SAS will be signed with account key
-    else:
-        # Use Managed Identity (Azure environment)
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-        # Create user delegation key for SAS
-        user_delegation_key = blob_service_client.get_user_delegation_key(
-            key_start_time=datetime.utcnow(),
-            key_expiry_time=datetime.utcnow() + timedelta(hours=expiry_hours)
-        )
+    # key auth (local testing) or Managed Identity (Azure)
+    blob_service_client = get_blob_service_client(account_url, account_key)
 
     # Ensure container exists
     container_client = blob_service_client.get_container_client(email_attachments_container_name)
@@ -774,36 +871,8 @@ def upload_and_get_sas(account_url: str, blob_name: str, local_file: str, expiry
     with open(local_file, "rb") as data:
         blob_client.upload_blob(data, overwrite=True)
 
-    if blob_service_client.account_name:
-        account_name = blob_service_client.account_name
-    else:
-        account_name = os.getenv("STORAGE_ACCOUNT_NAME")
-    
-    if not account_name:
-        raise ValueError("Storage account name could not be determined")
-    
-    # Generate SAS token
-    if account_key and blob_service_client.account_name:
-        sas_token = generate_blob_sas(
-            account_name=account_name,
-            container_name=email_attachments_container_name,
-            blob_name=blob_name,
-            account_key=account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
-        )
-    else:
-        sas_token = generate_blob_sas(
-            
-            account_name=account_name,
-            container_name=email_attachments_container_name,
-            blob_name=blob_name,
-            user_delegation_key=user_delegation_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
-        )
-
-    return f"{blob_client.url}?{sas_token}"
+    # Generate SAS token (user delegation key cached by the SAS service)
+    return get_sas_service(account_url).blob_sas_url(email_attachments_container_name, blob_name, expiry_hours)
 
 
 
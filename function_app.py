@@ -1,18 +1,167 @@
 import azure.functions as func
+import hashlib
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Set, Tuple
+from urllib.parse import urlencode, urlparse
 # import pyodbc
-# import os
 # import uuid
 # from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions  # added imports
-from extract_text import extract_file_info, analyze_text
+from extract_text import extract_file_info, analyze_document_text, analyze_text, remote_content_key
+from settings import get_settings
+from cache import get_attachment_cache
+from image_cache import get_image_cache
+from pdf_extract import table_stats
+from sas import get_sas_service, parse_blob_uri, redact_url
+from jobs import FAILED, FINISHED, QUEUED, RUNNING, SUCCEEDED, JobConflictError, get_job_store
+from idempotency import COMPUTED, email_idempotency_key, get_email_deduplicator
+from analysis_results import is_failed_analysis
+from persistence import ClaimsStore, build_email_result, get_claims_store
+from claim_rules import classifier_stats, find_claim_reference, merge_analyses
 
 
 # Initialize the Function App with proper configuration
 app = func.FunctionApp()
 
+# Load configuration once at worker startup; hot paths read the cached object.
+get_settings()
+
+# Upper bound of attachments processed concurrently for a single email.
+# Each attachment is mostly network bound (download, GPT-5 vision/text calls), so threads are enough.
+DEFAULT_ATTACHMENT_PARALLELISM = 4
+
+# Storage queue feeding process_email_job (process_email_async); AzureWebJobsStorage, Azurite locally.
+EMAIL_JOBS_QUEUE = "email-jobs"
+STORAGE_CONNECTION = "AzureWebJobsStorage"
+# seconds callers are asked to wait between status polls
+JOB_POLL_INTERVAL = 10
+# messages still failing after host.json extensions.queues.maxDequeueCount deliveries are moved here
+EMAIL_JOBS_POISON_QUEUE = EMAIL_JOBS_QUEUE + "-poison"
+
+
+def _attachment_parallelism(data: Dict[str, Any]) -> int:
+    """
+    Resolve the parallelism limit for one email.
+    - 'maxParallelism' in the request body wins (per-email override).
+    - Otherwise the ATTACHMENT_MAX_PARALLELISM setting (default DEFAULT_ATTACHMENT_PARALLELISM).
+    """
+    try:
+        limit = int(data.get('maxParallelism') or get_settings().attachment_max_parallelism)
+    except (TypeError, ValueError):
+        limit = DEFAULT_ATTACHMENT_PARALLELISM
+    return max(1, limit)
+
+
+def _presign_attachments(attachment_uris: List[str]) -> List[str]:
+    """
+    SAS URLs for all '/container/blob' attachment URIs, signed in one batch (at most one user
+    delegation key lookup per email). Other inputs, or all of them if signing fails, are returned as-is.
+    """
+    blob_uris = [att for att in attachment_uris if att.startswith('/')]
+    if not blob_uris:
+        return list(attachment_uris)
+    try:
+        urls = get_sas_service().blob_sas_urls([parse_blob_uri(att) for att in blob_uris])
+    except Exception as exc:
+        logging.warning(f'--|| Function ||-- Batch SAS signing failed, resolving attachments one by one: {exc}')
+        return list(attachment_uris)
+    signed = dict(zip(blob_uris, urls))
+    return [signed.get(att, att) for att in attachment_uris]
+
+
+def _process_attachment(att: str, source: str = None, failed: Optional[Set[str]] = None) -> Tuple[str, Any]:
+    """
+    Extract a single attachment; source is where to read it from (e.g. a presigned SAS URL), att by default.
+    Never raises: a failure is reported as the attachment result, and its blob name is added to failed.
+    """
+    logging.info(f'--|| Function ||--cycle Processing attachment: {redact_url(att)}')
+    blob_name = att.lstrip('/')  # normalize if path starts with /
+    failures: List[str] = []
+    try:
+        image_processing_result = extract_file_info(source or att, failures=failures)
+        # a plain-text model answer is a result, only a failed GPT-5 call degrades the email
+        if is_failed_analysis(image_processing_result):
+            failures.append("analysis")
+    except Exception as exc:
+        logging.error(f'--|| Function ||-- Failed to process attachment {redact_url(att)}: {exc}', exc_info=True)
+        image_processing_result = {"error": f"Failed to process attachment: {exc}"}
+        failures.append("extraction")
+    if failures and failed is not None:
+        failed.add(blob_name)
+    logging.info(f'--|| Function ||-- cycle extracted result for attachment {redact_url(att)}: {image_processing_result}')
+    return blob_name, image_processing_result
+
+
+def process_attachments(attachment_uris: List[str], max_parallelism: int = DEFAULT_ATTACHMENT_PARALLELISM,
+                        known: Optional[Dict[str, Any]] = None, failed: Optional[Set[str]] = None) -> List[Tuple[str, Any]]:
+    """
+    Run extract_file_info for all attachments with at most max_parallelism in flight.
+    known maps blob names to results from an earlier run; those attachments are not processed again.
+    Blob names of attachments whose extraction or analysis failed are added to failed.
+    Results are returned in the same order as attachment_uris.
+    """
+    known = known or {}
+    pending = [att for att in attachment_uris if att.lstrip('/') not in known]
+    if pending:
+        sources = _presign_attachments(pending)
+        workers = max(1, min(max_parallelism, len(pending)))
+        if workers == 1:
+            extracted = [_process_attachment(att, source, failed) for att, source in zip(pending, sources)]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attachment") as pool:
+                # map() yields in submission order, so the output matches pending
+                extracted = list(pool.map(lambda att, source: _process_attachment(att, source, failed),
+                                          pending, sources))
+    else:
+        extracted = []
+    fresh = iter(extracted)
+    return [(att.lstrip('/'), known[att.lstrip('/')]) if att.lstrip('/') in known else next(fresh)
+            for att in attachment_uris]
+
+
+def _attachment_content_hashes(attachment_uris: List[str], max_parallelism: int) -> Dict[str, str]:
+    """Blob name -> "md5:<hex>" from the blob properties (no download); blobs without Content-MD5 are left out."""
+    blob_uris = [att for att in attachment_uris if att.startswith('/')]
+    if not blob_uris:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallelism, len(blob_uris))),
+                            thread_name_prefix="attachment-hash") as pool:
+        keys = list(pool.map(remote_content_key, blob_uris))
+    return {att.lstrip('/'): key for att, key in zip(blob_uris, keys) if key}
+
+
+def _prior_results(store: Optional[ClaimsStore], claim_reference: Optional[str], attachment_uris: List[str],
+                   content_hashes: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Extractions of this email's attachments already stored for the claim (ClaimFiles), by blob name.
+    Attachments are matched by content hash only: names such as image001.png or scan.pdf recur across
+    emails with different content, so a blob without Content-MD5 is always processed again.
+    """
+    if store is None or not claim_reference or not attachment_uris:
+        return {}
+    try:
+        prior = store.prior_extractions(claim_reference)
+    except Exception as exc:
+        logging.warning(f'--|| Function ||-- Prior extractions lookup failed for {claim_reference}: {exc}')
+        return {}
+    by_hash: Dict[str, str] = {}
+    for row in prior:  # newest first, keep the latest extraction per hash
+        if row.content_hash:
+            by_hash.setdefault(row.content_hash, row.extracted_text)
+    known = {}
+    for att in attachment_uris:
+        blob_name = att.lstrip('/')
+        text = by_hash.get(content_hashes.get(blob_name))
+        if text is not None:
+            known[blob_name] = text
+    if known:
+        logging.info(f'--|| Function ||-- Claim {claim_reference}: reusing {len(known)} of {len(attachment_uris)} '
+                     f'attachment extraction(s) from ClaimFiles')
+    return known
+
 @app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
 def health_check(req: func.HttpRequest) -> func.HttpResponse:
     """Health check endpoint to verify function app is working"""
@@ -24,6 +173,15 @@ def health_check(req: func.HttpRequest) -> func.HttpResponse:
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "version": "1.0.0"
     }
+    attachment_cache = get_attachment_cache()
+    image_cache = get_image_cache()
+    response_data["caches"] = {
+        "attachments": attachment_cache.stats() if attachment_cache else None,
+        "images": image_cache.stats() if image_cache else None,
+    }
+    response_data["pdf_tables"] = table_stats()
+    response_data["classifier"] = classifier_stats()
+    response_data["email_dedupe"] = get_email_deduplicator().stats()
     
     return func.HttpResponse(
         json.dumps(response_data, indent=2),
@@ -31,65 +189,318 @@ def health_check(req: func.HttpRequest) -> func.HttpResponse:
         mimetype="application/json"
     )
 
+def _validate_email_request(data: Any) -> Optional[str]:
+    """Error message for a request body process_email cannot handle, None if it is valid."""
+    if not isinstance(data, dict):
+        return "Request body must be a JSON object"
+    if not (data.get('sender') or '').strip() or not data.get('emailBlobUri'):
+        return "Required fields: sender, subject, emailBlobUri"
+    return None
+
+
+def _run_email_pipeline(data: Dict[str, Any]) -> Tuple[str, bool]:
+    """
+    Analyze one validated email request: body and attachments in parallel, then the combined summary.
+    Returns (result, complete); complete is False when any attachment or analysis failed.
+    """
+    subject = (data.get('subject') or '').strip()
+    body_text = (data.get('bodyText') or '').strip()
+    email_text = "Subject: " + subject + "\n\n" + "Text: " + body_text
+    attachment_uris: List[str] = data.get('attachmentUris', [])
+    parallelism = _attachment_parallelism(data)
+    # follow-up emails quote the claim reference; resolved locally so stored extractions can be reused
+    claim_reference = find_claim_reference(subject, body_text)
+    store = get_claims_store()
+
+    # The email body analysis does not depend on the attachments: start it right away and let it
+    # run alongside attachment extraction, so the critical path is max(email, attachments) + combine.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="email-analysis") as email_pool:
+        # rule-first like attachments: an email body that is plainly an invoice or quote skips GPT-5
+        email_future = email_pool.submit(lambda: analyze_document_text(email_text)[0])
+
+        content_hashes = _attachment_content_hashes(attachment_uris, parallelism) if store else {}
+        known = _prior_results(store, claim_reference, attachment_uris, content_hashes)
+        #processed.append(("Email:", text))
+        # reused and new attachment results together, so the combined analysis sees all of them
+        failed: Set[str] = set()
+        processed = process_attachments(attachment_uris, parallelism, known, failed)
+
+        # Convert processed list to a single string for analysis
+        processed_text = '\n\n'.join(str(item) for item in processed)
+        logging.info(f'--|| Function ||-- Processed all attachments, text for analysis: {processed_text}')  # Log first 500 chars
+        # a single attachment (or none) needs no second GPT-5 pass over its own analysis
+        resp_att = merge_analyses(result for _, result in processed) or analyze_text(processed_text)
+        print("--|| Function ||-- All Attachments Analysis result: ","/n", resp_att)
+        logging.info(f'--|| Function ||-- All Attachments Analysis result: {resp_att}')
+
+        resp_email = email_future.result()
+    print("--|| Function ||-- Email Analysis result: ","/n", resp_email)
+    logging.info(f'--|| Function ||-- Email Analysis result: {resp_email}')
+
+    resp = merge_analyses((resp_email, resp_att)) \
+        or analyze_text("Email summary: " + resp_email + "\n\n Attachments summary: " + resp_att)
+    logging.info(f'--|| Function ||-- Final combined analysis result: {resp}')
+    complete = not failed and not any(is_failed_analysis(text) for text in (resp_email, resp_att, resp))
+    if store is not None and complete:
+        _persist_email_result(store, data, processed, resp, (resp_email, resp_att),
+                              claim_reference, content_hashes, set(known))
+    elif store is not None:
+        # a stored MessageId is never written again: keep degraded runs out so a resend can still persist
+        logging.warning(f'--|| Function ||-- Incomplete result (failed: {sorted(failed)}), not persisted')
+    return resp, complete
+
+
+def _persist_email_result(store: ClaimsStore, data: Dict[str, Any], processed: List[Tuple[str, Any]], resp: str,
+                          analyses: Tuple[str, ...], claim_reference: Optional[str],
+                          content_hashes: Dict[str, str], reused: set) -> None:
+    """
+    Write the email, per-file results and summary to the claims DB (CLAIMS_DB); attachments reused from
+    ClaimFiles are not stored again. Failures are logged, not raised.
+    """
+    settings = get_settings()
+    try:
+        email = build_email_result(data, processed, resp, analyses,
+                                   model_version=settings.gpt5_model or settings.gpt5_deployment,
+                                   claim_reference=claim_reference, content_hashes=content_hashes, reused=reused)
+        if email is None:
+            logging.warning('--|| Function ||-- No claim reference found, result not persisted')
+            return
+        claim_id, written = store.save_email_result(email)
+        if written:
+            logging.info(f'--|| Function ||-- Persisted email and {len(email.files)} file(s) to claim {claim_id}')
+        else:
+            logging.info(f'--|| Function ||-- Email {email.message_id} already persisted for claim {claim_id}')
+    except Exception as exc:
+        logging.error(f'--|| Function ||-- Failed to persist email result: {exc}', exc_info=True)
+
+
+def run_email_pipeline_once(data: Dict[str, Any]) -> Tuple[str, bool]:
+    """
+    _run_email_pipeline behind the idempotency layer: a repeated email (same MessageId, or same sender,
+    subject, body and attachments) gets the stored result, a concurrent duplicate waits for the running one.
+    Returns (result, complete) like _run_email_pipeline.
+    """
+    key = email_idempotency_key(data)
+    resp, complete, outcome = get_email_deduplicator().run(key, lambda: _run_email_pipeline(data))
+    if outcome != COMPUTED:
+        logging.info(f'--|| Function ||-- Email {key}: reused {outcome} result')
+    return resp, complete
+
+
 @app.route(route="process_email", methods=["POST"])
 def process_email(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('process_email invoked')
     try:
 
         data = req.get_json()
-        sender = (data.get('sender') or '').strip()
-        subject = (data.get('subject') or '').strip()
-        body_text = (data.get('bodyText') or '').strip()
-        email_text = "Subject: " + subject + "\n\n" + "Text: " + body_text
-        email_blob_uri = data.get('emailBlobUri')
-        attachment_uris: List[str] = data.get('attachmentUris', [])
-
-        if not sender or not email_blob_uri:
+        error = _validate_email_request(data)
+        if error:
             return func.HttpResponse(
-                json.dumps({"error": "Required fields: sender, subject, emailBlobUri"}),
+                json.dumps({"error": error}),
                 status_code=400,
                 mimetype="application/json"
             )
 
-        processed = []
-        #processed.append(("Email:", text))
-        for att in attachment_uris:
-            logging.info(f'--|| Function ||--cycle Processing attachment: {att}')
-            blob_name = att.lstrip('/')  # normalize if path starts with /
-            image_processing_result = extract_file_info(att)
-            logging.info(f'--|| Function ||-- cycle extracted result for attachment {att}: {image_processing_result}')
-            processed.append((blob_name, image_processing_result))
+        # functionTimeout (host.json) is sized for the queue worker; bound the synchronous route separately.
+        # On timeout the run continues in the background and its result is kept for a retry (idempotency.py).
+        timeout = get_settings().process_email_timeout_seconds
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="process-email")
+        future = executor.submit(run_email_pipeline_once, data)
+        executor.shutdown(wait=False)
+        try:
+            resp, _ = future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            logging.warning(f'process_email did not finish within {timeout}s')
+            return func.HttpResponse(
+                json.dumps({"error": "Processing timed out",
+                            "details": f"Not finished within {timeout}s, use process_email_async for large emails"}),
+                status_code=504, mimetype="application/json")
 
+        return func.HttpResponse(json.dumps(resp, indent=2), status_code=200, mimetype="application/json")
+    except ValueError as ve:
+        return func.HttpResponse(json.dumps({"error": "Invalid JSON", "details": str(ve)}),
+                                 status_code=400, mimetype="application/json")
+    except Exception as ex:
+        logging.error(f'Unhandled error: {ex}', exc_info=True)
+        return func.HttpResponse(json.dumps({"error": "Internal server error", "details": str(ex)}),
+                                 status_code=500, mimetype="application/json")
 
-        # Convert processed list to a single string for analysis
 
-        processed_text = '\n\n'.join(str(item) for item in processed)
-        logging.info(f'--|| Function ||-- Processed all attachments, text for analysis: {processed_text}')  # Log first 500 chars
-        resp_att = analyze_text(processed_text)
-        print("--|| Function ||-- All Attachments Analysis result: ","/n", resp_att)
-        logging.info(f'--|| Function ||-- All Attachments Analysis result: {resp_att}')
-        resp_email = analyze_text(email_text)
-        print("--|| Function ||-- Email Analysis result: ","/n", resp_email)
-        logging.info(f'--|| Function ||-- Email Analysis result: {resp_email}')
+def _job_status_url(req: func.HttpRequest, job_id: str) -> str:
+    """Absolute status URL for a job; the function key of the request is carried over so pollers can follow it."""
+    parsed = urlparse(req.url)
+    url = f"{parsed.scheme}://{parsed.netloc}/api/email_jobs/{job_id}"
+    code = req.params.get('code')
+    return f"{url}?{urlencode({'code': code})}" if code else url
 
-        resp = analyze_text("Email summary: " + resp_email + "\n\n Attachments summary: " + resp_att)
-        logging.info(f'--|| Function ||-- Final combined analysis result: {resp}')
 
+def _job_pending_response(req: func.HttpRequest, record: Dict[str, Any]) -> func.HttpResponse:
+    """
+    202 with Location and Retry-After: the asynchronous request-reply pattern the Logic App HTTP action
+    follows by polling Location until it gets the final response.
+    """
+    status_url = _job_status_url(req, record["jobId"])
+    body = {"jobId": record["jobId"], "status": record["status"], "statusUrl": status_url,
+            "createdAt": record["createdAt"], "updatedAt": record["updatedAt"]}
+    return func.HttpResponse(json.dumps(body, indent=2), status_code=202, mimetype="application/json",
+                             headers={"Location": status_url, "Retry-After": str(JOB_POLL_INTERVAL)})
 
-        return func.HttpResponse(json.dumps(resp, indent=2), status_code=200, mimetype="application/json")
+
+def _job_response(req: func.HttpRequest, record: Dict[str, Any]) -> func.HttpResponse:
+    job_id = record["jobId"]
+    if record["status"] == SUCCEEDED:
+        return func.HttpResponse(json.dumps(record["result"], indent=2), status_code=200,
+                                 mimetype="application/json", headers={"x-job-id": job_id})
+    if record["status"] == FAILED:
+        return func.HttpResponse(json.dumps({"error": "Job failed", "details": record["error"], "jobId": job_id}),
+                                 status_code=500, mimetype="application/json")
+    return _job_pending_response(req, record)
+
+
+@app.route(route="process_email_async", methods=["POST"])
+@app.queue_output(arg_name="jobs", queue_name=EMAIL_JOBS_QUEUE, connection=STORAGE_CONNECTION)
+def process_email_async(req: func.HttpRequest, jobs: func.Out[str]) -> func.HttpResponse:
+    """Validate and enqueue the email, answer 202 with the job ID right away; process_email_job does the work."""
+    logging.info('process_email_async invoked')
+    try:
+        data = req.get_json()
     except ValueError as ve:
         return func.HttpResponse(json.dumps({"error": "Invalid JSON", "details": str(ve)}),
                                  status_code=400, mimetype="application/json")
+    error = _validate_email_request(data)
+    if error:
+        return func.HttpResponse(json.dumps({"error": error}), status_code=400, mimetype="application/json")
+    try:
+        # the job ID is derived from the idempotency key, so a retried or re-delivered email maps to its
+        # existing job (on every instance with JOB_STORE=blob) instead of queueing the work again
+        job_id = hashlib.sha256(email_idempotency_key(data).encode("utf-8")).hexdigest()[:32]
+        store = get_job_store()
+        # the request lives in the job store, the queue message only carries the ID (64 KB message limit)
+        record, created = store.create(job_id, data)
+        if not created:
+            # a stale queued/running job is reported as failed here, so it is queued again below
+            record = _fail_stale_job(job_id, record)
+        # failed jobs and degraded successes (an attachment or analysis failed) are run again
+        if not created and (record["status"] == FAILED
+                            or (record["status"] == SUCCEEDED and not record.get("complete", True))):
+            try:
+                # conditional: of concurrent resubmissions only the first re-queues the job
+                record = store.update(job_id, expected_version=record.get("version", 0), status=QUEUED,
+                                      request=data, result=None, error=None, complete=None)
+                created = True
+            except JobConflictError:
+                record = store.get(job_id)
+        if created:
+            jobs.set(json.dumps({"jobId": job_id}))
+        else:
+            logging.info(f'--|| Function ||-- Email job {job_id} already {record["status"]}, not queued again')
     except Exception as ex:
-        logging.error(f'Unhandled error: {ex}', exc_info=True)
+        logging.error(f'Failed to enqueue email job: {ex}', exc_info=True)
         return func.HttpResponse(json.dumps({"error": "Internal server error", "details": str(ex)}),
                                  status_code=500, mimetype="application/json")
-    
+    if created:
+        logging.info(f'--|| Function ||-- Email job {job_id} queued')
+    return _job_response(req, record)
 
 
+@app.queue_trigger(arg_name="msg", queue_name=EMAIL_JOBS_QUEUE, connection=STORAGE_CONNECTION)
+def process_email_job(msg: func.QueueMessage) -> None:
+    """
+    Queue worker for process_email_async. Pipeline errors are recorded on the job and not re-raised
+    (a retry would redo all OCR/GPT work); job store failures raise so the message is retried.
+    """
+    job_id = json.loads(msg.get_body().decode("utf-8"))["jobId"]
+    store = get_job_store()
+    record = store.get(job_id)
+    if record is None:
+        logging.error(f'--|| Function ||-- Email job {job_id} not found, dropping message')
+        return
+    if record["status"] in FINISHED:
+        logging.info(f'--|| Function ||-- Email job {job_id} already {record["status"]}, skipping redelivery')
+        return
+    try:
+        # conditional: a duplicate message for the same job, delivered concurrently, leaves it to the other worker
+        store.update(job_id, expected_version=record.get("version", 0), status=RUNNING, attempts=msg.dequeue_count)
+    except JobConflictError:
+        logging.info(f'--|| Function ||-- Email job {job_id} changed since it was read, left to its other message')
+        return
+    try:
+        resp, complete = run_email_pipeline_once(record["request"])
+    except Exception as ex:
+        logging.error(f'--|| Function ||-- Email job {job_id} failed: {ex}', exc_info=True)
+        store.update(job_id, status=FAILED, error=str(ex))
+        return
+    store.update(job_id, status=SUCCEEDED, result=resp, complete=complete)
+    logging.info(f'--|| Function ||-- Email job {job_id} succeeded' + ('' if complete else ' with failures'))
+
 
+@app.queue_trigger(arg_name="msg", queue_name=EMAIL_JOBS_POISON_QUEUE, connection=STORAGE_CONNECTION)
+def process_email_job_poison(msg: func.QueueMessage) -> None:
+    """
+    Every delivery of a job message crashed or timed out its worker: mark the job failed so pollers stop
+    and a resubmission queues it again. Jobs that finished in the meantime are left as they are.
+    """
+    job_id = json.loads(msg.get_body().decode("utf-8"))["jobId"]
+    store = get_job_store()
+    record = store.get(job_id)
+    if record is None or record["status"] in FINISHED:
+        return
+    error = f"Worker did not finish after {record.get('attempts') or msg.dequeue_count} attempt(s)"
+    logging.warning(f'--|| Function ||-- Email job {job_id}: {error}')
+    try:
+        store.update(job_id, expected_version=record.get("version", 0), status=FAILED, error=error)
+    except JobConflictError:
+        logging.info(f'--|| Function ||-- Email job {job_id} was updated meanwhile (finished or re-queued), left as is')
 
 
+def _fail_stale_job(job_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Report a job that will not finish as failed: "running" for longer than JOB_STALE_MINUTES lost its worker
+    (crash, timeout), "queued" for longer than JOB_QUEUED_STALE_MINUTES has probably no queue message.
+    Only the stale "running" state is persisted: a queued job may just sit behind a backlog, and its
+    message must still find it queued, so that failure is reported to the caller without being written.
+    """
+    settings = get_settings()
+    if record["status"] == RUNNING:
+        minutes = settings.job_stale_minutes
+        error = f"Worker stopped responding, no update for over {minutes} minutes"
+    elif record["status"] == QUEUED:
+        minutes = settings.job_queued_stale_minutes
+        error = f"Job was not picked up by a worker within {minutes} minutes"
+    else:
+        return record
+    if time.time() - record["updatedAt"] < minutes * 60:
+        return record
+    logging.warning(f'--|| Function ||-- Email job {job_id}: {error}')
+    if record["status"] == QUEUED:
+        return {**record, "status": FAILED, "error": error}
+    try:
+        # persisted, so a resubmitted email queues the job again; unless its worker updated it meanwhile
+        return get_job_store().update(job_id, expected_version=record.get("version", 0), status=FAILED, error=error)
+    except JobConflictError:
+        return get_job_store().get(job_id)
+    except Exception as ex:
+        logging.error(f'Failed to mark stale email job {job_id} as failed: {ex}', exc_info=True)
+        return {**record, "status": FAILED, "error": error}
 
 
+@app.route(route="email_jobs/{job_id}", methods=["GET"])
+def email_job_status(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Poll a job: 202 while queued/running, then the same 200 body process_email returns,
+    or 500 with the error if the job failed, its worker stopped (stale "running" record) or it was
+    never picked up (stale "queued" record).
+    """
+    job_id = req.route_params.get('job_id')
+    try:
+        record = get_job_store().get(job_id)
+    except Exception as ex:
+        logging.error(f'Failed to read email job {job_id}: {ex}', exc_info=True)
+        return func.HttpResponse(json.dumps({"error": "Internal server error", "details": str(ex)}),
+                                 status_code=500, mimetype="application/json")
+    if record is None:
+        return func.HttpResponse(json.dumps({"error": "Job not found", "jobId": job_id}),
+                                 status_code=404, mimetype="application/json")
+    record = _fail_stale_job(job_id, record)
+    return _job_response(req, record)
 
@@ -0,0 +1,158 @@
+"""
+Idempotent email processing.
+
+An email is identified by its MessageId (ClaimEmails.MessageId) or, when the caller does not send
+one, by a hash of sender, subject, body and attachment URIs. The first request for a key runs the
+pipeline; a complete result (every attachment and analysis succeeded) is stored and returned for
+repeats, a degraded one is recomputed next time. Requests for a key that is still being processed
+in this worker wait for that run and share its result instead of redoing the OCR and GPT work.
+
+Stored results (EMAIL_DEDUPE_STORE):
+- "local": the local result cache (cache.py, namespace "emails"); a retry that lands on another
+  instance of a scaled-out app processes the email again.
+- "blob": one JSON blob per key in EMAIL_RESULTS_CONTAINER, shared by all instances.
+Waiting for an in-progress run only works within one worker process in both cases.
+"""
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from cache import get_cache
+from clients import get_blob_service_client
+from settings import get_settings
+
+
+COMPUTED = "computed"
+STORED = "stored"
+SHARED = "shared"
+
+
+def email_idempotency_key(data: Dict[str, Any]) -> str:
+    """"msg:<MessageId>" when the request carries one, else "sha256:<hash of the email content>"."""
+    message_id = str(data.get('messageId') or '').strip()
+    if message_id:
+        return f"msg:{message_id}"
+    content = {
+        "sender": str(data.get('sender') or '').strip().lower(),
+        "subject": str(data.get('subject') or '').strip(),
+        "bodyText": str(data.get('bodyText') or '').strip(),
+        "attachmentUris": list(data.get('attachmentUris') or []),
+    }
+    digest = hashlib.sha256(json.dumps(content, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return f"sha256:{digest.hexdigest()}"
+
+
+class BlobResultStore:
+    """get/put like SqliteLRUCache, one JSON blob per key; nothing is evicted (lifecycle rules may expire blobs)."""
+
+    def __init__(self, container_client):
+        self.container_client = container_client
+        try:
+            container_client.create_container()
+        except Exception:
+            pass  # already exists
+
+    def _blob(self, key: str):
+        # MessageIds carry characters blob names do not allow ("<...@...>")
+        return self.container_client.get_blob_client(hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            return json.loads(self._blob(key).download_blob().readall())
+        except ResourceNotFoundError:
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        self._blob(key).upload_blob(json.dumps(value, ensure_ascii=False), overwrite=True)
+
+
+class EmailDeduplicator:
+    def __init__(self, store):
+        self.store = store
+        self.counts = {COMPUTED: 0, STORED: 0, SHARED: 0}
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+
+    def _stored(self, key: str) -> Optional[Any]:
+        cached = self.store.get(key) if self.store else None
+        return cached["result"] if cached else None
+
+    def run(self, key: str, compute: Callable[[], Tuple[Any, bool]]) -> Tuple[Any, bool, str]:
+        """
+        (result, complete, outcome) for key; outcome tells how it was obtained: STORED (earlier run),
+        SHARED (waited for a concurrent run of the same email) or COMPUTED. compute returns (result,
+        complete); only complete results are stored, so transient failures (429, timeouts,
+        attachment errors) are retried.
+        """
+        result = self._stored(key)
+        if result is not None:
+            return result, True, self._count(STORED)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            logging.info(f"Email {key} is already being processed, waiting for that run")
+            result, complete = future.result()
+            return result, complete, self._count(SHARED)
+
+        try:
+            # a concurrent run may have finished between the lookup and taking ownership
+            result = self._stored(key)
+            complete, outcome = True, STORED
+            if result is None:
+                result, complete = compute()
+                outcome = COMPUTED
+                if self.store and complete:
+                    self.store.put(key, {"result": result})
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        future.set_result((result, complete))
+        return result, complete, self._count(outcome)
+
+    def _count(self, outcome: str) -> str:
+        with self._lock:
+            self.counts[outcome] += 1
+        return outcome
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counts, "in_flight": len(self._in_flight)}
+
+
+_lock = threading.Lock()
+_deduplicator: Optional[EmailDeduplicator] = None
+
+
+def get_email_deduplicator() -> EmailDeduplicator:
+    """Process-wide deduplicator; without the result store (EMAIL_DEDUPE_ENABLED off) only in-flight sharing remains."""
+    global _deduplicator
+    if _deduplicator is None:
+        with _lock:
+            if _deduplicator is None:
+                _deduplicator = EmailDeduplicator(_result_store())
+    return _deduplicator
+
+
+def _result_store():
+    """Result store selected by EMAIL_DEDUPE_STORE ("local" or "blob"), None when dedupe is off."""
+    settings = get_settings()
+    if not settings.email_dedupe_enabled:
+        return None
+    if settings.email_dedupe_store == "blob":
+        blob_service_client = get_blob_service_client(settings.storage_account_blob_endpoint,
+                                                      settings.storage_account_key)
+        return BlobResultStore(blob_service_client.get_container_client(settings.email_results_container))
+    if settings.email_dedupe_store != "local":
+        logging.warning(f"Unknown EMAIL_DEDUPE_STORE {settings.email_dedupe_store!r}, using local")
+    return get_cache("emails", True, settings.email_result_cache_max_mb)
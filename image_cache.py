@@ -0,0 +1,165 @@
+"""
+OCR/caption cache in front of analyze_image.
+
+DOCX attachments keep repeating the same logos, signatures and letterheads across emails.
+Images are looked up by the SHA-256 of their bytes. Small embedded assets (at most
+IMAGE_CACHE_NEAR_MAX_PIXELS) are also matched by a 64-bit difference hash (dHash), so re-encoded
+or slightly resized copies hit as well. Pages, photos and scans are matched exactly only: two
+documents from the same template differ in a few text regions and would be within a few dHash
+bits of each other. Hit/miss counters and an estimate of the GPT-5 tokens saved are kept per
+worker process.
+"""
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from cache import SqliteLRUCache, get_cache
+from prompts import IMAGE_PROMPT, get_prompt
+from settings import get_settings
+from tokens import count_tokens
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash: compares adjacent pixels of a (hash_size+1)x(hash_size) grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_pixels(image_source) -> Optional[int]:
+    """Pixel area of a local path, bytes or PIL.Image (header only), None when it cannot be read."""
+    try:
+        if isinstance(image_source, Image.Image):
+            width, height = image_source.size
+        else:
+            with Image.open(image_source if isinstance(image_source, str) else BytesIO(image_source)) as img:
+                width, height = img.size
+    except Exception:
+        return None
+    return width * height
+
+
+def image_hashes(image_source) -> Tuple[str, Optional[int]]:
+    """
+    Return (exact_key, perceptual_hash) for a local path, bytes or PIL.Image.
+    The perceptual hash is None when the bytes cannot be decoded as an image.
+    """
+    if isinstance(image_source, Image.Image):
+        # hash the decoded pixels, PIL images have no stable encoded form; mode and size go into the
+        # digest, the same bytes are a different image in another mode or shape (100x50 vs 50x100)
+        digest = hashlib.sha256(f"{image_source.mode}:{image_source.size[0]}x{image_source.size[1]}:".encode())
+        digest.update(image_source.tobytes())
+        exact = digest.hexdigest()
+        return f"sha256:{exact}", dhash(image_source)
+    if isinstance(image_source, str):
+        with open(image_source, "rb") as fh:
+            data = fh.read()
+    else:
+        data = bytes(image_source)
+    exact_key = f"sha256:{hashlib.sha256(data).hexdigest()}"
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return exact_key, dhash(img)
+    except Exception as exc:
+        logging.debug("Perceptual hash unavailable: %s", exc)
+        return exact_key, None
+
+
+class ImageOCRCache:
+    def __init__(self, store: SqliteLRUCache, max_distance: int = 4, model_name: str = ""):
+        self.store = store
+        self.max_distance = max_distance
+        self.model_name = model_name
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+        # perceptual hash -> exact key, loaded once and kept in sync on store()
+        self._phashes: Dict[int, str] = {int(aux, 16): key for key, aux in store.aux_entries()}
+
+    def lookup(self, exact_key: str, phash: Optional[int]) -> Optional[str]:
+        """Cached OCR text for an identical or near-identical image, or None."""
+        cached = self.store.get(exact_key)
+        if cached is not None:
+            self._record_hit(cached["ocr_text"], near=False)
+            return cached["ocr_text"]
+        if phash is not None:
+            for candidate, key in self._nearest(phash):
+                cached = self.store.get(key)
+                if cached is None:
+                    # evicted from the store, forget it
+                    with self._lock:
+                        self._phashes.pop(candidate, None)
+                    continue
+                logging.info(f"Image cache near hit (distance {bin(candidate ^ phash).count('1')}) for {exact_key}")
+                self._record_hit(cached["ocr_text"], near=True)
+                return cached["ocr_text"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _nearest(self, phash: int):
+        with self._lock:
+            items = list(self._phashes.items())
+        matches = [(bin(candidate ^ phash).count("1"), candidate, key) for candidate, key in items]
+        return [(candidate, key) for distance, candidate, key in sorted(matches) if distance <= self.max_distance]
+
+    def _record_hit(self, ocr_text: str, near: bool) -> None:
+        # lower bound: image prompt + answer; the image input tokens themselves are not known here
+        saved = count_tokens(self.model_name, ocr_text)
+        try:
+            saved += get_prompt(IMAGE_PROMPT).token_count(self.model_name)
+        except OSError:
+            pass
+        with self._lock:
+            if near:
+                self.near_hits += 1
+            else:
+                self.exact_hits += 1
+            self.tokens_saved += saved
+
+    def store_result(self, exact_key: str, phash: Optional[int], ocr_text: str) -> None:
+        aux = format(phash, "016x") if phash is not None else None
+        self.store.put(exact_key, {"ocr_text": ocr_text}, aux=aux)
+        if phash is not None:
+            with self._lock:
+                self._phashes[phash] = exact_key
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+                "estimated_tokens_saved": self.tokens_saved,
+            }
+
+
+_lock = threading.Lock()
+_image_cache: Optional[ImageOCRCache] = None
+
+
+def get_image_cache() -> Optional[ImageOCRCache]:
+    """Process-wide image OCR cache, None when disabled or unavailable."""
+    global _image_cache
+    if _image_cache is None:
+        settings = get_settings()
+        store = get_cache("images", settings.image_cache_enabled, settings.image_cache_max_mb)
+        if store is None:
+            return None
+        with _lock:
+            if _image_cache is None:
+                _image_cache = ImageOCRCache(store, settings.image_cache_max_distance, settings.gpt5_model)
+    return _image_cache
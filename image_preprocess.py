@@ -0,0 +1,95 @@
+"""
+Image preprocessing in front of GPT-5 vision calls.
+
+Scanned PDF pages and phone photos are turned upright by their EXIF orientation (the tag does not
+survive re-encoding), downscaled to IMAGE_MAX_EDGE, converted to grayscale
+when they carry no colour information (text pages, receipts) and re-encoded as JPEG/WebP at
+IMAGE_QUALITY. This shrinks payloads from several MB of lossless PNG to a few hundred KB and
+reduces the number of vision tiles GPT-5 bills for.
+"""
+import logging
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image, ImageOps, ImageStat
+
+from settings import get_settings
+
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+EXIF_ORIENTATION = 0x0112
+
+
+def is_grayscale_candidate(img: Image.Image, max_saturation: float) -> bool:
+    """True when the mean HSV saturation of a thumbnail is low, i.e. the image is effectively monochrome."""
+    if img.mode in ("L", "1", "LA"):
+        return True
+    thumb = img.convert("RGB")
+    thumb.thumbnail((128, 128))
+    saturation = ImageStat.Stat(thumb.convert("HSV")).mean[1]
+    return saturation <= max_saturation
+
+
+def preprocess_image(img: Image.Image) -> Tuple[bytes, str]:
+    """
+    Rotate upright (EXIF orientation), downscale, optionally convert to grayscale, and re-encode
+    an image for a vision call. Returns (encoded bytes, mime type).
+    """
+    settings = get_settings()
+    fmt = settings.image_format.upper()
+    if fmt not in MIME_TYPES:
+        logging.warning(f"Unsupported IMAGE_FORMAT {settings.image_format!r}, using JPEG")
+        fmt = "JPEG"
+
+    # phone photos store the rotation as a tag; apply it before the pixels are re-encoded without it
+    out = ImageOps.exif_transpose(img)
+    if max(out.size) > settings.image_max_edge:
+        out = out.copy()
+        out.thumbnail((settings.image_max_edge, settings.image_max_edge), Image.LANCZOS)
+    if is_grayscale_candidate(out, settings.image_grayscale_max_saturation):
+        out = out.convert("L")
+    elif out.mode != "RGB":
+        out = out.convert("RGB")
+
+    buffer = BytesIO()
+    if fmt == "PNG":
+        out.save(buffer, format=fmt, optimize=True)
+    else:
+        out.save(buffer, format=fmt, quality=settings.image_quality, optimize=True)
+    return buffer.getvalue(), MIME_TYPES[fmt]
+
+
+def prepare_image_payload(image_source) -> Tuple[bytes, str]:
+    """
+    Bytes + mime type to send for a path, bytes or PIL.Image.
+    With IMAGE_PREPROCESS disabled the original encoding is kept (PIL images become PNG).
+    """
+    if isinstance(image_source, Image.Image):
+        img = image_source
+        if not get_settings().image_preprocess:
+            buffer = BytesIO()
+            img.save(buffer, format="PNG")
+            return buffer.getvalue(), "image/png"
+        return preprocess_image(img)
+
+    if isinstance(image_source, str):
+        with open(image_source, "rb") as fh:
+            data = fh.read()
+    else:
+        data = bytes(image_source)
+    with Image.open(BytesIO(data)) as img:
+        original_mime = Image.MIME.get(img.format or "", "")
+        oversized = max(img.size) > get_settings().image_max_edge
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        if not get_settings().image_preprocess:
+            if original_mime in MIME_TYPES.values():
+                return data, original_mime
+            # formats GPT-5 does not accept inline (e.g. TIFF)
+            buffer = BytesIO()
+            img.convert("RGB").save(buffer, format="PNG")
+            return buffer.getvalue(), "image/png"
+        payload, mime = preprocess_image(img)
+    if not oversized and not rotated and len(payload) >= len(data) and original_mime in MIME_TYPES.values():
+        # already compact, upright and in a supported format (e.g. a small JPEG): keep the original
+        return data, original_mime
+    return payload, mime
@@ -0,0 +1,174 @@
+"""
+Job records for asynchronous email processing (process_email_async).
+
+The HTTP endpoint stores the request under a new job ID and queues only that ID (storage queue
+messages are limited to 64 KB), the queue-triggered worker loads the request, runs the pipeline
+and stores the result, and the status endpoint reads the record back. "complete" is False for
+the result of a degraded run (an attachment or analysis failed); resubmitting that email queues
+the job again.
+
+Updates are read-modify-write under optimistic concurrency (a BEGIN IMMEDIATE transaction, the blob
+ETag): the worker, the status endpoint, resubmissions and the poison-queue handler all update jobs.
+Each record carries a version; update(expected_version=...) applies a change only if nobody else
+updated the job since it was read, and raises JobConflictError otherwise.
+
+Two stores with the same interface:
+- "sqlite": a table in the local result cache file (cache.py); single instance / local runs only.
+- "blob": one JSON blob per job in JOBS_CONTAINER, shared by all instances of a scaled-out app.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+from cache import cache_file_path
+from clients import get_blob_service_client
+from settings import get_settings
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+# blob writes lost to a concurrent writer before update() gives up
+UPDATE_ATTEMPTS = 5
+
+
+class JobConflictError(Exception):
+    """The job was updated by someone else since it was read; the conditional update was not applied."""
+
+
+def _new_record(job_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.time()
+    return {"jobId": job_id, "status": QUEUED, "request": request, "result": None, "error": None,
+            "complete": None, "createdAt": now, "updatedAt": now, "version": 0}
+
+
+def _apply_update(record: Dict[str, Any], changes: Dict[str, Any], expected_version: Optional[int]) -> Dict[str, Any]:
+    version = record.get("version", 0)
+    if expected_version is not None and version != expected_version:
+        raise JobConflictError(f"Job {record['jobId']} is at version {version}, expected {expected_version}")
+    record.update(changes, updatedAt=time.time(), version=version + 1)
+    return record
+
+
+class SqliteJobStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS email_jobs (job_id TEXT PRIMARY KEY, record TEXT NOT NULL)")
+
+    def create(self, job_id: str, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Create the job, or return the existing record for job_id; the flag tells whether it was created."""
+        record = _new_record(job_id, request)
+        with self._lock:
+            inserted = self._conn.execute("INSERT OR IGNORE INTO email_jobs (job_id, record) VALUES (?, ?)",
+                                          (job_id, json.dumps(record, ensure_ascii=False))).rowcount
+        if not inserted:
+            return self.get(job_id), False
+        return record, True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM email_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id: str, expected_version: Optional[int] = None, **changes) -> Dict[str, Any]:
+        """Apply changes and return the new record; JobConflictError if expected_version is given and stale."""
+        with self._lock:
+            # IMMEDIATE takes the write lock up front: other worker processes sharing the file wait
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT record FROM email_jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    raise KeyError(job_id)
+                record = _apply_update(json.loads(row[0]), changes, expected_version)
+                self._conn.execute("UPDATE email_jobs SET record = ? WHERE job_id = ?",
+                                   (json.dumps(record, ensure_ascii=False), job_id))
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return record
+
+
+class BlobJobStore:
+    def __init__(self, container_client):
+        self.container_client = container_client
+        try:
+            container_client.create_container()
+        except Exception:
+            pass  # already exists
+
+    def _blob(self, job_id: str):
+        return self.container_client.get_blob_client(f"{job_id}.json")
+
+    def _write(self, record: Dict[str, Any], overwrite: bool = True) -> None:
+        self._blob(record["jobId"]).upload_blob(json.dumps(record, ensure_ascii=False), overwrite=overwrite)
+
+    def create(self, job_id: str, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Create the job, or return the existing record for job_id; the flag tells whether it was created."""
+        record = _new_record(job_id, request)
+        try:
+            self._write(record, overwrite=False)
+        except ResourceExistsError:
+            return self.get(job_id), False
+        return record, True
+
+    def _read(self, job_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(record, ETag) of a job, (None, None) if it does not exist."""
+        try:
+            downloader = self._blob(job_id).download_blob()
+            return json.loads(downloader.readall()), downloader.properties.etag
+        except ResourceNotFoundError:
+            return None, None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._read(job_id)[0]
+
+    def update(self, job_id: str, expected_version: Optional[int] = None, **changes) -> Dict[str, Any]:
+        """Apply changes and return the new record; JobConflictError if expected_version is given and stale."""
+        for _ in range(UPDATE_ATTEMPTS):
+            record, etag = self._read(job_id)
+            if record is None:
+                raise KeyError(job_id)
+            record = _apply_update(record, changes, expected_version)
+            try:
+                self._blob(job_id).upload_blob(json.dumps(record, ensure_ascii=False), overwrite=True,
+                                               etag=etag, match_condition=MatchConditions.IfNotModified)
+                return record
+            except ResourceModifiedError:
+                # written since it was read: read again, so the other change is not overwritten
+                continue
+        raise JobConflictError(f"Job {job_id} kept changing, update not applied after {UPDATE_ATTEMPTS} attempts")
+
+
+_lock = threading.Lock()
+_store = None
+
+
+def get_job_store():
+    """Process-wide job store selected by JOB_STORE ("sqlite" or "blob")."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                settings = get_settings()
+                if settings.job_store == "blob":
+                    blob_service_client = get_blob_service_client(settings.storage_account_blob_endpoint,
+                                                                  settings.storage_account_key)
+                    _store = BlobJobStore(blob_service_client.get_container_client(settings.jobs_container))
+                else:
+                    if settings.job_store != "sqlite":
+                        logging.warning(f"Unknown JOB_STORE {settings.job_store!r}, using sqlite")
+                    _store = SqliteJobStore(cache_file_path())
+    return _store
@@ -0,0 +1,282 @@
+"""
+PDF helpers for extract_file_info.
+
+Each page is classified on its own: pages with a usable text layer are read with pdfplumber
+(split across processes for large documents), the rest go to OCR. Scanned pages are rasterized lazily, a small window of pages at a time, so peak memory stays
+flat regardless of document length and each page can go to OCR as soon as it is rendered.
+OCR of those pages runs on a bounded worker pool and is reassembled in page order.
+
+Documents are given as a local path or an in-memory binary stream (BytesIO). Streams are read
+without touching the disk; the process-pool path and the rasterization of scanned pages (pdftoppm)
+spool them to a temp file.
+"""
+import contextlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pdfplumber
+from pdf2image import convert_from_path
+from PIL import Image
+
+
+PdfSource = Union[str, BinaryIO]
+
+
+def _open_pdf(source: PdfSource):
+    """pdfplumber document for a path or stream; streams are rewound and left open on close."""
+    if not isinstance(source, str):
+        source.seek(0)
+    return pdfplumber.open(source)
+
+
+def _page_count(source: PdfSource) -> int:
+    with _open_pdf(source) as pdf:
+        return len(pdf.pages)
+
+
+@contextlib.contextmanager
+def _spooled_path(source: PdfSource):
+    """Local path for a source: paths as-is, streams written to a temp file removed on exit."""
+    if isinstance(source, str):
+        yield source
+        return
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            tmp.write(chunk)
+    try:
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+
+def _has_table_structure(page) -> bool:
+    """
+    Cheap pre-check before extract_tables(): the default "lines" strategy needs ruling lines,
+    so a page without at least two horizontal and two vertical edges cannot yield a table.
+    """
+    if not page.lines and not page.rects and not page.curves:
+        return False
+    edges = page.edges
+    horizontal = sum(1 for edge in edges if edge["orientation"] == "h")
+    return horizontal >= 2 and len(edges) - horizontal >= 2
+
+
+def _extract_text_layer_range(source: PdfSource, first: int, last: int,
+                              min_chars: int) -> Tuple[Dict[int, str], List, List[int], Dict[str, float]]:
+    """
+    Text layer of pages first..last (1-based, inclusive). Module level so worker processes can run it.
+    The last element holds table-detection counters for this range (see table_stats()).
+    """
+    with _open_pdf(source) as pdf:
+        return _extract_pages(pdf, first, last, min_chars)
+
+
+def _extract_pages(pdf, first: int, last: int,
+                   min_chars: int) -> Tuple[Dict[int, str], List, List[int], Dict[str, float]]:
+    page_texts: Dict[int, str] = {}
+    tables: List = []
+    ocr_page_numbers: List[int] = []
+    stats = {"pages_skipped": 0, "pages_extracted": 0, "extract_seconds": 0.0}
+    for page in pdf.pages[first - 1:last]:
+        text = page.extract_text() or ""
+        if len(text.strip()) < min_chars:
+            ocr_page_numbers.append(page.page_number)
+            # kept as the fallback if OCR of the page comes back empty ("Total due: $1,250")
+            if text.strip():
+                page_texts[page.page_number] = text
+            continue
+        page_texts[page.page_number] = text
+        if not _has_table_structure(page):
+            stats["pages_skipped"] += 1
+            continue
+        start = time.perf_counter()
+        tables.extend(page.extract_tables())
+        stats["pages_extracted"] += 1
+        stats["extract_seconds"] += time.perf_counter() - start
+    return page_texts, tables, ocr_page_numbers, stats
+
+
+_table_stats = {"pages_skipped": 0, "pages_extracted": 0, "extract_seconds": 0.0}
+_table_stats_lock = threading.Lock()
+
+
+def _record_table_stats(stats: Dict[str, float]) -> None:
+    with _table_stats_lock:
+        for key, value in stats.items():
+            _table_stats[key] += value
+
+
+def table_stats() -> Dict[str, float]:
+    """
+    Process-wide counters of the table pre-check: pages skipped, pages where extract_tables() ran,
+    and the estimated time saved (skipped pages x mean extract_tables() time per page).
+    """
+    with _table_stats_lock:
+        stats = dict(_table_stats)
+    mean = stats["extract_seconds"] / stats["pages_extracted"] if stats["pages_extracted"] else 0.0
+    stats["estimated_seconds_saved"] = round(stats["pages_skipped"] * mean, 3)
+    stats["extract_seconds"] = round(stats["extract_seconds"], 3)
+    return stats
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Shared process pool, created on first use so process start-up is paid once per worker."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: forking a multi-threaded function host is unsafe
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def _reset_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def extract_text_layer(source: PdfSource, min_chars: int = 50, workers: int = 1,
+                       parallel_min_pages: int = 0) -> Tuple[Dict[int, str], List, List[int]]:
+    """
+    Read the text layer page by page from a local path or a binary stream.
+    Returns (page_texts, tables, ocr_page_numbers):
+    - page_texts: page number -> text layer; for OCR pages only when they have some (shorter than
+      min_chars) text, which the caller keeps unless OCR returns something
+    - tables: tables of pages with usable text, in page order (not extracted for pages that go to OCR)
+    - ocr_page_numbers: pages with less than min_chars of text, to be rasterized and OCRed
+    With workers > 1 and at least parallel_min_pages pages, page ranges are split across a
+    process pool (pdfplumber is CPU-bound pure Python) and merged in page order; a stream is
+    spooled to a temp file first so the workers can open it.
+    """
+    with _open_pdf(source) as pdf:
+        page_count = len(pdf.pages)
+        serial = workers <= 1 or page_count < max(parallel_min_pages, 2)
+        if serial:
+            page_texts, tables, ocr_page_numbers, stats = _extract_pages(pdf, 1, page_count, min_chars)
+    if not serial:
+        with _spooled_path(source) as local_path:
+            page_texts, tables, ocr_page_numbers, stats = _extract_text_layer_parallel(
+                local_path, page_count, min_chars, workers)
+    _record_table_stats(stats)
+    logging.info(f"PDF text layer: {len(page_texts)} pages with text, {len(ocr_page_numbers)} pages need OCR, "
+                 f"table detection skipped on {stats['pages_skipped']} pages without ruling lines")
+    return page_texts, tables, ocr_page_numbers
+
+
+def _extract_text_layer_parallel(local_path: str, page_count: int, min_chars: int,
+                                 workers: int) -> Tuple[Dict[int, str], List, List[int], Dict[str, float]]:
+    # a few chunks per worker to even out pages of different complexity
+    chunk = max(1, -(-page_count // (workers * 2)))
+    ranges = [(first, min(first + chunk - 1, page_count)) for first in range(1, page_count + 1, chunk)]
+    start = time.perf_counter()
+    try:
+        pool = _get_process_pool(workers)
+        futures = [pool.submit(_extract_text_layer_range, local_path, first, last, min_chars) for first, last in ranges]
+        parts = [future.result() for future in futures]
+    except BrokenProcessPool as exc:
+        logging.warning(f"PDF process pool failed, extracting serially: {exc}")
+        _reset_process_pool()
+        return _extract_text_layer_range(local_path, 1, page_count, min_chars)
+    logging.info(f"PDF text layer of {page_count} pages extracted in {len(ranges)} ranges "
+                 f"on {workers} processes in {time.perf_counter() - start:.2f}s")
+
+    page_texts: Dict[int, str] = {}
+    tables: List = []
+    ocr_page_numbers: List[int] = []
+    stats = {"pages_skipped": 0, "pages_extracted": 0, "extract_seconds": 0.0}
+    # ranges are in page order, so concatenating keeps tables and OCR pages ordered
+    for part_texts, part_tables, part_ocr, part_stats in parts:
+        page_texts.update(part_texts)
+        tables.extend(part_tables)
+        ocr_page_numbers.extend(part_ocr)
+        for key, value in part_stats.items():
+            stats[key] += value
+    return page_texts, tables, ocr_page_numbers, stats
+
+
+def _windows(page_numbers: List[int], window: int) -> Iterator[Tuple[int, int]]:
+    """Group sorted page numbers into (first, last) runs of consecutive pages, at most window long."""
+    start = prev = None
+    for number in page_numbers:
+        if start is not None and number == prev + 1 and number - start < window:
+            prev = number
+            continue
+        if start is not None:
+            yield start, prev
+        start = prev = number
+    if start is not None:
+        yield start, prev
+
+
+def iter_pdf_page_images(source: PdfSource, page_numbers: Optional[Iterable[int]] = None,
+                         dpi: int = 200, window: int = 1) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Yield (page_number, PIL.Image) for the requested pages (1-based, all pages by default),
+    rendered by pdftoppm at most `window` pages per call. A stream is spooled to a temp file for
+    the duration: in-process rendering (pdfplumber to_image / pypdfium2) is not thread-safe, and
+    attachments are extracted on parallel threads.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, _page_count(source) + 1)
+    page_numbers = sorted(set(page_numbers))
+    with _spooled_path(source) as local_path:
+        for first, last in _windows(page_numbers, max(1, window)):
+            images = convert_from_path(local_path, dpi=dpi, first_page=first, last_page=last)
+            logging.info(f"Rasterized PDF pages {first}-{last} at {dpi} DPI")
+            number = first
+            while images:
+                # pop so the window list does not keep already consumed pages alive
+                yield number, images.pop(0)
+                number += 1
+
+
+def ocr_pages(pages: Iterable[Tuple[int, Image.Image]], ocr: Callable[[Image.Image], str],
+              max_workers: int = 4) -> List[Tuple[int, str, float]]:
+    """
+    OCR rendered pages on a worker pool.
+    - pages: (page_number, image) pairs, typically iter_pdf_page_images(); consumed lazily so at most
+      max_workers pages are rendered but not yet OCRed at any time.
+    - ocr: callable returning the page text; a failing page yields "" and does not stop the others.
+    Returns [(page_number, text, seconds)] in page order. Each page image is closed after OCR.
+    """
+    def run(number: int, image: Image.Image) -> Tuple[int, str, float]:
+        start = time.perf_counter()
+        try:
+            text = ocr(image)
+        except Exception as exc:
+            logging.warning(f"OCR failed for PDF page {number}: {exc}")
+            text = ""
+        finally:
+            image.close()
+        elapsed = time.perf_counter() - start
+        logging.info(f"PDF page {number} OCR took {elapsed:.2f}s")
+        return number, text, elapsed
+
+    results: Dict[int, Tuple[int, str, float]] = {}
+    workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-ocr") as pool:
+        in_flight = set()
+        for number, image in pages:
+            if len(in_flight) >= workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                results.update((r[0], r) for r in (f.result() for f in done))
+            in_flight.add(pool.submit(run, number, image))
+        results.update((r[0], r) for r in (f.result() for f in wait(in_flight).done))
+    return [results[number] for number in sorted(results)]
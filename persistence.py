@@ -0,0 +1,388 @@
+"""
+Persistence of processed emails into the claims schema (data/Create DB structure.sql).
+
+One email is written in a single transaction: the policy holder and claim are resolved (created
+if missing), then the ClaimEmails row, all ClaimFiles rows with their extracted text (one
+executemany batch) and the AISummaries row. Connections come from a small pool that lives for
+the worker process.
+
+ClaimFiles.ContentHash ("md5:<hex>" from the blob Content-MD5) lets a follow-up email for the same
+claim reuse earlier extractions instead of processing the attachments again (prior_extractions()).
+
+Backends (CLAIMS_DB):
+- "sqlserver": Azure SQL through pyodbc and SQL_CONNECTION_STRING.
+- "sqlite": a local file with the same tables (CLAIMS_SQLITE_PATH), for local runs and testing.
+- "" (default): persistence disabled.
+"""
+import contextlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from cache import cache_file_path
+from claim_rules import normalize_claim_reference
+from idempotency import email_idempotency_key
+from settings import get_settings
+
+
+NO_VALUE = "None"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS PolicyHolders (
+    PolicyHolderId INTEGER PRIMARY KEY AUTOINCREMENT,
+    FirstName TEXT NOT NULL,
+    LastName TEXT NOT NULL,
+    Email TEXT NOT NULL UNIQUE,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS Claims (
+    ClaimId INTEGER PRIMARY KEY AUTOINCREMENT,
+    PolicyHolderId INTEGER NOT NULL REFERENCES PolicyHolders(PolicyHolderId),
+    ClaimNumber TEXT NOT NULL UNIQUE,
+    Status TEXT DEFAULT 'New',
+    Description TEXT NULL,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS ClaimFiles (
+    FileId INTEGER PRIMARY KEY AUTOINCREMENT,
+    ClaimId INTEGER NOT NULL REFERENCES Claims(ClaimId),
+    FileName TEXT NOT NULL,
+    FileType TEXT,
+    BlobUrl TEXT NOT NULL,
+    ExtractedText TEXT NULL,
+    ContentHash TEXT NULL,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS IX_ClaimFiles_ClaimId ON ClaimFiles (ClaimId);
+CREATE TABLE IF NOT EXISTS ClaimEmails (
+    EmailId INTEGER PRIMARY KEY AUTOINCREMENT,
+    ClaimId INTEGER NOT NULL REFERENCES Claims(ClaimId),
+    Sender TEXT NOT NULL,
+    Subject TEXT,
+    Body TEXT,
+    ReceivedAt TEXT,
+    MessageId TEXT UNIQUE,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS AISummaries (
+    SummaryId INTEGER PRIMARY KEY AUTOINCREMENT,
+    ClaimId INTEGER NOT NULL REFERENCES Claims(ClaimId),
+    SummaryText TEXT NOT NULL,
+    KeyData TEXT NULL,
+    ModelVersion TEXT NULL,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+@dataclass
+class ProcessedFile:
+    file_name: str
+    file_type: str
+    blob_url: str
+    extracted_text: str
+    content_hash: Optional[str] = None
+
+
+@dataclass
+class PriorFile:
+    file_name: str
+    content_hash: Optional[str]
+    extracted_text: str
+
+
+@dataclass
+class EmailResult:
+    claim_number: str
+    sender: str
+    subject: str
+    body: str
+    received_at: Optional[str]
+    message_id: Optional[str]
+    summary_text: str
+    key_data: str
+    model_version: str
+    files: List[ProcessedFile] = field(default_factory=list)
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections; a connection that failed mid-transaction is discarded."""
+
+    def __init__(self, connect: Callable[[], Any], max_size: int = 4):
+        self._connect = connect
+        self._idle: "queue.LifoQueue" = queue.LifoQueue(maxsize=max_size)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[Any]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except Exception:
+            _close_quietly(conn)
+            raise
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception as exc:
+        logging.debug("Failed to close DB connection: %s", exc)
+
+
+class SqlServerBackend:
+    name = "sqlserver"
+
+    def __init__(self, connection_string: str, pool_size: int = 4):
+        import pyodbc  # only needed with CLAIMS_DB=sqlserver
+
+        def connect():
+            conn = pyodbc.connect(connection_string, autocommit=False)
+            return conn
+
+        self.integrity_errors = (pyodbc.IntegrityError,)
+        self.pool = ConnectionPool(connect, pool_size)
+
+    def cursor(self, conn):
+        cursor = conn.cursor()
+        # send executemany parameters as one array instead of a round trip per row
+        cursor.fast_executemany = True
+        return cursor
+
+    def insert_returning_id(self, cursor, table: str, id_column: str, columns: Sequence[str], values: Sequence) -> int:
+        placeholders = ", ".join("?" for _ in columns)
+        cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) OUTPUT INSERTED.{id_column} VALUES ({placeholders})",
+                       values)
+        return int(cursor.fetchone()[0])
+
+
+class SqliteBackend:
+    name = "sqlite"
+    integrity_errors = (sqlite3.IntegrityError,)
+
+    def __init__(self, path: str, pool_size: int = 4):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        def connect():
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            return conn
+
+        with contextlib.closing(connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+            # files created before ClaimFiles.ContentHash existed
+            if "ContentHash" not in {row[1] for row in conn.execute("PRAGMA table_info(ClaimFiles)")}:
+                conn.execute("ALTER TABLE ClaimFiles ADD COLUMN ContentHash TEXT NULL")
+        self.pool = ConnectionPool(connect, pool_size)
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def insert_returning_id(self, cursor, table: str, id_column: str, columns: Sequence[str], values: Sequence) -> int:
+        placeholders = ", ".join("?" for _ in columns)
+        cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", values)
+        return int(cursor.lastrowid)
+
+
+class ClaimsStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def save_email_result(self, email: EmailResult) -> Tuple[int, bool]:
+        """
+        Write the email, its files and the summary in one transaction.
+        Returns (claim_id, written); written is False when the MessageId is already stored.
+        """
+        with self.backend.pool.connection() as conn:
+            cursor = self.backend.cursor(conn)
+            try:
+                if email.message_id:
+                    cursor.execute("SELECT ClaimId FROM ClaimEmails WHERE MessageId = ?", (email.message_id,))
+                    row = cursor.fetchone()
+                    if row:
+                        conn.rollback()
+                        return int(row[0]), False
+                claim_id = self._claim_id(cursor, email)
+                try:
+                    self.backend.insert_returning_id(
+                        cursor, "ClaimEmails", "EmailId",
+                        ("ClaimId", "Sender", "Subject", "Body", "ReceivedAt", "MessageId"),
+                        (claim_id, email.sender, email.subject, email.body, email.received_at, email.message_id))
+                except self.backend.integrity_errors:
+                    # the same MessageId was stored by a concurrent delivery since the check above
+                    conn.rollback()
+                    cursor.execute("SELECT ClaimId FROM ClaimEmails WHERE MessageId = ?", (email.message_id,))
+                    row = cursor.fetchone()
+                    conn.rollback()
+                    if row is None:
+                        raise
+                    return int(row[0]), False
+                if email.files:
+                    cursor.executemany(
+                        "INSERT INTO ClaimFiles (ClaimId, FileName, FileType, BlobUrl, ExtractedText, ContentHash) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(claim_id, f.file_name, f.file_type, f.blob_url, f.extracted_text, f.content_hash)
+                         for f in email.files])
+                cursor.execute(
+                    "INSERT INTO AISummaries (ClaimId, SummaryText, KeyData, ModelVersion) VALUES (?, ?, ?, ?)",
+                    (claim_id, email.summary_text, email.key_data, email.model_version))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return claim_id, True
+
+    def prior_extractions(self, claim_number: str) -> List[PriorFile]:
+        """Stored files of a claim (normalized claim number), newest first; rows of failed extractions are left out."""
+        with self.backend.pool.connection() as conn:
+            cursor = self.backend.cursor(conn)
+            cursor.execute(
+                "SELECT f.FileName, f.ContentHash, f.ExtractedText FROM ClaimFiles f "
+                "JOIN Claims c ON c.ClaimId = f.ClaimId WHERE c.ClaimNumber = ? ORDER BY f.FileId DESC",
+                (claim_number,))
+            rows = cursor.fetchall()
+            conn.rollback()  # end the read transaction before the connection goes back to the pool
+        return [PriorFile(file_name=row[0], content_hash=row[1], extracted_text=row[2])
+                for row in rows if row[2] and "error" not in _parse_analysis(row[2])]
+
+    def _claim_id(self, cursor, email: EmailResult) -> int:
+        claim_id = self._select_id(cursor, "SELECT ClaimId FROM Claims WHERE ClaimNumber = ?", email.claim_number)
+        if claim_id is not None:
+            return claim_id
+        # only the address is known; names are filled in by the claims team
+        holder_id = self._get_or_create(
+            cursor, "SELECT PolicyHolderId FROM PolicyHolders WHERE Email = ?", email.sender,
+            "PolicyHolders", "PolicyHolderId", ("FirstName", "LastName", "Email"),
+            (email.sender.split("@")[0], "", email.sender))
+        return self._get_or_create(
+            cursor, "SELECT ClaimId FROM Claims WHERE ClaimNumber = ?", email.claim_number,
+            "Claims", "ClaimId", ("PolicyHolderId", "ClaimNumber", "Description"),
+            (holder_id, email.claim_number, email.summary_text))
+
+    @staticmethod
+    def _select_id(cursor, select_sql: str, key: str) -> Optional[int]:
+        cursor.execute(select_sql, (key,))
+        row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    def _get_or_create(self, cursor, select_sql: str, key: str, table: str, id_column: str,
+                       columns: Sequence[str], values: Sequence) -> int:
+        """
+        ID of the row with a unique key, inserted if missing. Two emails for a new sender or claim
+        race between the lookup and the insert; the loser's insert fails on the UNIQUE constraint
+        (only that statement is rolled back) and it reads the winner's row instead.
+        """
+        row_id = self._select_id(cursor, select_sql, key)
+        if row_id is not None:
+            return row_id
+        try:
+            return self.backend.insert_returning_id(cursor, table, id_column, columns, values)
+        except self.backend.integrity_errors:
+            row_id = self._select_id(cursor, select_sql, key)
+            if row_id is None:
+                raise
+            logging.info(f"{table} row for {key} created concurrently, using it")
+            return row_id
+
+
+def _parse_analysis(text: Any) -> Dict[str, Any]:
+    try:
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def build_email_result(data: Dict[str, Any], processed: List[Tuple[str, Any]], resp: str,
+                       analyses: Sequence[str] = (), model_version: str = "",
+                       claim_reference: Optional[str] = None, content_hashes: Optional[Dict[str, str]] = None,
+                       reused: Sequence[str] = ()) -> Optional[EmailResult]:
+    """
+    EmailResult for a finished pipeline run, or None when no claim reference was found
+    (every row of the schema hangs off a claim).
+    - processed: (blob name, per-file analysis) as returned by process_attachments
+    - resp: final combined analysis; analyses: further analyses searched for the claim reference;
+      claim_reference: used when none of the analyses has one (e.g. matched in the subject)
+    - content_hashes: blob name -> content hash; reused: blob names already stored for the claim
+    """
+    final = _parse_analysis(resp)
+    claim_number = None
+    for parsed in [final] + [_parse_analysis(text) for text in analyses]:
+        reference = str(parsed.get("ClaimReference") or "").strip()
+        if reference and reference != NO_VALUE:
+            claim_number = reference
+            break
+    claim_number = claim_number or claim_reference
+    if not claim_number:
+        return None
+    # the same spelling as find_claim_reference, so lookups and later emails hit the same claim
+    claim_number = normalize_claim_reference(claim_number)
+    content_hashes = content_hashes or {}
+    files = []
+    for blob_name, analysis in processed:
+        if blob_name in reused:
+            continue
+        file_name = os.path.basename(blob_name)
+        text = analysis if isinstance(analysis, str) else json.dumps(analysis, ensure_ascii=False)
+        files.append(ProcessedFile(file_name=file_name,
+                                   file_type=os.path.splitext(file_name)[1].lstrip(".").lower(),
+                                   blob_url="/" + blob_name.lstrip("/"),
+                                   extracted_text=text,
+                                   content_hash=content_hashes.get(blob_name)))
+    return EmailResult(
+        claim_number=claim_number,
+        sender=(data.get('sender') or '').strip(),
+        subject=(data.get('subject') or '').strip(),
+        body=(data.get('bodyText') or '').strip(),
+        received_at=data.get('timestamp') or datetime.utcnow().isoformat(),
+        # ClaimEmails.MessageId is UNIQUE and SQL Server allows a single NULL: emails without a messageId
+        # are keyed like the idempotency layer ("sha256:<hash of the email content>")
+        message_id=str(data.get('messageId') or '').strip() or email_idempotency_key(data),
+        summary_text=str(final.get("Summary") or resp),
+        key_data=resp,
+        model_version=model_version,
+        files=files,
+    )
+
+
+_lock = threading.Lock()
+_store: Optional[ClaimsStore] = None
+
+
+def get_claims_store() -> Optional[ClaimsStore]:
+    """Process-wide claims store for CLAIMS_DB, None when persistence is disabled or unavailable."""
+    global _store
+    settings = get_settings()
+    if not settings.claims_db:
+        return None
+    if _store is None:
+        with _lock:
+            if _store is None:
+                try:
+                    if settings.claims_db == "sqlserver":
+                        if not settings.sql_connection_string:
+                            raise RuntimeError("SQL_CONNECTION_STRING is required for CLAIMS_DB=sqlserver")
+                        backend = SqlServerBackend(settings.sql_connection_string, settings.claims_db_pool_size)
+                    elif settings.claims_db == "sqlite":
+                        path = settings.claims_sqlite_path or os.path.join(os.path.dirname(cache_file_path()), "claims.sqlite")
+                        backend = SqliteBackend(path, settings.claims_db_pool_size)
+                    else:
+                        raise RuntimeError(f"Unknown CLAIMS_DB {settings.claims_db!r}")
+                except Exception as exc:
+                    logging.error(f"Claims store unavailable: {exc}")
+                    return None
+                _store = ClaimsStore(backend)
+    return _store
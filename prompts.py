@@ -0,0 +1,81 @@
+"""
+Registry of GPT-5 system prompt templates (./ai/*.txt).
+
+Templates are loaded once by absolute path (independent of the working directory) and kept in
+memory together with their token counts, so per-request token accounting only has to encode the
+user text. With PROMPT_RELOAD_ON_CHANGE enabled a template is re-read when its file mtime changes.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict
+
+from settings import APP_ROOT, get_settings
+from tokens import count_tokens
+
+
+PROMPTS_DIR = os.path.join(APP_ROOT, "ai")
+TEXT_PROMPT = "gpt5_prompt.txt"
+IMAGE_PROMPT = "gpt5_img_prompt.txt"
+
+
+@dataclass
+class PromptTemplate:
+    name: str
+    path: str
+    text: str
+    mtime: float
+    _token_counts: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def token_count(self, model_name: str) -> int:
+        """Token count of the template for the model, computed once per model."""
+        count = self._token_counts.get(model_name)
+        if count is None:
+            count = count_tokens(model_name, self.text)
+            self._token_counts[model_name] = count
+        return count
+
+
+_lock = threading.Lock()
+_prompts: Dict[str, PromptTemplate] = {}
+
+
+def _load(name: str) -> PromptTemplate:
+    path = os.path.join(PROMPTS_DIR, name)
+    mtime = os.path.getmtime(path)
+    with open(path, "r", encoding="utf-8") as fh:
+        text = fh.read()
+    prompt = PromptTemplate(name=name, path=path, text=text, mtime=mtime)
+    # precompute for the configured model, the common case for every request
+    prompt.token_count(get_settings().gpt5_model)
+    logging.info(f"Loaded prompt template {path} ({len(text)} chars)")
+    return prompt
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    """
+    Return the cached template from the ai/ folder.
+    Raises FileNotFoundError if the template does not exist.
+    """
+    prompt = stale = _prompts.get(name)
+    if prompt is not None and get_settings().prompt_reload_on_change:
+        try:
+            if os.path.getmtime(prompt.path) != prompt.mtime:
+                prompt = None
+        except OSError:
+            pass  # keep serving the cached copy if the file disappeared
+    if prompt is None:
+        with _lock:
+            # another thread may have loaded it while this one waited for the lock
+            prompt = _prompts.get(name)
+            if prompt is None or prompt is stale:
+                prompt = _load(name)
+                _prompts[name] = prompt
+    return prompt
+
+
+def invalidate_prompts() -> None:
+    """Drop all cached templates; they are reloaded on next use."""
+    with _lock:
+        _prompts.clear()
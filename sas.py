@@ -0,0 +1,146 @@
+"""
+Read-only SAS URLs for blobs, signed locally.
+
+With a storage key (local development, Azurite) tokens are signed with the account key. Without
+one (Managed Identity) they are signed with a user delegation key. Fetching that key is a round
+trip to Entra ID and Storage, so each key is fetched to outlive the requested SAS expiry by
+SAS_DELEGATION_KEY_HOURS and reused until a new SAS would come within SAS_KEY_REFRESH_MINUTES
+of its expiry. Signing itself is a local HMAC, so blob_sas_urls() signs any number of blobs with
+at most one network call.
+
+The blob service client is injected, so the service can be pointed at Azurite
+(http://127.0.0.1:10000/devstoreaccount1 with the well-known dev account key) or at a stand-in
+object that implements get_user_delegation_key() and get_blob_client().
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+from clients import get_blob_service_client
+from settings import get_settings
+
+
+# tolerate clock skew between this host and Storage
+CLOCK_SKEW = timedelta(minutes=5)
+# Storage rejects delegation keys valid for more than 7 days
+MAX_KEY_LIFETIME = timedelta(days=7)
+
+
+class SasService:
+    def __init__(self, blob_service_client, account_key: str = "", account_name: str = "",
+                 key_lifetime_hours: float = 6, refresh_minutes: float = 5):
+        self.blob_service_client = blob_service_client
+        self.account_key = account_key
+        self.account_name = getattr(blob_service_client, "account_name", None) or account_name
+        if not self.account_name:
+            raise ValueError("Storage account name could not be determined")
+        self.key_lifetime = timedelta(hours=key_lifetime_hours)
+        self.refresh_margin = timedelta(minutes=refresh_minutes)
+        self.key_fetches = 0
+        self.tokens_signed = 0
+        self._lock = threading.Lock()
+        self._delegation_key = None
+        self._delegation_key_expiry: Optional[datetime] = None
+
+    def delegation_key(self, valid_until: datetime):
+        """
+        Cached user delegation key that stays valid until at least valid_until + the refresh margin.
+        A new key is fetched only when the cached one would expire earlier; it is requested valid
+        until valid_until + the key lifetime, so it can be reused for that long.
+        """
+        with self._lock:
+            if self._delegation_key is None or self._delegation_key_expiry < valid_until + self.refresh_margin:
+                now = datetime.utcnow()
+                expiry = min(valid_until + max(self.key_lifetime, self.refresh_margin), now + MAX_KEY_LIFETIME)
+                self._delegation_key = self.blob_service_client.get_user_delegation_key(
+                    key_start_time=now - CLOCK_SKEW,
+                    key_expiry_time=expiry
+                )
+                self._delegation_key_expiry = expiry
+                self.key_fetches += 1
+                logging.info(f"Fetched user delegation key valid until {expiry.isoformat()}Z")
+            return self._delegation_key
+
+    def blob_sas_url(self, container_name: str, blob_name: str, expiry_hours: float = 1) -> str:
+        """Read-only SAS URL for one blob."""
+        return self.blob_sas_urls([(container_name, blob_name)], expiry_hours)[0]
+
+    def blob_sas_urls(self, blobs: Iterable[Tuple[str, str]], expiry_hours: float = 1) -> List[str]:
+        """Read-only SAS URLs for (container, blob) pairs, in order; one key lookup for the whole batch."""
+        blobs = list(blobs)
+        expiry = datetime.utcnow() + timedelta(hours=expiry_hours)
+        signing: Dict[str, Any] = {"account_key": self.account_key} if self.account_key \
+            else {"user_delegation_key": self.delegation_key(expiry)}
+        urls = []
+        for container_name, blob_name in blobs:
+            sas_token = generate_blob_sas(
+                account_name=self.account_name,
+                container_name=container_name,
+                blob_name=blob_name,
+                permission=BlobSasPermissions(read=True),
+                expiry=expiry,
+                **signing
+            )
+            blob_url = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name).url
+            urls.append(f"{blob_url}?{sas_token}")
+        with self._lock:
+            self.tokens_signed += len(urls)
+        return urls
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "signing": "account_key" if self.account_key else "user_delegation_key",
+                "key_fetches": self.key_fetches,
+                "tokens_signed": self.tokens_signed,
+                "key_expiry": f"{self._delegation_key_expiry.isoformat()}Z" if self._delegation_key_expiry else None,
+            }
+
+
+def parse_blob_uri(blob_uri: str, default_container: str = "") -> Tuple[str, str]:
+    """Split "/container/path/to/blob" into (container, blob); a single segment uses default_container."""
+    parts = blob_uri.lstrip("/").split("/", 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    if not default_container:
+        raise ValueError(f"Invalid URI path format: {blob_uri}")
+    return default_container, parts[0]
+
+
+def redact_url(url: Any) -> Any:
+    """Loggable form of a URL: the query string (a SAS token grants access) is replaced by "?<redacted>"."""
+    if not isinstance(url, str) or "?" not in url:
+        return url
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(query="<redacted>", fragment=""))
+
+
+_lock = threading.Lock()
+_services: Dict[Tuple[str, str], SasService] = {}
+
+
+def get_sas_service(account_url: Optional[str] = None) -> SasService:
+    """Process-wide SAS service for the account (STORAGE_ACCOUNT_BLOB_ENDPOINT by default)."""
+    settings = get_settings()
+    account_url = (account_url or settings.storage_account_blob_endpoint or "").rstrip("/")
+    if not account_url:
+        raise RuntimeError("Storage account URL not configured. Set STORAGE_ACCOUNT_BLOB_ENDPOINT.")
+    key = (account_url, settings.storage_account_key)
+    service = _services.get(key)
+    if service is None:
+        with _lock:
+            service = _services.get(key)
+            if service is None:
+                service = SasService(
+                    get_blob_service_client(account_url, settings.storage_account_key),
+                    account_key=settings.storage_account_key,
+                    account_name=settings.storage_account_name,
+                    key_lifetime_hours=settings.sas_delegation_key_hours,
+                    refresh_minutes=settings.sas_key_refresh_minutes,
+                )
+                _services[key] = service
+    return service
@@ -0,0 +1,170 @@
+"""
+Typed application settings, loaded once per worker process.
+
+Values come from environment variables (App Settings in Azure). When a variable is not set,
+the "Values" section of local.settings.json is used as a fallback for local runs.
+Call get_settings(reload=True) to pick up changed configuration.
+"""
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Optional
+
+
+LOCAL_SETTINGS_FILE = "local.settings.json"
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _setting(env_name: str, default: Any = "", secret: bool = False):
+    # secrets are kept out of repr() so the settings object can be logged safely
+    return field(default=default, repr=not secret, metadata={"env": env_name})
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Azure OpenAI (GPT-5)
+    gpt5_endpoint: str = _setting("GPT5_ENDPOINT")
+    gpt5_deployment: str = _setting("GPT5_DEPLOYMENT")
+    gpt5_model: str = _setting("GPT5_MODEL")
+    gpt5_key: str = _setting("GPT5_KEY", secret=True)
+    gpt5_api_version: str = _setting("GPT5_API_VERSION", "2024-12-01-preview")
+    # SDK retries (exponential backoff, Retry-After aware) on 429 / 5xx
+    gpt5_max_retries: int = _setting("GPT5_MAX_RETRIES", 5)
+    # in-flight GPT-5 vision calls per worker process, across all attachments and pages
+    vision_max_concurrency: int = _setting("VISION_MAX_CONCURRENCY", 8)
+    # AI Services (Vision)
+    ai_services_endpoint: str = _setting("AI_SERVICES_ENDPOINT")
+    ai_services_key: str = _setting("AI_SERVICES_KEY", secret=True)
+    # Storage
+    storage_account_blob_endpoint: str = _setting("STORAGE_ACCOUNT_BLOB_ENDPOINT")
+    storage_account_key: str = _setting("STORAGE_ACCOUNT_KEY", secret=True)
+    storage_account_name: str = _setting("STORAGE_ACCOUNT_NAME")
+    email_attachments_container: str = _setting("EMAIL_ATTACHMENTS_CONTAINER")
+    # user delegation key (Managed Identity SAS signing, sas.py): how long one key is reused, and how
+    # long it must still outlive a new SAS before a fresh key is fetched
+    sas_delegation_key_hours: int = _setting("SAS_DELEGATION_KEY_HOURS", 6)
+    sas_key_refresh_minutes: int = _setting("SAS_KEY_REFRESH_MINUTES", 5)
+    # attachments are streamed to disk in chunks of this size; blob SDK downloads fetch up to
+    # DOWNLOAD_MAX_CONCURRENCY ranges of a large blob in parallel
+    download_chunk_bytes: int = _setting("DOWNLOAD_CHUNK_BYTES", 4 * 1024 * 1024)
+    download_max_concurrency: int = _setting("DOWNLOAD_MAX_CONCURRENCY", 4)
+    # extract remote attachments from in-memory buffers (no image dirs; scanned PDF pages are still
+    # rendered by pdftoppm from a temp file); attachments above EXTRACT_IN_MEMORY_MAX_BYTES are
+    # spooled to a temp file instead
+    extract_in_memory: bool = _setting("EXTRACT_IN_MEMORY", True)
+    extract_in_memory_max_bytes: int = _setting("EXTRACT_IN_MEMORY_MAX_BYTES", 32 * 1024 * 1024)
+    # Processing
+    attachment_max_parallelism: int = _setting("ATTACHMENT_MAX_PARALLELISM", 4)
+    prompt_reload_on_change: bool = _setting("PROMPT_RELOAD_ON_CHANGE", False)
+    # async processing (process_email_async, jobs.py): "sqlite" for local runs, "blob" when scaled out
+    job_store: str = _setting("JOB_STORE", "sqlite")
+    jobs_container: str = _setting("JOBS_CONTAINER", "emailjobs")
+    # a job still "running" this long after its last update outlived functionTimeout (host.json, 30 min):
+    # its worker crashed or timed out, the status endpoint reports it as failed
+    job_stale_minutes: int = _setting("JOB_STALE_MINUTES", 35)
+    # a job still "queued" this long was probably never enqueued (the record is written first): polls
+    # report it as failed and a resubmission queues it again; the record itself stays queued
+    job_queued_stale_minutes: int = _setting("JOB_QUEUED_STALE_MINUTES", 60)
+    # host.json functionTimeout is raised for the queue worker; the synchronous process_email route
+    # keeps its previous 5 minute bound and answers 504 after this many seconds
+    process_email_timeout_seconds: int = _setting("PROCESS_EMAIL_TIMEOUT_SECONDS", 300)
+    # results of processed emails by MessageId / content hash, returned for repeats (idempotency.py):
+    # "local" keeps them per instance (EMAIL_RESULT_CACHE_MAX_MB), "blob" shares them across a scaled-out app
+    email_dedupe_enabled: bool = _setting("EMAIL_DEDUPE_ENABLED", True)
+    email_dedupe_store: str = _setting("EMAIL_DEDUPE_STORE", "local")
+    email_results_container: str = _setting("EMAIL_RESULTS_CONTAINER", "emailresults")
+    email_result_cache_max_mb: int = _setting("EMAIL_RESULT_CACHE_MAX_MB", 64)
+    # local pre-classifier in front of GPT-5 text analysis (claim_rules.py): distinct invoice/quote
+    # markers needed to classify an attachment without a model call
+    rule_classifier_enabled: bool = _setting("RULE_CLASSIFIER_ENABLED", True)
+    rule_classifier_min_markers: int = _setting("RULE_CLASSIFIER_MIN_MARKERS", 2)
+    # persistence of processed emails into the claims schema (persistence.py): "" = off,
+    # "sqlserver" (pyodbc, SQL_CONNECTION_STRING) or "sqlite" (CLAIMS_SQLITE_PATH, default in RESULT_CACHE_DIR)
+    claims_db: str = _setting("CLAIMS_DB")
+    sql_connection_string: str = _setting("SQL_CONNECTION_STRING", secret=True)
+    claims_sqlite_path: str = _setting("CLAIMS_SQLITE_PATH")
+    claims_db_pool_size: int = _setting("CLAIMS_DB_POOL_SIZE", 4)
+    # Local result caches (cache.py); default dir is <tempdir>/ai-claims-cache
+    cache_dir: str = _setting("RESULT_CACHE_DIR")
+    attachment_cache_enabled: bool = _setting("ATTACHMENT_CACHE_ENABLED", True)
+    attachment_cache_max_mb: int = _setting("ATTACHMENT_CACHE_MAX_MB", 256)
+    image_cache_enabled: bool = _setting("IMAGE_CACHE_ENABLED", True)
+    image_cache_max_mb: int = _setting("IMAGE_CACHE_MAX_MB", 64)
+    # max Hamming distance between 64-bit dHashes to treat two images as the same; only applied to
+    # embedded images (logos, signatures) of at most IMAGE_CACHE_NEAR_MAX_PIXELS, pages match exactly
+    image_cache_max_distance: int = _setting("IMAGE_CACHE_MAX_DISTANCE", 4)
+    image_cache_near_max_pixels: int = _setting("IMAGE_CACHE_NEAR_MAX_PIXELS", 600 * 400)
+    # Local gate for embedded images/pages before any upload or GPT-5 call
+    image_min_bytes: int = _setting("IMAGE_MIN_BYTES", 100_000)
+    image_min_pixels: int = _setting("IMAGE_MIN_PIXELS", 200 * 200)
+    image_min_stddev: float = _setting("IMAGE_MIN_STDDEV", 5.0)
+    # "inline": send images to GPT-5 as base64 data URLs, "blob": upload and send a SAS URL.
+    # Inline payloads above IMAGE_INLINE_MAX_BYTES fall back to the blob upload.
+    image_transport: str = _setting("IMAGE_TRANSPORT", "inline")
+    image_inline_max_bytes: int = _setting("IMAGE_INLINE_MAX_BYTES", 4 * 1024 * 1024)
+    # Preprocessing before vision calls (image_preprocess.py)
+    image_preprocess: bool = _setting("IMAGE_PREPROCESS", True)
+    image_max_edge: int = _setting("IMAGE_MAX_EDGE", 2048)
+    image_format: str = _setting("IMAGE_FORMAT", "JPEG")
+    image_quality: int = _setting("IMAGE_QUALITY", 80)
+    image_grayscale_max_saturation: float = _setting("IMAGE_GRAYSCALE_MAX_SATURATION", 20.0)
+    pdf_raster_dpi: int = _setting("PDF_RASTER_DPI", 150)
+    # scanned PDF pages rendered per pdftoppm call; bounds peak memory
+    pdf_raster_window: int = _setting("PDF_RASTER_WINDOW", 2)
+    # scanned PDF pages OCRed in parallel per document
+    pdf_ocr_concurrency: int = _setting("PDF_OCR_CONCURRENCY", 4)
+    # pdfplumber text/table extraction on a process pool for PDFs with at least PDF_PARALLEL_MIN_PAGES
+    # pages; 0 workers = one per CPU, 1 = always serial
+    pdf_process_workers: int = _setting("PDF_PROCESS_WORKERS", 0)
+    pdf_parallel_min_pages: int = _setting("PDF_PARALLEL_MIN_PAGES", 40)
+
+    @classmethod
+    def load(cls, settings_file: Optional[str] = None) -> "Settings":
+        file_values = _read_local_settings(settings_file)
+        values: Dict[str, Any] = {}
+        for f in fields(cls):
+            env_name = f.metadata["env"]
+            raw = os.getenv(env_name, "").strip() or str(file_values.get(env_name) or "").strip()
+            if not raw:
+                continue
+            if isinstance(f.default, bool):
+                values[f.name] = raw.lower() in ("1", "true", "yes", "on")
+            elif isinstance(f.default, (int, float)):
+                try:
+                    values[f.name] = type(f.default)(raw)
+                except ValueError:
+                    logging.warning(f"Setting {env_name}={raw!r} is not a number, using default {f.default}")
+            else:
+                values[f.name] = raw
+        return cls(**values)
+
+
+def _read_local_settings(settings_file: Optional[str] = None) -> Dict[str, Any]:
+    """Return the "Values" section of local.settings.json (working dir first, then app root)."""
+    candidates = [settings_file] if settings_file else [LOCAL_SETTINGS_FILE, os.path.join(APP_ROOT, LOCAL_SETTINGS_FILE)]
+    for path in candidates:
+        try:
+            with open(path, "r") as fh:
+                return json.load(fh).get("Values", {})
+        except FileNotFoundError:
+            continue
+        except (ValueError, AttributeError) as exc:
+            logging.warning(f"Failed to parse {path}: {exc}")
+            return {}
+    return {}
+
+
+_lock = threading.Lock()
+_settings: Optional[Settings] = None
+
+
+def get_settings(reload: bool = False) -> Settings:
+    """Return the cached Settings, loading them on first use or when reload=True."""
+    global _settings
+    if _settings is None or reload:
+        with _lock:
+            if _settings is None or reload:
+                _settings = Settings.load()
+    return _settings
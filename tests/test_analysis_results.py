@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from analysis_results import is_failed_analysis
+
+
+@pytest.mark.parametrize("text", [
+    "GPT-5 completion failed: Error code: 429",
+    "GPT-5 Image completion failed: Request timed out.",
+    "Failed to get GPT-5 client: DefaultAzureCredential failed to retrieve a token",
+    "Image analysis failed: upload failed",
+])
+def test_failed_calls_are_failures(text):
+    assert is_failed_analysis(text)
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps({"DocumentType": "Invoice", "Summary": "Invoice 4411"}),
+    "I'm sorry, but I can't help with identifying people in images.",
+    "The image shows a water-damaged ceiling.",
+    "",
+    None,
+    {"Summary": "Unsupported file format."},
+])
+def test_model_answers_are_results(text):
+    assert not is_failed_analysis(text)
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+import extract_text
+from claim_rules import (COMBINED, EMPTY, MERGED, RULES, SUMMARY_SOURCE, classifier_stats, classify_document,
+                         find_claim_reference, merge_analyses, normalize_claim_reference)
+from settings import get_settings
+
+
+INVOICE_TEXT = "TAX INVOICE\nInvoice No: 4411\nClaim TPEH123456\nTotal due: $1,250.00"
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    """Enable the classifier with the default marker threshold; returns a setter for other thresholds."""
+    def configure(min_markers=2):
+        monkeypatch.setenv("RULE_CLASSIFIER_ENABLED", "true")
+        monkeypatch.setenv("RULE_CLASSIFIER_MIN_MARKERS", str(min_markers))
+        get_settings(reload=True)
+    configure()
+    yield configure
+    monkeypatch.undo()
+    get_settings(reload=True)
+
+
+def _analysis(**values):
+    return json.dumps(values)
+
+
+def test_invoice_is_classified_locally(rules):
+    result = json.loads(classify_document(INVOICE_TEXT))
+
+    assert result["DocumentType"] == "Invoice"
+    assert result["ClaimReference"] == "TPEH123456"
+    assert result[SUMMARY_SOURCE] == RULES
+    assert "Total due: $1,250.00" in result["Summary"]
+
+
+def test_invoice_and_quote_markers_conflict(rules):
+    assert classify_document(INVOICE_TEXT + "\nQuotation valid until 30 June") is None
+
+
+def test_claim_acknowledgement_goes_to_gpt(rules):
+    text = "We confirm receipt of your claim TPEH123456.\nAmount paid to date: $500.00"
+    assert classify_document(text) is None
+
+
+def test_missing_amount_goes_to_gpt(rules):
+    assert classify_document("TAX INVOICE\nInvoice No: 4411\nTotal due on receipt") is None
+
+
+def test_min_markers_threshold(rules):
+    text = "Invoice No: 4411\nPlease pay $300.00"
+    assert classify_document(text) is None
+
+    rules(min_markers=1)
+    assert json.loads(classify_document(text))["DocumentType"] == "Invoice"
+
+
+def test_merge_rejects_conflicting_document_types(rules):
+    assert merge_analyses([_analysis(DocumentType="Invoice"), _analysis(DocumentType="Quote")]) is None
+
+
+def test_merge_rejects_two_summaries(rules):
+    assert merge_analyses([_analysis(Summary="Invoice 4411"), _analysis(Summary="Photo of damage")]) is None
+
+
+def test_merge_rejects_rule_summary(rules):
+    analyses = [_analysis(DocumentType="Invoice", Summary="Total due: $1,250.00", **{SUMMARY_SOURCE: RULES})]
+    assert merge_analyses(analyses) is None
+
+
+def test_merge_combines_agreeing_analyses(rules):
+    merged = json.loads(merge_analyses([_analysis(DocumentType="Invoice", ClaimReference="TPEH123456"),
+                                        _analysis(ClaimReference="TPEH123456", Summary="Invoice 4411")]))
+
+    assert merged == {"DocumentType": "Invoice", "ClaimReference": "TPEH123456", "Summary": "Invoice 4411"}
+
+
+def test_merge_of_nothing_is_empty(rules):
+    assert json.loads(merge_analyses([])) == {}
+
+
+def test_email_body_takes_the_rule_path(rules, monkeypatch):
+    gpt_calls = []
+    monkeypatch.setattr(extract_text, "analyze_text", lambda text: gpt_calls.append(text) or "{}")
+    body = "Subject: Invoice for claim TPEH123456\n\nText: Invoice No: 4411\nTotal due: $1,250.00"
+
+    analysis, rules_version = extract_text.analyze_document_text(body)
+
+    assert json.loads(analysis)["DocumentType"] == "Invoice" and rules_version is not None
+    extract_text.analyze_document_text("Subject: Water damage\n\nText: Please call me back.")
+    assert len(gpt_calls) == 1
+
+
+def test_stats_count_classifications_and_merges_separately(rules):
+    before = classifier_stats()
+
+    classify_document(INVOICE_TEXT)
+    merge_analyses([])
+    merge_analyses([_analysis(Summary="Invoice 4411")])
+    merge_analyses([_analysis(Summary="Invoice 4411"), _analysis(Summary="Photo of damage")])
+
+    after = classifier_stats()
+    assert {key: after[key] - before[key] for key in (RULES, MERGED, EMPTY, COMBINED)} == \
+        {RULES: 1, MERGED: 1, EMPTY: 1, COMBINED: 1}
+    assert 0.0 <= after["fast_path_ratio"] <= 1.0 and 0.0 < after["merge_ratio"] < 1.0
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Claim TPEH123456 update", "TPEH123456"),
+    ("re: taai-000123", "TAAI000123"),
+    ("Re: TPEH 123456", "TPEH123456"),
+    ("Ref MSFTCL_42/ and TPEH1", "MSFTCL42"),
+    ("No reference here", None),
+    ("TPEHX123", None),
+])
+def test_find_claim_reference(text, expected):
+    assert find_claim_reference(text) == expected
+
+
+def test_find_claim_reference_searches_texts_in_order():
+    assert find_claim_reference(None, "", "Body mentions TEGH77", "TAAI88") == "TEGH77"
+
+
+@pytest.mark.parametrize("reference, expected", [
+    ("tpeh-123", "TPEH123"),
+    ("TPEH 123", "TPEH123"),
+    ("TAAI/000123", "TAAI000123"),
+    ("Claim no. TCCHH_9 (urgent)", "TCCHH9"),
+    ("unknown-ref", "UNKNOWNREF"),
+])
+def test_normalize_claim_reference(reference, expected):
+    assert normalize_claim_reference(reference) == expected
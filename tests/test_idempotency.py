@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from cache import SqliteLRUCache
+from idempotency import COMPUTED, SHARED, STORED, EmailDeduplicator, email_idempotency_key
+
+
+RESULT = '{"Summary": "Invoice 4411"}'
+
+
+class RecordingLock:
+    """The deduplicator's lock, recording which threads released it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.released_by = []
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *exc):
+        self.released_by.append(threading.current_thread().name)
+        self._lock.release()
+
+
+class Pipeline:
+    """Fake email pipeline; blocks until release() when created with block=True."""
+    def __init__(self, complete=True, block=False):
+        self.complete = complete
+        self.calls = 0
+        self._release = threading.Event()
+        if not block:
+            self._release.set()
+
+    def release(self):
+        self._release.set()
+
+    def __call__(self):
+        self.calls += 1
+        assert self._release.wait(5)
+        return RESULT, self.complete
+
+
+@pytest.fixture
+def deduplicator(tmp_path):
+    return EmailDeduplicator(SqliteLRUCache(str(tmp_path / "cache.sqlite"), "emails", 1024 * 1024))
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_concurrent_duplicate_shares_the_running_result(deduplicator):
+    deduplicator._lock = lock = RecordingLock()
+    pipeline = Pipeline(block=True)
+    results = {}
+
+    def run(name):
+        results[name] = deduplicator.run("msg:m1", pipeline)
+
+    first = threading.Thread(target=run, args=("first",), name="first")
+    first.start()
+    _wait_for(lambda: deduplicator.stats()["in_flight"] == 1)
+    second = threading.Thread(target=run, args=("second",), name="second")
+    second.start()
+    # the second caller has taken the in-flight future once it released the lock
+    _wait_for(lambda: "second" in lock.released_by)
+    pipeline.release()
+    first.join(5)
+    second.join(5)
+
+    assert pipeline.calls == 1
+    assert results["first"] == (RESULT, True, COMPUTED)
+    assert results["second"] == (RESULT, True, SHARED)
+    assert deduplicator.stats()["in_flight"] == 0
+
+
+def test_complete_result_is_stored(deduplicator):
+    pipeline = Pipeline()
+
+    assert deduplicator.run("msg:m1", pipeline) == (RESULT, True, COMPUTED)
+    assert deduplicator.run("msg:m1", pipeline) == (RESULT, True, STORED)
+    assert pipeline.calls == 1
+    assert deduplicator.stats()[COMPUTED] == 1 and deduplicator.stats()[STORED] == 1
+
+
+def test_degraded_result_is_recomputed(deduplicator):
+    pipeline = Pipeline(complete=False)
+
+    assert deduplicator.run("msg:m1", pipeline) == (RESULT, False, COMPUTED)
+    pipeline.complete = True
+    assert deduplicator.run("msg:m1", pipeline) == (RESULT, True, COMPUTED)
+    assert deduplicator.run("msg:m1", pipeline)[2] == STORED
+    assert pipeline.calls == 2
+
+
+def test_failed_run_is_not_kept_in_flight(deduplicator):
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        deduplicator.run("msg:m1", fail)
+    assert deduplicator.run("msg:m1", Pipeline()) == (RESULT, True, COMPUTED)
+
+
+def test_idempotency_key():
+    email = {"sender": "Jane.Doe@example.com ", "subject": "Claim", "bodyText": "Hi", "attachmentUris": ["/a.pdf"]}
+
+    assert email_idempotency_key({**email, "messageId": "<abc@example.com>"}) == "msg:<abc@example.com>"
+    assert email_idempotency_key({**email, "messageId": 42}) == "msg:42"
+    assert email_idempotency_key(email) == email_idempotency_key({**email, "sender": "jane.doe@example.com"})
+    assert email_idempotency_key(email) != email_idempotency_key({**email, "attachmentUris": []})
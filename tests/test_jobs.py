@@ -0,0 +1,215 @@
+import json
+
+import azure.functions as func
+import pytest
+
+import function_app
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobConflictError, SqliteJobStore
+from settings import get_settings
+
+
+process_email_async = function_app.process_email_async._function.get_user_function()
+process_email_job = function_app.process_email_job._function.get_user_function()
+email_job_status = function_app.email_job_status._function.get_user_function()
+
+EMAIL = {"sender": "jane.doe@example.com", "subject": "Claim TPEH123456", "bodyText": "Invoice attached",
+         "emailBlobUri": "/emails/1.eml", "messageId": "m1"}
+RESULT = json.dumps({"DocumentType": "Invoice", "ClaimReference": "TPEH123456", "Summary": "Invoice 4411"})
+
+
+class Output:
+    """Stand-in for the queue output binding (func.Out)."""
+    def __init__(self):
+        self.messages = []
+
+    def set(self, value):
+        self.messages.append(value)
+
+
+class Message:
+    """Stand-in for func.QueueMessage with a dequeue count."""
+    def __init__(self, body, dequeue_count=1):
+        self._body = body.encode("utf-8")
+        self.dequeue_count = dequeue_count
+
+    def get_body(self):
+        return self._body
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    job_store = SqliteJobStore(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(function_app, "get_job_store", lambda: job_store)
+    return job_store
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Fake run_email_pipeline_once; set .complete to return a degraded result."""
+    class Pipeline:
+        complete = True
+        calls = 0
+
+        def __call__(self, data):
+            self.calls += 1
+            return RESULT, self.complete
+    fake = Pipeline()
+    monkeypatch.setattr(function_app, "run_email_pipeline_once", fake)
+    return fake
+
+
+@pytest.fixture
+def stale_after(monkeypatch):
+    """Set JOB_STALE_MINUTES / JOB_QUEUED_STALE_MINUTES; 0 makes every running / queued job stale."""
+    def configure(running=35, queued=60):
+        monkeypatch.setenv("JOB_STALE_MINUTES", str(running))
+        monkeypatch.setenv("JOB_QUEUED_STALE_MINUTES", str(queued))
+        get_settings(reload=True)
+    yield configure
+    monkeypatch.undo()
+    get_settings(reload=True)
+
+
+def _submit(data=EMAIL, body=None):
+    output = Output()
+    req = func.HttpRequest("POST", "http://localhost:7071/api/process_email_async",
+                           body=body if body is not None else json.dumps(data).encode("utf-8"))
+    return process_email_async(req, output), output
+
+
+def _poll(job_id):
+    req = func.HttpRequest("GET", f"http://localhost:7071/api/email_jobs/{job_id}", body=b"",
+                           route_params={"job_id": job_id})
+    return email_job_status(req)
+
+
+def _run_worker(output, dequeue_count=1):
+    process_email_job(Message(output.messages[-1], dequeue_count))
+
+
+def test_job_lifecycle(store, pipeline):
+    resp, output = _submit()
+
+    assert resp.status_code == 202
+    body = json.loads(resp.get_body())
+    assert body["status"] == QUEUED
+    assert resp.headers["Location"] == f"http://localhost:7071/api/email_jobs/{body['jobId']}"
+    assert json.loads(output.messages[0]) == {"jobId": body["jobId"]}
+    assert _poll(body["jobId"]).status_code == 202
+
+    _run_worker(output)
+
+    record = store.get(body["jobId"])
+    assert record["status"] == SUCCEEDED and record["complete"] is True
+    polled = _poll(body["jobId"])
+    assert polled.status_code == 200
+    # the same body the synchronous process_email route returns
+    assert polled.get_body().decode("utf-8") == json.dumps(RESULT, indent=2)
+
+
+def test_resubmission_of_running_or_succeeded_job_is_not_queued(store, pipeline):
+    _, output = _submit()
+    resp, again = _submit()
+    assert resp.status_code == 202 and again.messages == []
+
+    _run_worker(output)
+    resp, again = _submit()
+    assert resp.status_code == 200 and again.messages == []
+    assert pipeline.calls == 1
+
+
+def test_resubmission_requeues_failed_job(store, pipeline):
+    resp, output = _submit()
+    job_id = json.loads(resp.get_body())["jobId"]
+    store.update(job_id, status=FAILED, error="GPT-5 completion failed: 429")
+    assert _poll(job_id).status_code == 500
+
+    resp, again = _submit()
+
+    assert resp.status_code == 202 and len(again.messages) == 1
+    assert store.get(job_id)["status"] == QUEUED and store.get(job_id)["error"] is None
+    _run_worker(again)
+    assert store.get(job_id)["status"] == SUCCEEDED
+
+
+def test_resubmission_requeues_incomplete_job(store, pipeline):
+    pipeline.complete = False
+    _, output = _submit()
+    _run_worker(output)
+
+    pipeline.complete = True
+    resp, again = _submit()
+
+    assert resp.status_code == 202 and len(again.messages) == 1
+    _run_worker(again)
+    assert store.get(json.loads(again.messages[0])["jobId"])["complete"] is True
+    assert pipeline.calls == 2
+
+
+def test_stale_running_job_is_failed(store, pipeline, stale_after):
+    resp, output = _submit()
+    job_id = json.loads(resp.get_body())["jobId"]
+    store.update(job_id, status=RUNNING)
+    stale_after(running=0)
+
+    polled = _poll(job_id)
+
+    assert polled.status_code == 500
+    assert store.get(job_id)["status"] == FAILED
+    resp, again = _submit()
+    assert resp.status_code == 202 and len(again.messages) == 1
+
+
+def test_stale_queued_job_is_reported_but_still_processed(store, pipeline, stale_after):
+    resp, output = _submit()
+    job_id = json.loads(resp.get_body())["jobId"]
+    stale_after(queued=0)
+
+    assert _poll(job_id).status_code == 500
+    # not persisted: a message delayed by a backlog still finds the job queued
+    assert store.get(job_id)["status"] == QUEUED
+    _run_worker(output)
+    assert store.get(job_id)["status"] == SUCCEEDED
+
+
+def test_stale_queued_job_is_requeued_on_resubmission(store, pipeline, stale_after):
+    _submit()
+    stale_after(queued=0)
+
+    resp, again = _submit()
+
+    assert resp.status_code == 202 and len(again.messages) == 1
+
+
+def test_poisoned_job_is_failed(store, pipeline):
+    resp, output = _submit()
+    job_id = json.loads(resp.get_body())["jobId"]
+    store.update(job_id, status=RUNNING, attempts=3)
+
+    function_app.process_email_job_poison._function.get_user_function()(Message(output.messages[0]))
+
+    assert store.get(job_id)["status"] == FAILED
+    assert "3 attempt(s)" in store.get(job_id)["error"]
+
+
+def test_conditional_update_rejects_stale_version(store):
+    record, _ = store.create("job", EMAIL)
+    store.update("job", expected_version=record["version"], status=RUNNING)
+
+    with pytest.raises(JobConflictError):
+        store.update("job", expected_version=record["version"], status=QUEUED)
+    assert store.get("job")["status"] == RUNNING
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"x"', b"1"])
+def test_non_object_body_is_rejected(store, body):
+    resp, output = _submit(body=body)
+
+    assert resp.status_code == 400
+    assert output.messages == []
+
+
+def test_non_object_body_is_rejected_by_sync_route():
+    req = func.HttpRequest("POST", "http://localhost:7071/api/process_email", body=b"[]")
+
+    assert function_app.process_email._function.get_user_function()(req).status_code == 400
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+
+import pytest
+
+from persistence import ClaimsStore, SqliteBackend, build_email_result
+
+
+def _analysis(**values):
+    return json.dumps(values)
+
+
+def _email(message_id="m1", sender="jane.doe@example.com", claim_reference="TPEH123", processed=None, **kwargs):
+    data = {"sender": sender, "subject": "Claim update", "bodyText": "Invoice attached",
+            "messageId": message_id, "timestamp": "2025-09-01T10:00:00Z"}
+    resp = _analysis(DocumentType="Invoice", ClaimReference=claim_reference, Summary="Invoice of $1,200 paid.")
+    if processed is None:
+        processed = [("emailattachments/invoice.pdf", _analysis(Summary="Invoice 4411")),
+                     ("emailattachments/photo.jpg", _analysis(Summary="Water damage"))]
+    return build_email_result(data, processed, resp, model_version="gpt-5", **kwargs)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "claims.sqlite")
+
+
+@pytest.fixture
+def store(db_path):
+    return ClaimsStore(SqliteBackend(db_path))
+
+
+def _count(db_path, table):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_save_email_result_writes_all_tables(store, db_path):
+    claim_id, written = store.save_email_result(_email(content_hashes={"emailattachments/invoice.pdf": "md5:aa"}))
+
+    assert written
+    assert {table: _count(db_path, table) for table in
+            ("PolicyHolders", "Claims", "ClaimEmails", "ClaimFiles", "AISummaries")} == \
+        {"PolicyHolders": 1, "Claims": 1, "ClaimEmails": 1, "ClaimFiles": 2, "AISummaries": 1}
+    with sqlite3.connect(db_path) as conn:
+        files = conn.execute("SELECT ClaimId, FileName, FileType, BlobUrl, ContentHash FROM ClaimFiles "
+                             "ORDER BY FileId").fetchall()
+        summary = conn.execute("SELECT SummaryText, ModelVersion FROM AISummaries").fetchone()
+    assert files == [(claim_id, "invoice.pdf", "pdf", "/emailattachments/invoice.pdf", "md5:aa"),
+                     (claim_id, "photo.jpg", "jpg", "/emailattachments/photo.jpg", None)]
+    assert summary == ("Invoice of $1,200 paid.", "gpt-5")
+
+
+def test_same_message_id_is_written_once(store, db_path):
+    first = store.save_email_result(_email())
+    second = store.save_email_result(_email())
+
+    assert first == (first[0], True)
+    assert second == (first[0], False)
+    assert _count(db_path, "ClaimFiles") == 2
+
+
+def test_emails_without_message_id_are_keyed_by_content(store, db_path):
+    first = store.save_email_result(_email(None))
+    second = store.save_email_result(_email("", sender="john.roe@example.com"))
+    repeat = store.save_email_result(_email(None))
+
+    assert first[1] and second[1]
+    assert repeat == (first[0], False)
+    with sqlite3.connect(db_path) as conn:
+        message_ids = [row[0] for row in conn.execute("SELECT MessageId FROM ClaimEmails ORDER BY EmailId")]
+    assert len(message_ids) == 2 and all(m.startswith("sha256:") for m in message_ids)
+
+
+def test_follow_up_email_reuses_claim_and_policy_holder(store, db_path):
+    claim_id, _ = store.save_email_result(_email("m1"))
+    follow_up_id, written = store.save_email_result(_email("m2", claim_reference="tpeh-123"))
+
+    assert written and follow_up_id == claim_id
+    assert _count(db_path, "Claims") == 1
+    assert _count(db_path, "PolicyHolders") == 1
+    assert _count(db_path, "ClaimEmails") == 2
+
+
+def test_concurrently_created_claim_is_reused(store, db_path, monkeypatch):
+    claim_id, _ = store.save_email_result(_email("m1"))
+    # the lookups before the inserts miss, as if another email created the rows in between;
+    # both inserts then hit the UNIQUE constraints and the rows are read again
+    misses = {"FROM Claims": 2, "FROM PolicyHolders": 1}
+    select_id = ClaimsStore._select_id
+
+    def racing_select(cursor, select_sql, key):
+        for table, remaining in misses.items():
+            if table in select_sql and remaining:
+                misses[table] -= 1
+                return None
+        return select_id(cursor, select_sql, key)
+
+    monkeypatch.setattr(ClaimsStore, "_select_id", staticmethod(racing_select))
+
+    follow_up_id, written = store.save_email_result(_email("m2"))
+
+    assert written and follow_up_id == claim_id
+    assert misses == {"FROM Claims": 0, "FROM PolicyHolders": 0}
+    assert _count(db_path, "Claims") == 1
+    assert _count(db_path, "PolicyHolders") == 1
+    assert _count(db_path, "ClaimEmails") == 2
+
+
+def test_prior_extractions_newest_first_without_failures(store):
+    store.save_email_result(_email("m1", content_hashes={"emailattachments/invoice.pdf": "md5:old"}))
+    store.save_email_result(_email("m2", processed=[
+        ("emailattachments/invoice.pdf", _analysis(Summary="Invoice 4411 v2")),
+        ("emailattachments/broken.pdf", {"error": "Failed to process attachment"}),
+    ], content_hashes={"emailattachments/invoice.pdf": "md5:new"}))
+
+    prior = store.prior_extractions("TPEH123")
+
+    assert [(f.file_name, f.content_hash) for f in prior] == \
+        [("invoice.pdf", "md5:new"), ("photo.jpg", None), ("invoice.pdf", "md5:old")]
+
+
+def test_build_email_result_normalizes_claim_number_and_skips_reused():
+    data = {"sender": "a@b.com", "messageId": 42}
+    processed = [("c/new.pdf", _analysis(Summary="new")), ("c/old.pdf", _analysis(Summary="old"))]
+
+    email = build_email_result(data, processed, _analysis(ClaimReference="None", Summary="s"),
+                               analyses=[_analysis(ClaimReference="taai-0042")], reused={"c/old.pdf"})
+
+    assert email.claim_number == "TAAI0042"
+    assert email.message_id == "42"
+    assert [f.file_name for f in email.files] == ["new.pdf"]
+
+
+def test_build_email_result_without_claim_reference():
+    assert build_email_result({"sender": "a@b.com"}, [], _analysis(ClaimReference="None", Summary="s")) is None
+
+
+def test_sqlite_file_without_content_hash_is_migrated(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE ClaimFiles (FileId INTEGER PRIMARY KEY AUTOINCREMENT, ClaimId INTEGER NOT NULL, "
+                     "FileName TEXT NOT NULL, FileType TEXT, BlobUrl TEXT NOT NULL, ExtractedText TEXT NULL)")
+
+    store = ClaimsStore(SqliteBackend(db_path))
+    store.save_email_result(_email(content_hashes={"emailattachments/invoice.pdf": "md5:aa"}))
+
+    assert [f.content_hash for f in store.prior_extractions("TPEH123")] == [None, "md5:aa"]
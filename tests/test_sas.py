@@ -0,0 +1,74 @@
+from urllib.parse import parse_qs, urlsplit
+
+from azure.storage.blob import UserDelegationKey
+
+from sas import SasService
+
+
+class FakeBlobClient:
+    def __init__(self, container, blob):
+        self.url = f"http://127.0.0.1:10000/devstoreaccount1/{container}/{blob}"
+
+
+class FakeBlobServiceClient:
+    """Stand-in for BlobServiceClient: hands out delegation keys and records each request."""
+    account_name = "devstoreaccount1"
+
+    def __init__(self):
+        self.key_requests = []
+
+    def get_user_delegation_key(self, key_start_time, key_expiry_time):
+        self.key_requests.append((key_start_time, key_expiry_time))
+        key = UserDelegationKey()
+        key.signed_oid = "00000000-0000-0000-0000-000000000001"
+        key.signed_tid = "00000000-0000-0000-0000-000000000002"
+        key.signed_start = key_start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_expiry = key_expiry_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_service = "b"
+        key.signed_version = "2021-08-06"
+        key.value = "a2V5LXZhbHVl"
+        return key
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(container, blob)
+
+
+def test_one_key_request_per_batch():
+    client = FakeBlobServiceClient()
+    service = SasService(client, key_lifetime_hours=6, refresh_minutes=5)
+
+    urls = service.blob_sas_urls([("emailattachments", "a.pdf"), ("emailattachments", "b.jpg"), ("tems", "c.png")])
+    service.blob_sas_urls([("emailattachments", "d.docx")])
+
+    assert len(client.key_requests) == 1
+    assert [urlsplit(url).path for url in urls] == ["/devstoreaccount1/emailattachments/a.pdf",
+                                                   "/devstoreaccount1/emailattachments/b.jpg",
+                                                   "/devstoreaccount1/tems/c.png"]
+    assert all(parse_qs(urlsplit(url).query)["sp"] == ["r"] for url in urls)
+    assert service.stats()["key_fetches"] == 1 and service.stats()["tokens_signed"] == 4
+
+
+def test_key_is_reused_until_the_refresh_margin():
+    client = FakeBlobServiceClient()
+    # the first key is requested for the 1 h SAS expiry plus the 1 h key lifetime: about 2 h from now
+    service = SasService(client, key_lifetime_hours=1, refresh_minutes=5)
+    service.blob_sas_urls([("emailattachments", "a.pdf")], expiry_hours=1)
+
+    # a SAS expiring 6 minutes before the key, outside the 5 minute margin, still uses it
+    service.blob_sas_urls([("emailattachments", "a.pdf")], expiry_hours=1.9)
+    assert len(client.key_requests) == 1
+
+    # 3 minutes before the key expiry, within the margin: a new key is fetched
+    service.blob_sas_urls([("emailattachments", "a.pdf")], expiry_hours=1.95)
+    assert len(client.key_requests) == 2
+    assert client.key_requests[1][1] > client.key_requests[0][1]
+
+
+def test_account_key_signing_needs_no_key_request():
+    client = FakeBlobServiceClient()
+    service = SasService(client, account_key="a2V5LXZhbHVl")
+
+    url = service.blob_sas_url("emailattachments", "a.pdf")
+
+    assert client.key_requests == []
+    assert "sig" in parse_qs(urlsplit(url).query)
@@ -0,0 +1,39 @@
+import pytest
+
+import tokens
+from tokens import count_tokens, count_tokens_batch, estimate_tokens
+
+
+TEXTS = ["Invoice No: 4411", "", "Total due: $1,250.00\n" * 50, "Water damage in the kitchen ceiling."]
+
+
+def test_batch_matches_single_counts_in_order():
+    assert count_tokens_batch("gpt-4o", TEXTS) == [count_tokens("gpt-4o", text) for text in TEXTS]
+
+
+def test_texts_above_threshold_are_estimated():
+    long_text = "claim " * 100
+
+    counts = count_tokens_batch("gpt-4o", ["short", long_text], estimate_threshold=100)
+
+    assert counts[0] == count_tokens("gpt-4o", "short")
+    assert counts[1] == estimate_tokens(long_text)
+
+
+def test_only_estimates_skip_the_encoder(monkeypatch):
+    def no_encoder(model_name):
+        raise AssertionError("encoder requested")
+    monkeypatch.setattr(tokens, "_get_encoder", no_encoder)
+
+    assert count_tokens_batch("gpt-4o", ["a" * 20, "b" * 40], estimate_threshold=10) == [5, 10]
+    assert count_tokens_batch("gpt-4o", []) == []
+
+
+@pytest.mark.parametrize("encoder", [None, "broken"])
+def test_falls_back_to_estimates_without_tiktoken(monkeypatch, encoder):
+    class Broken:
+        def encode_batch(self, texts):
+            raise RuntimeError("encoding failed")
+    monkeypatch.setattr(tokens, "_get_encoder", lambda model_name: Broken() if encoder else None)
+
+    assert count_tokens_batch("gpt-4o", TEXTS) == [estimate_tokens(text) for text in TEXTS]
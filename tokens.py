@@ -0,0 +1,109 @@
+"""
+Token accounting for GPT-5 requests.
+
+Encoders are resolved once per model and memoized. Very large texts (e.g. 100-page PDFs) can be
+estimated instead of fully encoded, see TOKEN_ESTIMATE_THRESHOLD.
+"""
+import logging
+import math
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+try:
+    import tiktoken  # optional dependency
+except ImportError:  # pragma: no cover - depends on the environment
+    tiktoken = None
+
+
+DEFAULT_ENCODING = "cl100k_base"
+# Texts longer than this (characters) are estimated instead of encoded; 0 disables the fast path.
+TOKEN_ESTIMATE_THRESHOLD = 200_000
+# Average ~4 characters per token for English text.
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoder(model_name: str):
+    """Return the tiktoken encoder for the model (cl100k_base if unknown), or None without tiktoken."""
+    if tiktoken is None:
+        return None
+    try:
+        if model_name:
+            return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        # fallback encoding if model-specific lookup fails
+        pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap heuristic token count, no encoding."""
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+
+def count_tokens(model_name: str, text: str, estimate_threshold: Optional[int] = None) -> int:
+    """
+    Count tokens for the given text.
+
+    Uses the tiktoken library when available (best accuracy). If tiktoken is not
+    installed or fails, falls back to a simple heuristic estimate (1 token ≈ 4 chars).
+    If a model name is configured (gpt5_model_name or gpt5_deployment) the encoding is
+    picked with tiktoken.encoding_for_model(model) and cached per model.
+    Texts longer than estimate_threshold characters (TOKEN_ESTIMATE_THRESHOLD by default)
+    are estimated with the heuristic instead of being encoded.
+    """
+    threshold = TOKEN_ESTIMATE_THRESHOLD if estimate_threshold is None else estimate_threshold
+    if threshold and len(text) > threshold:
+        return estimate_tokens(text)
+    try:
+        enc = _get_encoder(model_name)
+        if enc is None:
+            return estimate_tokens(text)
+        return len(enc.encode(text))
+    except Exception as exc:
+        logging.debug("tiktoken not available or failed, using heuristic token count: %s", exc)
+        return estimate_tokens(text)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimated input tokens for one image sent with detail=high: the image is fit into 2048x2048,
+    its short side scaled to 768, then billed 170 tokens per 512px tile plus a base of 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def count_tokens_batch(model_name: str, texts: Iterable[str], estimate_threshold: Optional[int] = None) -> List[int]:
+    """
+    Count tokens for many texts in one call (e.g. all pages of a document).
+    Texts under the threshold are encoded together with tiktoken's encode_batch,
+    larger ones are estimated. The result keeps the order of texts.
+    """
+    texts = list(texts)
+    threshold = TOKEN_ESTIMATE_THRESHOLD if estimate_threshold is None else estimate_threshold
+    counts = [0] * len(texts)
+    to_encode = []
+    for i, text in enumerate(texts):
+        if threshold and len(text) > threshold:
+            counts[i] = estimate_tokens(text)
+        else:
+            to_encode.append(i)
+    if not to_encode:
+        return counts
+    try:
+        enc = _get_encoder(model_name)
+        if enc is None:
+            raise RuntimeError("tiktoken is not installed")
+        encoded = enc.encode_batch([texts[i] for i in to_encode])
+        for i, tokens in zip(to_encode, encoded):
+            counts[i] = len(tokens)
+    except Exception as exc:
+        logging.debug("tiktoken not available or failed, using heuristic token count: %s", exc)
+        for i in to_encode:
+            counts[i] = estimate_tokens(texts[i])
+    return counts